@@ -0,0 +1,411 @@
+###############################################################################
+# Imports
+
+from storage import execute_values  # Multi-row inserts
+
+# Run statistics
+from metrics import METRICS
+
+# General utility
+import collections
+
+###############################################################################
+# AS name columns
+
+# (ASN column, AS name column) pairs of every table
+NAME_COLUMNS = {
+    'Outage': (('asn', 'as_name'),),
+    'Hijack': (('original_asn', 'original_as_name'),
+               ('hj_asn', 'hj_as_name')),
+    'Leak': (('original_asn', 'original_as_name'),
+             ('leaking_asn', 'leaking_as_name')),
+    'Leaker': (('asn', 'as_name'),),
+}
+
+# Column of every table with the id of the event, which orders the names
+EVENT_COLUMNS = {
+    'Outage': 'id',
+    'Hijack': 'id',
+    'Leak': 'id',
+    'Leaker': 'leak',
+}
+
+# Advisory lock of the AutonomousSystem table on postgres: shared by the
+# writers that remove names from their rows, exclusive to rename an AS
+AS_NAMES_LOCK = 0x6267707361
+
+
+def as_number(value):
+    """ Returns: 'value' as an ASN, or None if it is not the number of an AS
+        (the outages of a country have the ASN 0)
+    """
+
+    try:
+        asn = int(value)
+    except (TypeError, ValueError):
+        return None
+
+    return asn if asn > 0 else None
+
+###############################################################################
+# AS names
+
+
+class AsNames():
+    """ Write-through cache of the AutonomousSystem table, which holds one
+        name per AS: the one of its newest event, whose id is stored with it.
+        The 'size' most recently used ASes are kept in memory. The rows
+        written while it is attached to a BulkWriter only keep the names that
+        differ from the stored one. With 'locking' (postgres), the writers
+        take an advisory lock on the table so that an AS is not renamed while
+        another writer removes its name from rows
+    """
+
+    def __init__(self, connection, size=100000, locking=False):
+        self.connection = connection
+        self.size = size
+        self.locking = locking
+
+        # {asn: (name, id of the newest event with that name)}, least
+        # recently used first
+        self.names = collections.OrderedDict()
+        self.complete = False
+
+        cursor = connection.cursor()
+        self.generation = self.renames(cursor) if locking else None
+        self.load(cursor)
+
+    ###########################################################################
+
+    def load(self, cursor):
+        """ Replaces the cached ASes with the first 'size' stored ones """
+
+        self.names.clear()
+        cursor.execute('SELECT asn, name, COALESCE(event, 0) '
+                       'FROM AutonomousSystem LIMIT %s;', (self.size,))
+        for asn, name, event in cursor.fetchall():
+            self.names[asn] = (name, event)
+
+        # While every stored AS is in memory, an unknown ASN is not looked up
+        self.complete = len(self.names) < self.size
+
+    ###########################################################################
+
+    def renames(self, cursor):
+        """ Returns: the state of the AsNameRenames sequence, which changes
+            whenever an AS is renamed
+        """
+
+        cursor.execute('SELECT last_value, is_called FROM AsNameRenames;')
+        return cursor.fetchone()
+
+    ###########################################################################
+
+    def lock(self, cursor, exclusive):
+        """ Takes the advisory lock of the table until the end of the
+            transaction, and reloads the cache if an AS was renamed since it
+            was loaded, i.e. by another writer
+            Returns: True if the cache was reloaded
+        """
+
+        if not self.locking:
+            return False
+
+        cursor.execute('SELECT pg_advisory_xact_lock{}(%s);'.format(
+            '' if exclusive else '_shared'), (AS_NAMES_LOCK,))
+
+        generation = self.renames(cursor)
+        if generation == self.generation:
+            return False
+
+        self.generation = generation
+        self.load(cursor)
+        return True
+
+    ###########################################################################
+
+    def lookup(self, cursor, asns):
+        """ Loads the stored names of the 'asns' that are not in memory, with
+            one query
+        """
+
+        missing = []
+        for asn in sorted(asns):
+            if asn in self.names:
+                METRICS.count('cache_hits', cache='as_names')
+                self.names.move_to_end(asn)
+            else:
+                METRICS.count('cache_misses', cache='as_names')
+                missing.append((asn,))
+
+        if not missing or self.complete:
+            return
+
+        rows = execute_values(cursor, 'SELECT asn, name, COALESCE(event, 0) '
+                              'FROM AutonomousSystem WHERE asn IN (VALUES %s)',
+                              missing, page_size=len(missing), fetch=True)
+        for asn, name, event in rows:
+            self.put(asn, name, event)
+
+    ###########################################################################
+
+    def put(self, asn, name, event):
+        self.names[asn] = (name, event)
+        self.names.move_to_end(asn)
+
+        if len(self.names) > self.size:
+            self.names.popitem(last=False)
+            self.complete = False
+
+    ###########################################################################
+
+    def add(self, cursor, names):
+        """ Stores the {asn: (name, event)} 'names' of the ASes that are not
+            stored yet. The ASes stored meanwhile by another writer keep their
+            name
+        """
+
+        values = sorted((asn, name, event)
+                        for asn, (name, event) in names.items())
+        rows = execute_values(cursor, 'INSERT INTO AutonomousSystem '
+                              '(asn, name, event) VALUES %s '
+                              'ON CONFLICT (asn) DO NOTHING '
+                              'RETURNING asn, name, event', values,
+                              page_size=len(values), fetch=True)
+        METRICS.count('as_names_written', len(rows))
+        for asn, name, event in rows:
+            self.put(asn, name, event)
+
+        # The names stored meanwhile by another writer
+        written = {asn for asn, _, _ in rows}
+        stored = [(asn,) for asn, _, _ in values if asn not in written]
+        if stored:
+            rows = execute_values(cursor, 'SELECT asn, name, '
+                                  'COALESCE(event, 0) FROM AutonomousSystem '
+                                  'WHERE asn IN (VALUES %s)', stored,
+                                  page_size=len(stored), fetch=True)
+            for asn, name, event in rows:
+                self.put(asn, name, event)
+
+    ###########################################################################
+
+    def renamed(self, latest):
+        """ Returns: {asn: (name, event)} of the {asn: (name, event)} 'latest'
+            whose event is newer than the one of the cached name, and names
+            the AS differently
+        """
+
+        renamed = {}
+        for asn, (name, event) in latest.items():
+            stored_name, stored_event = self.names.get(asn, (None, None))
+            if stored_name is not None and name != stored_name and \
+                    event > stored_event:
+                renamed[asn] = (name, event)
+
+        return renamed
+
+    ###########################################################################
+
+    def newest(self, cursor, names):
+        """ Returns: {asn: id of the newest stored event that gives the AS
+            the name of the {asn: name} 'names', or leaves it out}, with one
+            query per AS name column
+        """
+
+        newest = collections.defaultdict(int)
+        for table_name, pairs in sorted(NAME_COLUMNS.items()):
+            for asn_column, name_column in pairs:
+                rows = execute_values(
+                    cursor, 'WITH Named (asn, name) AS (VALUES %s) '
+                    'SELECT Named.asn, max({0}) FROM {1} JOIN Named '
+                    'ON {1}.{2} = Named.asn AND ({1}.{3} = Named.name '
+                    'OR {1}.{3} IS NULL) GROUP BY Named.asn'.format(
+                        EVENT_COLUMNS[table_name], table_name, asn_column,
+                        name_column), sorted(names.items()),
+                    page_size=len(names), fetch=True)
+                for asn, event in rows:
+                    newest[asn] = max(newest[asn], event)
+
+        return newest
+
+    ###########################################################################
+
+    def rename(self, cursor, renamed):
+        """ Stores the {asn: (name, event)} 'renamed' names, unless a stored
+            event newer than 'event' still has the old name, in which case
+            only the id of that event is stored. The rows that were stripped
+            of the old name get it back first. Meant to be called while
+            holding the exclusive lock
+        """
+
+        old_names = {asn: self.names[asn][0] for asn in renamed}
+        newest = self.newest(cursor, old_names)
+
+        names, events = [], []
+        for asn, (name, event) in sorted(renamed.items()):
+            if newest[asn] > event:
+                events.append((asn, newest[asn]))
+                self.put(asn, old_names[asn], newest[asn])
+            else:
+                names.append((old_names[asn], name, event, asn))
+
+        if events:
+            execute_values(cursor, 'WITH Newest (asn, event) AS (VALUES %s) '
+                           'UPDATE AutonomousSystem SET event = Newest.event '
+                           'FROM Newest WHERE AutonomousSystem.asn = '
+                           'Newest.asn', events, page_size=len(events))
+
+        if not names:
+            return
+
+        old_names = [(asn, old_name) for old_name, _, _, asn in names]
+        for table_name, pairs in sorted(NAME_COLUMNS.items()):
+            for asn_column, name_column in pairs:
+                execute_values(
+                    cursor, 'WITH Named (asn, name) AS (VALUES %s) '
+                    'UPDATE {0} SET {2} = Named.name FROM Named '
+                    'WHERE {0}.{1} = Named.asn AND {0}.{2} IS NULL'.format(
+                        table_name, asn_column, name_column),
+                    old_names, page_size=len(old_names))
+
+        execute_values(cursor, 'WITH Renamed (asn, name, event) AS '
+                       '(VALUES %s) UPDATE AutonomousSystem '
+                       'SET name = Renamed.name, event = Renamed.event '
+                       'FROM Renamed WHERE AutonomousSystem.asn = Renamed.asn',
+                       [(asn, name, event) for _, name, event, asn in names],
+                       page_size=len(names))
+        METRICS.count('as_names_renamed', len(names))
+
+        # The other writers reload their cache, and so does this one at the
+        # next lock in case the transaction is rolled back
+        if self.locking:
+            cursor.execute("SELECT nextval('AsNameRenames');")
+
+        for _, name, event, asn in names:
+            self.put(asn, name, event)
+
+    ###########################################################################
+
+    def strip(self, cursor, rows):
+        """ Stores the names of the new ASes of the {table_name: [columns,
+            ...]} 'rows', all at once and in the order of their ASN so that
+            concurrent writers cannot deadlock, and the new names of the ASes
+            that a newer event names differently. Then removes from the rows
+            the AS names that are stored in the AutonomousSystem table. Meant
+            to be called right before the rows are inserted, in the same
+            transaction. The names of the rows that are not about an AS are
+            kept
+        """
+
+        # {asn: (name, event)} of the newest event of every AS
+        latest = {}
+        for table_name, table_rows in rows.items():
+            event_column = EVENT_COLUMNS.get(table_name)
+            for asn_column, name_column in NAME_COLUMNS.get(table_name, ()):
+                for columns in table_rows:
+                    asn = as_number(columns.get(asn_column))
+                    name = columns.get(name_column)
+                    event = as_number(columns.get(event_column)) or 0
+                    if asn is not None and name is not None and \
+                            (asn not in latest or event >= latest[asn][1]):
+                        latest[asn] = (name, event)
+
+        if not latest:
+            return
+
+        self.lookup(cursor, latest)
+        exclusive = bool(self.renamed(latest))
+        if self.lock(cursor, exclusive):
+            self.lookup(cursor, latest)
+
+        new = {asn: latest[asn] for asn in latest if asn not in self.names}
+        if new:
+            self.add(cursor, new)
+
+        # A rename that is only seen under the shared lock needs the lock of
+        # the table to itself, without waiting for it, which could deadlock.
+        # Otherwise it waits for the next batch that names the AS that way:
+        # meanwhile the rows keep the name
+        renamed = self.renamed(latest)
+        if renamed and self.locking and not exclusive:
+            cursor.execute('SELECT pg_try_advisory_xact_lock(%s);',
+                           (AS_NAMES_LOCK,))
+            exclusive = cursor.fetchone()[0]
+        if renamed and (exclusive or not self.locking):
+            self.rename(cursor, renamed)
+
+        for table_name, table_rows in rows.items():
+            for asn_column, name_column in NAME_COLUMNS.get(table_name, ()):
+                for columns in table_rows:
+                    asn = as_number(columns.get(asn_column))
+                    name = columns.get(name_column)
+                    if name is not None and asn is not None and \
+                            name == self.names.get(asn, (None,))[0]:
+                        del columns[name_column]
+
+    ###########################################################################
+
+    def attach(self, writer):
+        """ Stores the AS names of the rows written by the BulkWriter 'writer'
+            and removes them from the rows
+        """
+
+        writer.names = self
+
+    ###########################################################################
+
+    def normalize(self):
+        """ Moves the AS names stored in the rows of the events to the
+            AutonomousSystem table. The name of an AS that is not stored yet
+            is its most frequent one, and the rows keep the other names
+            Returns: {table_name: number of rows whose name was removed}
+        """
+
+        cursor = self.connection.cursor()
+        self.lock(cursor, True)
+
+        # {asn: {name: number of rows}}, {(asn, name): newest event}
+        counts = collections.defaultdict(collections.Counter)
+        newest = collections.defaultdict(int)
+        for table_name, pairs in sorted(NAME_COLUMNS.items()):
+            for asn_column, name_column in pairs:
+                cursor.execute(
+                    'SELECT {0}, {1}, count(*), max({3}) FROM {2} '
+                    'WHERE {0} > 0 AND {1} IS NOT NULL '
+                    'GROUP BY {0}, {1};'.format(
+                        asn_column, name_column, table_name,
+                        EVENT_COLUMNS[table_name]))
+                for asn, name, count, event in cursor.fetchall():
+                    counts[int(asn)][name] += count
+                    newest[int(asn), name] = max(newest[int(asn), name],
+                                                 event)
+
+        self.lookup(cursor, counts)
+        new = {}
+        for asn, names in counts.items():
+            if asn not in self.names:
+                name = names.most_common(1)[0][0]
+                new[asn] = (name, newest[asn, name])
+        if new:
+            self.add(cursor, new)
+
+        removed = {}
+        for table_name, pairs in sorted(NAME_COLUMNS.items()):
+            removed[table_name] = 0
+            for asn_column, name_column in pairs:
+                cursor.execute(
+                    'UPDATE {0} SET {2} = NULL WHERE {1} > 0 AND {2} = '
+                    '(SELECT name FROM AutonomousSystem '
+                    'WHERE AutonomousSystem.asn = {0}.{1});'.format(
+                        table_name, asn_column, name_column))
+                removed[table_name] += cursor.rowcount
+
+        self.connection.commit()
+
+        return removed
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('AsNames({} ASes{})'.format(
+            len(self.names), ', locking' if self.locking else ''))
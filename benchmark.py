@@ -0,0 +1,1019 @@
+#!/usr/bin/python3.5
+
+###############################################################################
+# Imports
+
+import argparse  # Argument parsing
+import re       # Regular expressions
+
+# Parser under test
+from page_parser import parse_html_page
+
+# Query layer under test
+from bgpstream_database import Database
+from query import find_events
+from partitions import PARTITIONED_TABLES, Partitions
+from prefix_index import EventIndex
+
+# Ingestion under test, fed by local stand-ins of bgpstream.com and Twitter
+from fetcher import PageFetcher
+from page_cache import open_cache
+from page_parser import extract_rows, PageBlock
+from synthetic import PageGenerator, PageServer
+from metrics import METRICS
+
+# General utility
+import contextlib
+import datetime
+import io
+import ipaddress
+import multiprocessing
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+###############################################################################
+# Argument Parsing
+
+
+def get_parser():
+    # Get parser for command line arguments
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the bgpstream database ingestion"
+    )
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    # Parser benchmark
+    parse = subparsers.add_parser('parser', help='parse every page of the '
+                                  'html cache with the reference and the '
+                                  'compiled parsers')
+    parse.add_argument('--dir', action='store', default='html',
+                       help='directory of the cached pages. default=html')
+    parse.add_argument('--cache', action='store', default='files',
+                       choices=['files', 'segments'],
+                       help='page cache backend of --dir. default=files')
+    parse.add_argument('-n', '--repeat', action='store', default=3, type=int,
+                       help='number of passes over the cache. default=3')
+
+    # Query benchmark
+    query = subparsers.add_parser('query', help='load a synthetic dataset '
+                                  'and measure the latency of the prefix, '
+                                  'ASN and time window lookups')
+    query.add_argument('-u', '--username', action='store', default='database',
+                       help='username of the database. default=database')
+    query.add_argument('-d', '--database', action='store',
+                       default='bgpstream_benchmark', help='name of the '
+                       'database, which is reset. default=bgpstream_benchmark')
+    query.add_argument('--rows', action='store', default=3000000, type=int,
+                       help='number of synthetic events. default=3000000')
+    query.add_argument('-n', '--samples', action='store', default=200,
+                       type=int, help='number of queries of each kind. '
+                       'default=200')
+    query.add_argument('--partitioned', action='store_true',
+                       help='partition the event tables by month')
+
+    # Prefix index benchmark
+    index = subparsers.add_parser('index', help='load a synthetic dataset '
+                                  'into the in-memory prefix index and '
+                                  'compare its lookups/s with the queries')
+    index.add_argument('-u', '--username', action='store', default='database',
+                       help='username of the database. default=database')
+    index.add_argument('-d', '--database', action='store',
+                       default='bgpstream_benchmark', help='name of the '
+                       'database, which is reset. default=bgpstream_benchmark')
+    index.add_argument('--rows', action='store', default=1000000, type=int,
+                       help='number of synthetic events. default=1000000')
+    index.add_argument('-n', '--samples', action='store', default=20000,
+                       type=int, help='number of alerts looked up. '
+                       'default=20000')
+
+    # Ingestion benchmark
+    ingest = subparsers.add_parser('ingest', help='ingest synthetic pages '
+                                   'served locally and report events/s, '
+                                   'latency and peak memory')
+    ingest.add_argument('-s', '--scenario', action='append', default=None,
+                        choices=INGEST_SCENARIOS, dest='scenarios',
+                        help='parse: parse pages from memory, cache: ingest '
+                        'from a warm page cache, full: download, cache, '
+                        'parse and write. Can be repeated. default=all')
+    ingest.add_argument('-n', '--events', action='store', default=5000,
+                        type=int, help='number of events. default=5000')
+    ingest.add_argument('--seed', action='store', default=0, type=int,
+                        help='seed of the synthetic pages. default=0')
+    ingest.add_argument('--max-leakers', action='store', default=50,
+                        type=int, help='typical maximum number of leakers '
+                        'of a leak. default=50')
+    ingest.add_argument('-u', '--username', action='store',
+                        default='database',
+                        help='username of the database. default=database')
+    ingest.add_argument('-d', '--database', action='store',
+                        default='bgpstream_benchmark', help='name of the '
+                        'database, which is reset. default=bgpstream_benchmark')
+    ingest.add_argument('--backend', action='store', default='postgres',
+                        choices=['postgres', 'sqlite'],
+                        help='database backend, with sqlite -d is the file. '
+                        'default=postgres')
+    ingest.add_argument('--cache', action='store', default='segments',
+                        choices=['files', 'segments'],
+                        help='page cache backend. default=segments')
+    ingest.add_argument('-w', '--workers', action='store', default=8,
+                        type=int, help='number of parallel downloads. '
+                        'default=8')
+    ingest.add_argument('-b', '--batch-size', action='store', default=500,
+                        type=int, help='number of events per transaction. '
+                        'default=500')
+    ingest.add_argument('--delay', action='store', default=0, type=float,
+                        help='seconds taken by the local server to answer. '
+                        'default=0')
+
+    # Streaming reader benchmark
+    stream = subparsers.add_parser('stream', help='download synthetic pages '
+                                   'in full and in streaming mode, check that '
+                                   'both give the same rows and report the '
+                                   'bytes received and cached')
+    stream.add_argument('-n', '--events', action='store', default=5000,
+                        type=int, help='number of events. default=5000')
+    stream.add_argument('--seed', action='store', default=0, type=int,
+                        help='seed of the synthetic pages. default=0')
+    stream.add_argument('--max-leakers', action='store', default=50,
+                        type=int, help='typical maximum number of leakers '
+                        'of a leak. default=50')
+    stream.add_argument('-w', '--workers', action='store', default=8,
+                        type=int, help='number of parallel downloads. '
+                        'default=8')
+    stream.add_argument('--no-gzip', action='store_false', dest='gzip',
+                        help='serve the pages uncompressed')
+    stream.add_argument('--cache', action='store', default='files',
+                        choices=['files', 'segments'],
+                        help='page cache backend of --cache-dir. '
+                        'default=files')
+    stream.add_argument('--cache-dir', action='store', default=None,
+                        help='also check the pages of this page cache, e.g. '
+                        'the real pages of html/')
+
+    return parser
+
+
+###############################################################################
+# Reference parser
+
+
+def reference_parse_html_page(page_number, page):
+    """ Parser as it was before page_parser.py, kept to check and measure the
+        compiled one.
+        Extracts the information that will be inserted inside the
+        database
+        Return:
+            type: the event type (i.e. outage or hijack)
+            columns: a dictionary containing {column_name: value}
+    """
+
+    ###############################################################
+
+    def clean_html(raw_html):
+        cleanr = re.compile('<.*?>')
+        cleantext = re.sub(cleanr, '', raw_html)
+        return cleantext
+
+    ###############################################################
+
+    # Dict containing the values to be inserted inside the
+    # database with the format {column_name: value, ...}
+    columns = {}
+
+    # Determine page type
+    type = ''
+    type += 'Outage' if ('outage' in page) else ''
+    type += 'Hijack' if ('hijack' in page) else ''
+    type += 'Leak' if ('Leak' in page) else ''
+
+    queries = {}
+    queries[type] = {}
+
+    # the id becomes the bgpstream event number
+    columns['id'] = page_number
+
+    # Variables necessary when one needs to analyze multiple lines
+    is_hj_as_name = False
+    is_leaker = False
+    sub_query_columns = {'leak': [], 'asn': [], 'as_name': []}
+
+    # for each line in the html file
+    for line in page.split('\n'):
+        #
+        if type == 'Outage':
+            if "Start time:" in line:
+                columns['start_time'] = line.split()[2] + \
+                    " " + line.split()[3]
+            elif "End time:" in line:
+                columns['end_time'] = line.split()[2] + \
+                    " " + line.split()[3]
+            elif "we detected an outage" in line:
+                # Split cases where ASN is mentioned or when the
+                # country is mentioned
+                if "ASN" in line:
+                    columns['asn'] = int(
+                        line.split('ASN')[1].split('(')[0]
+                    )
+                    columns['as_name'] = line.split(
+                        '(')[1].split(')')[0]
+                else:
+                    columns['asn'] = 0
+                    columns['as_name'] = line.split('for '
+                                                    '')[1].split()[0]
+            elif "Number of Prefixes" in line:
+                columns['number_of_prefixes'] = int(
+                    line.split(':')[1].split('(')[0]
+                )
+                columns['percentage'] = int(
+                    line.split('(')[1].split('%')[0]
+                ) / 100
+        #
+        elif type == 'Leak':
+            if "Start time:" in line:
+                columns['start_time'] = line.split()[2] + \
+                    " " + line.split()[3]
+            if 'Leaked prefix:' in line:
+                tmp = line.split(': ')[1]
+                columns['prefix'] = tmp.split()[0]
+                columns['original_asn'] = int(
+                    tmp.split('AS')[1].split()[0]
+                )
+                tmp = tmp.split('(')[1].split(')')[0].split()[1:]
+                columns['original_as_name'] = (
+                    ' '.join(tmp)
+                )
+            if 'Leaked by' in line:
+                columns['leaking_asn'] = int(
+                    line.split('AS')[1].split()[0]
+                )
+                columns['leaking_as_name'] = clean_html(
+                    ' '.join(line.split('AS')[1].split()[1:])
+                )
+            if 'Example AS path:' in line:
+                columns['as_path'] = clean_html(
+                    line.split(': ')[1]
+                )[:-1]
+            if 'Number of BGPMon peers' in line:
+                columns['number_of_peers'] = int(
+                    clean_html(line.split(': ')[1])
+                )
+            if 'Leaked To:' in line:
+                is_leaker = True
+                sub_query_columns['leak'] = page_number
+            if '<li>' in line and is_leaker:
+                sub_query_columns['asn'].append(
+                    clean_html(line.split()[0])
+                )
+                sub_query_columns['as_name'].append(
+                    line.split('(')[1].split(')')[0]
+                )
+            if '</td>' in line and is_leaker:
+                if 'Leaker' not in queries:
+                    queries['Leaker'] = {}
+                for key, value in sub_query_columns.items():
+                    queries['Leaker'][key] = value
+
+                is_leaker = False
+        #
+        elif type == 'Hijack':
+            if "Start time:" in line:
+                columns['start_time'] = line.split()[2] + \
+                    " " + line.split()[3]
+            if 'Expected prefix:' in line:
+                columns['original_prefix'] = clean_html(
+                    line.split(': ')[1]
+                )
+            if 'Expected ASN:' in line:
+                tmp = line.split(': ')[1]
+                columns['original_asn'] = int(tmp.split()[0])
+
+                is_hj_as_name = True
+            if '(' in line and is_hj_as_name:
+                columns['original_as_name'] = line.split(
+                    '(')[1].split(')')[0]
+                is_hj_as_name = False
+            if 'But beginning at' in line:
+                columns['hj_time'] = (
+                    line.split()[3] + " " + line.split()[4]
+                )
+            if 'Detected advertisement:' in line:
+                columns['hj_prefix'] = clean_html(
+                    line.split(': ')[1]
+                )
+            if 'Detected Origin ASN' in line:
+                columns['hj_asn'] = int(line.split()[3])
+                is_hj_as_name = True
+
+            if '(' in line and is_hj_as_name:
+                columns['hj_as_name'] = clean_html(
+                    line.split('(')[1].split(')')[0]
+                )
+                is_hj_as_name = False
+            if 'Detected AS Path' in line:
+                columns['hj_as_path'] = clean_html(
+                    line.split('Path ')[1]
+                )
+            if 'Detected by number of BGPMon' in line:
+                columns['number_of_peers'] = int(
+                    clean_html(line.split(':')[1])
+                )
+
+    queries[type] = columns
+    return queries
+
+
+###############################################################################
+# Parser benchmark
+
+# Columns that version 2 of the parser extracts differently from the
+# reference parser, which is version 1 (see PARSER_VERSION in page_parser.py)
+VERSION_2_COLUMNS = {'Hijack': ('original_as_name', 'hj_as_name')}
+
+# Hijack page whose AS names are on the line after their ASN, which version 1
+# of the parser got wrong, with the names that must be extracted
+MULTILINE_HIJACK = """<h3>Possible BGP hijack</h3>
+<p>Start time: 2018-01-01 00:00:00 UTC</p>
+<p>Expected prefix: <b>192.0.2.0/24</b></p>
+<p>Expected ASN: 64496
+(Expected Name)</p>
+<p>But beginning at 2018-01-01 00:00:00 UTC,</p>
+<p>Detected advertisement: <b>192.0.2.0/25</b></p>
+<p>Detected Origin ASN 64511
+(Hijacker Name)</p>
+<p>Detected AS Path 3356 64511</p>
+<p>Detected by number of BGPMon peers: 12</p>"""
+MULTILINE_HIJACK_NAMES = {'original_as_name': 'Expected Name',
+                          'hj_as_name': 'Hijacker Name'}
+
+
+def version_2_change(expected, queries):
+    """ Returns: True if the 'queries' of the parser only differ from the
+        'expected' ones of the reference parser in VERSION_2_COLUMNS
+    """
+
+    if sorted(expected) != sorted(queries):
+        return False
+
+    for type, columns in expected.items():
+        ignored = VERSION_2_COLUMNS.get(type, ())
+        if not isinstance(columns, dict) or not ignored:
+            if columns != queries[type]:
+                return False
+            continue
+
+        if {key: value for key, value in columns.items()
+                if key not in ignored} != \
+                {key: value for key, value in queries[type].items()
+                 if key not in ignored}:
+            return False
+
+    return True
+
+###############################################################################
+
+
+def load_pages(cache_kind, dir):
+    """ Reads every page of the page cache 'cache_kind' stored in 'dir'
+        Returns: a list of (event number, page)
+    """
+
+    cache = open_cache(cache_kind, dir)
+    try:
+        return [(event_number, cache.get(event_number))
+                for event_number in cache.event_numbers()]
+    finally:
+        cache.close()
+
+###############################################################################
+
+
+def time_parser(parse, pages, repeat):
+    """ Parses 'pages' 'repeat' times with 'parse'
+        Returns: the best number of pages per second
+    """
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for page_number, page in pages:
+            parse(page_number, page)
+        elapsed = time.perf_counter() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    return len(pages) / best if best else float('inf')
+
+###############################################################################
+
+
+def benchmark_parser(cache_kind, dir, repeat):
+    """ Checks that both parsers extract the same queries from every cached
+        page, then reports their throughput
+    """
+
+    pages = load_pages(cache_kind, dir)
+    if not pages:
+        sys.exit('No cached page in {}/'.format(dir))
+
+    # The parser must get right the fix of version 2, which the reference
+    # parser does not have
+    mismatches = 0
+    columns = parse_html_page(0, MULTILINE_HIJACK)['Hijack']
+    names = {key: columns.get(key) for key in MULTILINE_HIJACK_NAMES}
+    if names != MULTILINE_HIJACK_NAMES:
+        mismatches += 1
+        print('Mismatch on the multi-line hijack page: {}'.format(names),
+              file=sys.stderr)
+
+    # Both parsers must agree before their speed is compared, except on the
+    # columns that version 2 changed, which are listed apart. Pages that the
+    # reference parser cannot handle are left out.
+    valid = []
+    changed = []
+    for page_number, page in pages:
+        try:
+            expected = reference_parse_html_page(page_number, page)
+        except Exception:
+            continue
+
+        valid.append((page_number, page))
+        queries = parse_html_page(page_number, page)
+        if queries == expected:
+            continue
+        if version_2_change(expected, queries):
+            changed.append(page_number)
+        else:
+            mismatches += 1
+            print('Mismatch on event {}'.format(page_number), file=sys.stderr)
+
+    before = time_parser(reference_parse_html_page, valid, repeat)
+    after = time_parser(parse_html_page, valid, repeat)
+
+    print('{} pages, {} mismatches'.format(len(valid), mismatches))
+    print('{} hijacks with other AS names since parser version 2'.format(
+        len(changed)))
+    if changed:
+        print('  events {}'.format(' '.join(str(page_number)
+                                            for page_number in changed)))
+    print('reference parser: {:10.0f} pages/s'.format(before))
+    print('compiled parser:  {:10.0f} pages/s ({:.1f}x)'.format(
+        after, after / before))
+
+
+###############################################################################
+# Query benchmark
+
+# Synthetic events spread over 5 years, with random /16 to /24 prefixes (the
+# hijacks announce a more specific one) among 60000 ASNs, and two Leaker rows
+# per leak. %(n)s is the number of events of each type
+SYNTHETIC_EVENTS = """
+INSERT INTO Outage (id, start_time, end_time, asn, as_name,
+                    number_of_prefixes, percentage)
+SELECT i, t, t + interval '2 hours', asn, 'AS ' || asn,
+       1 + (random() * 100)::int, random()
+FROM (SELECT i, timestamp '2015-01-01' + random() * interval '1826 days' AS t,
+             (random() * 60000)::int AS asn
+      FROM generate_series(1, %(n)s) i) events;
+
+INSERT INTO Hijack (id, start_time, original_prefix, original_asn,
+                    original_as_name, hj_time, hj_prefix, hj_asn, hj_as_name,
+                    hj_as_path, number_of_peers)
+SELECT %(n)s + i, t, prefix, asn, 'AS ' || asn, t,
+       network(set_masklen(prefix, masklen(prefix) + 1))::inet, hj_asn,
+       'AS ' || hj_asn, '3356 ' || hj_asn, (random() * 100)::int
+FROM (SELECT i, timestamp '2015-01-01' + random() * interval '1826 days' AS t,
+             network(set_masklen('0.0.0.0'::inet
+                                 + (random() * 4294967295)::bigint,
+                                 16 + (random() * 8)::int))::inet AS prefix,
+             (random() * 60000)::int AS asn,
+             (random() * 60000)::int AS hj_asn
+      FROM generate_series(1, %(n)s) i) events;
+
+INSERT INTO Leak (id, start_time, prefix, original_asn, original_as_name,
+                  leaking_asn, leaking_as_name, as_path, number_of_peers)
+SELECT 2 * %(n)s + i, t, prefix, asn, 'AS ' || asn, leaking_asn,
+       'AS ' || leaking_asn, '3356 ' || leaking_asn || ' ' || asn,
+       (random() * 100)::int
+FROM (SELECT i, timestamp '2015-01-01' + random() * interval '1826 days' AS t,
+             network(set_masklen('0.0.0.0'::inet
+                                 + (random() * 4294967295)::bigint,
+                                 16 + (random() * 8)::int))::inet AS prefix,
+             (random() * 60000)::int AS asn,
+             (random() * 60000)::int AS leaking_asn
+      FROM generate_series(1, %(n)s) i) events;
+
+INSERT INTO Leaker (asn, as_name, leak)
+SELECT asn, 'AS ' || asn, id
+FROM (SELECT id, (random() * 60000)::int AS asn
+      FROM Leak, generate_series(1, 2)) leakers;
+"""
+
+###############################################################################
+
+
+def percentile(values, fraction):
+    """ Returns: the value below which 'fraction' of 'values' fall """
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+###############################################################################
+
+
+def random_filters(kind):
+    """ Returns: the find_events filters of a random query of 'kind' """
+
+    def prefix():
+        address = random.getrandbits(24) << 8
+        return '{}.{}.{}.0/24'.format(address >> 24, (address >> 16) & 255,
+                                      (address >> 8) & 255)
+
+    def window(days):
+        since = (datetime.datetime(2015, 1, 1) +
+                 datetime.timedelta(days=random.randint(0, 1826 - days)))
+        return since, since + datetime.timedelta(days=days)
+
+    if kind == 'prefix':
+        return {'prefix': prefix()}
+    if kind == 'asn':
+        return {'asn': random.randint(0, 60000)}
+    if kind == 'time':
+        since, until = window(1)
+        return {'since': since, 'until': until}
+
+    # prefix+time
+    since, until = window(30)
+    return {'prefix': prefix(), 'match': 'covering', 'since': since,
+            'until': until}
+
+###############################################################################
+
+
+def load_synthetic_events(name, user, rows, partitioned=False):
+    """ Resets the database 'name' and loads 'rows' synthetic events
+        Returns: the Database
+    """
+
+    database = Database(name, user, True, partitioned)
+    database.prepare()
+
+    if partitioned:
+        # The synthetic events start between 2015 and 2019
+        partitions = Partitions(database.connection)
+        cursor = database.connection.cursor()
+        for table_name in PARTITIONED_TABLES:
+            for year in range(2015, 2021):
+                for month in range(1, 13):
+                    partitions.create(cursor, table_name, year, month)
+        database.connection.commit()
+
+    start = time.perf_counter()
+    cursor = database.connection.cursor()
+    cursor.execute(SYNTHETIC_EVENTS, {'n': rows // 3})
+    database.connection.commit()
+
+    # Up to date statistics for the planner
+    database.connection.autocommit = True
+    cursor.execute('ANALYZE;')
+    print('Loaded {} events in {:.1f}s'.format(
+        rows // 3 * 3, time.perf_counter() - start))
+
+    return database
+
+###############################################################################
+
+
+def benchmark_query(name, user, rows, samples, partitioned=False):
+    """ Resets the database 'name', loads 'rows' synthetic events and reports
+        the latency of each kind of lookup
+    """
+
+    database = load_synthetic_events(name, user, rows, partitioned)
+
+    for kind in ('prefix', 'asn', 'time', 'prefix+time'):
+        latencies = []
+        found = 0
+        for _ in range(samples):
+            filters = random_filters(kind)
+
+            start = time.perf_counter()
+            found += sum(1 for _ in find_events(database.connection,
+                                                **filters))
+            latencies.append(time.perf_counter() - start)
+
+        print('{:>12}: p50 {:8.2f}ms, p99 {:8.2f}ms, {:8.1f} events/query'
+              .format(kind, percentile(latencies, 0.5) * 1000,
+                      percentile(latencies, 0.99) * 1000, found / samples))
+
+
+###############################################################################
+# Prefix index benchmark
+
+# Alerts are correlated with the events of their prefix this long before or
+# after them
+ALERT_WINDOW = datetime.timedelta(days=1)
+
+# Maximum number of alerts also looked up with SQL queries
+SQL_SAMPLES = 500
+
+
+def random_alerts(connection, samples):
+    """ Returns: 'samples' (prefix, time) alerts: half of them in a /24 of a
+        stored hijack or leak, around its time, and the others random
+    """
+
+    cursor = connection.cursor()
+    cursor.execute('SELECT prefix::text, start_time FROM ('
+                   'SELECT hj_prefix AS prefix, start_time FROM Hijack '
+                   'UNION ALL SELECT prefix, start_time FROM Leak) events '
+                   'ORDER BY random() LIMIT %s;', (samples // 2,))
+    alerts = []
+    for prefix, start_time in cursor.fetchall():
+        network = ipaddress.ip_network(prefix, strict=False)
+        if network.prefixlen > 24:
+            network = network.supernet(new_prefix=24)
+        else:
+            network = next(network.subnets(new_prefix=24))
+        alerts.append((str(network), start_time + datetime.timedelta(
+            hours=random.uniform(-24, 24))))
+    connection.rollback()
+
+    while len(alerts) < samples:
+        filters = random_filters('prefix+time')
+        alerts.append((filters['prefix'], filters['since']))
+
+    random.shuffle(alerts)
+    return alerts
+
+###############################################################################
+
+
+def benchmark_index(name, user, rows, samples):
+    """ Resets the database 'name', loads 'rows' synthetic events into an
+        EventIndex, checks its results against the queries of query.py and
+        reports the lookups per second of both
+    """
+
+    database = load_synthetic_events(name, user, rows)
+    connection = database.connection
+    connection.autocommit = False
+
+    before = peak_rss()
+    start = time.perf_counter()
+    index = EventIndex(connection)
+    index.refresh()
+    print('Indexed {} events in {:.1f}s, {} trie nodes, {:.0f} MiB'.format(
+        index.events, time.perf_counter() - start, index.trie.nodes,
+        peak_rss() - before))
+
+    alerts = random_alerts(connection, samples)
+
+    def lookup(prefix, time):
+        return index.find(prefix, time - ALERT_WINDOW, time + ALERT_WINDOW)
+
+    def sql(prefix, time):
+        return list(find_events(connection, ('Hijack', 'Leak'),
+                                prefix=prefix, match='covering',
+                                since=time - ALERT_WINDOW,
+                                until=time + ALERT_WINDOW))
+
+    # Both must find the same events before their speed is compared
+    checked = alerts[:SQL_SAMPLES]
+    start = time.perf_counter()
+    expected = [sql(*alert) for alert in checked]
+    sql_rate = len(checked) / (time.perf_counter() - start)
+    connection.rollback()
+
+    mismatches = sum(
+        1 for alert, rows in zip(checked, expected)
+        if sorted((table_name, row['id']) for table_name, row in rows) !=
+        sorted((table_name, id) for table_name, id, _, _ in lookup(*alert)))
+    print('{} alerts checked, {} mismatches, {:.2f} events/alert'.format(
+        len(checked), mismatches,
+        sum(len(rows) for rows in expected) / max(1, len(checked))))
+
+    start = time.perf_counter()
+    for alert in alerts:
+        lookup(*alert)
+    single_rate = len(alerts) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    index.find_many(alerts, ALERT_WINDOW)
+    batch_rate = len(alerts) / (time.perf_counter() - start)
+
+    asns = [random.randint(0, 60000) for _ in alerts]
+    start = time.perf_counter()
+    for asn, (_, time_) in zip(asns, alerts):
+        index.find_outages(asn, time_ - ALERT_WINDOW, time_ + ALERT_WINDOW)
+    outage_rate = len(alerts) / (time.perf_counter() - start)
+
+    print('{:>12}: {:10.0f} lookups/s'.format('sql', sql_rate))
+    print('{:>12}: {:10.0f} lookups/s'.format('index', single_rate))
+    print('{:>12}: {:10.0f} lookups/s'.format('index batch', batch_rate))
+    print('{:>12}: {:10.0f} lookups/s'.format('outages', outage_rate))
+
+###############################################################################
+# Ingestion benchmark
+
+# Scenarios of the ingestion benchmark, from the cheapest to the most complete
+INGEST_SCENARIOS = ['parse', 'cache', 'full']
+
+
+class TimedCache():
+    """ Page cache that records when every event is first looked up, which is
+        when the ingestion of the event starts
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.started = {}
+
+    def get(self, event_number):
+        self.started.setdefault(event_number, time.perf_counter())
+        return self.cache.get(event_number)
+
+    def put(self, event_number, page):
+        self.cache.put(event_number, page)
+
+    def close(self):
+        self.cache.close()
+
+###############################################################################
+
+
+class TimedDatabase(Database):
+    """ Database that records when the rows of every event are committed """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.committed = {}
+
+    def open_writer(self, *args, **kwargs):
+        writer = super().open_writer(*args, **kwargs)
+
+        # Runs right before the commit, after the inserts
+        def record(cursor):
+            now = time.perf_counter()
+            for ids in writer.inserted.values():
+                for id in ids:
+                    self.committed[id] = now
+
+        writer.hooks.append(record)
+        return writer
+
+###############################################################################
+
+
+def peak_rss():
+    """ Returns: the peak resident memory of the process in MiB """
+
+    # Kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+###############################################################################
+
+
+def run_scenario(scenario, options):
+    """ Runs one scenario of the ingestion benchmark
+        Returns: the number of events, the duration in seconds and the
+        latency of every event
+    """
+
+    generator = PageGenerator(options['events'], options['seed'],
+                              options['max_leakers'])
+    event_numbers = range(1, options['events'] + 1)
+
+    if scenario == 'parse':
+        latencies = []
+        start = time.perf_counter()
+        for event_number in event_numbers:
+            page = generator.page(event_number)
+            if page is None:
+                continue
+
+            parse_start = time.perf_counter()
+            extract_rows(event_number, page)
+            latencies.append(time.perf_counter() - parse_start)
+
+        # Page generation is not part of the measure
+        return len(latencies), sum(latencies), latencies
+
+    directory = tempfile.mkdtemp(prefix='bgpstream-benchmark-')
+    server = PageServer(generator, delay=options['delay']).start()
+    try:
+        cache = open_cache(options['cache'], directory)
+        if scenario == 'cache':
+            generator.fill_cache(cache)
+
+        timed_cache = TimedCache(cache)
+        fetcher = PageFetcher(url=server.url, workers=options['workers'])
+        database = TimedDatabase(options['database'], options['username'],
+                                 True, backend=options['backend'])
+
+        # The report of fill would get in the way of the results
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            database.fill(fetcher, timed_cache, options['batch_size'],
+                          last_event=options['events'])
+        elapsed = time.perf_counter() - start
+
+        timed_cache.close()
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+
+    latencies = [committed - timed_cache.started[event_number]
+                 for event_number, committed
+                 in database.committed.items()]
+
+    return len(latencies), elapsed, latencies
+
+###############################################################################
+
+
+def scenario_process(scenario, options, results):
+    """ Body of the process of a scenario, so that the peak memory of each
+        scenario is measured separately
+    """
+
+    events, elapsed, latencies = run_scenario(scenario, options)
+    results.put((events, elapsed, percentile(latencies, 0.5),
+                 percentile(latencies, 0.99), peak_rss()))
+
+###############################################################################
+
+
+def benchmark_ingest(scenarios, options):
+    """ Reports the events/s, the p50/p99 latency per event and the peak
+        memory of every scenario of 'scenarios'
+    """
+
+    print('{:>8} {:>8} {:>10} {:>10} {:>10} {:>9}'.format(
+        'scenario', 'events', 'events/s', 'p50 ms', 'p99 ms', 'peak MiB'))
+
+    for scenario in scenarios:
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=scenario_process,
+                                          args=(scenario, options, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            sys.exit('Scenario {} failed'.format(scenario))
+
+        events, elapsed, p50, p99, peak = results.get()
+        print('{:>8} {:8} {:10.0f} {:10.2f} {:10.2f} {:9.1f}'.format(
+            scenario, events, events / elapsed if elapsed else 0,
+            p50 * 1000, p99 * 1000, peak))
+        sys.stdout.flush()
+
+
+###############################################################################
+# Streaming reader benchmark
+
+
+def page_block(page, chunk_size=PageFetcher.CHUNK_SIZE):
+    """ Returns: the block of 'page' that the streaming reader keeps, the page
+        being fed 'chunk_size' characters at a time
+    """
+
+    block = PageBlock()
+    for start in range(0, len(page), chunk_size):
+        if block.feed(page[start:start + chunk_size]):
+            break
+    else:
+        block.close()
+
+    return block.page
+
+###############################################################################
+
+
+def download_pages(url, event_numbers, workers, stream):
+    """ Downloads the pages of 'event_numbers' from 'url', in full or in
+        streaming mode
+        Returns:
+            {event_number: page}
+            the number of bytes received
+            the duration in seconds
+    """
+
+    fetcher = PageFetcher(url=url, workers=workers, stream=stream)
+    key = METRICS.key('http_bytes', {})
+    received = METRICS.counters.get(key, 0)
+
+    start = time.perf_counter()
+    pages = {event_number: page for event_number, _, page
+             in fetcher.fetch(event_numbers) if page is not None}
+    elapsed = time.perf_counter() - start
+
+    return pages, METRICS.counters.get(key, 0) - received, elapsed
+
+###############################################################################
+
+
+def count_mismatches(pages, blocks):
+    """ Returns: the number of events of 'pages' whose rows differ from the
+        rows of their block in 'blocks'
+    """
+
+    mismatches = 0
+    for event_number, page in sorted(pages.items()):
+        block = blocks.get(event_number)
+        if block is None or \
+                extract_rows(event_number, block) != \
+                extract_rows(event_number, page):
+            mismatches += 1
+            print('Mismatch on event {}'.format(event_number), file=sys.stderr)
+
+    return mismatches
+
+###############################################################################
+
+
+def benchmark_stream(options):
+    """ Checks that the parser extracts the same rows from the blocks read by
+        the streaming mode of PageFetcher as from the whole pages, then
+        compares the bytes received and cached by both modes
+    """
+
+    if options['cache_dir'] is not None:
+        cache = open_cache(options['cache'], options['cache_dir'])
+        pages = {event_number: cache.get(event_number)
+                 for event_number in cache.event_numbers()}
+        cache.close()
+
+        mismatches = count_mismatches(pages, {
+            event_number: page_block(page)
+            for event_number, page in pages.items()})
+        print('{} cached pages, {} mismatches'.format(len(pages), mismatches))
+
+    generator = PageGenerator(options['events'], options['seed'],
+                              options['max_leakers'])
+    server = PageServer(generator, compress=options['gzip']).start()
+    try:
+        results = [(stream, download_pages(
+            server.url, range(1, options['events'] + 1), options['workers'],
+            stream)) for stream in (False, True)]
+    finally:
+        server.stop()
+
+    pages, blocks = results[0][1][0], results[1][1][0]
+    print('{} synthetic pages, {} mismatches'.format(
+        len(pages), count_mismatches(pages, blocks)))
+
+    print('{:>6} {:>10} {:>12} {:>12} {:>12}'.format(
+        'mode', 'events/s', 'received MiB', 'cached MiB', 'largest KiB'))
+    for stream, (pages, received, elapsed) in results:
+        sizes = [len(page.encode('utf-8')) for page in pages.values()]
+        print('{:>6} {:10.0f} {:12.2f} {:12.2f} {:12.1f}'.format(
+            'stream' if stream else 'full',
+            len(pages) / elapsed if elapsed else 0, received / (1 << 20),
+            sum(sizes) / (1 << 20), max(sizes, default=0) / 1024))
+
+
+###############################################################################
+
+if __name__ == "__main__":
+    # Create a parser
+    parser = get_parser()
+
+    # Parse arguments
+    args = parser.parse_args()
+
+    if args.benchmark == 'parser':
+        benchmark_parser(args.cache, args.dir, args.repeat)
+    elif args.benchmark == 'query':
+        benchmark_query(args.database, args.username, args.rows, args.samples,
+                        args.partitioned)
+    elif args.benchmark == 'index':
+        benchmark_index(args.database, args.username, args.rows, args.samples)
+    elif args.benchmark == 'ingest':
+        benchmark_ingest(args.scenarios or INGEST_SCENARIOS, {
+            'events': args.events,
+            'seed': args.seed,
+            'max_leakers': args.max_leakers,
+            'username': args.username,
+            'database': args.database,
+            'backend': args.backend,
+            'cache': args.cache,
+            'workers': args.workers,
+            'batch_size': args.batch_size,
+            'delay': args.delay,
+        })
+    elif args.benchmark == 'stream':
+        benchmark_stream({
+            'events': args.events,
+            'seed': args.seed,
+            'max_leakers': args.max_leakers,
+            'workers': args.workers,
+            'gzip': args.gzip,
+            'cache': args.cache,
+            'cache_dir': args.cache_dir,
+        })
+    else:
+        parser.print_help()
@@ -4,25 +4,39 @@
 # Imports
 
 import argparse  # Argument parsing
-import requests  # Webpage requests
-import re       # Regular expressions
-import psycopg2  # Postgresql
+import requests  # HTTP errors
+from storage import BACKENDS  # Postgresql and SQLite
+from export import export_tables, EXPORT_TABLES  # Columnar files
 import json     # JSON format parsing
+from fetcher import PageFetcher  # Concurrent page downloads
+from writer import BulkWriter  # Batched inserts
+from page_parser import extract_rows, PARSER_VERSION  # Event extraction
+from page_cache import FileCache, open_cache, migrate  # Page cache backends
+from sync_state import SyncState  # Processed event ids
+from negative_cache import NegativeCache  # Failed event ids
+from pipeline import Pipeline, Stage  # Concurrent ingestion stages
+from query import find_events, EVENT_TABLES  # Index-backed lookups
+from rollups import Rollups  # Per-ASN and per-day statistics
+from partitions import Partitions, is_partitioned  # Monthly partitions
+from as_names import AsNames  # AS dimension table
+from metrics import METRICS  # Run statistics
+from work_queue import WorkQueue, split_ranges  # Shared backfill ranges
 
 # BGPStream Twitter mining
-import tweepy
-from tweepy import Stream
-from tweepy import OAuthHandler
-from tweepy.streaming import StreamListener
-
-# Twitter app credentials
-from credentials import *
+from event_source import get_last_tweet_info
+from event_source import TwitterEventSource, FeedEventSource
 
 # General utility
 import sys
+import atexit
+import cProfile
+import pstats
 import datetime
-import os
-from pprint import pprint
+import multiprocessing
+import time
+
+# Print debug info, set with -x
+DEBUG = False
 
 ###############################################################################
 # Argument Parsing
@@ -42,24 +56,277 @@ def get_parser():
     parser.add_argument('-d', '--database', action='store',
                         default='bgpstream', help='specify the name of the database. '
                         'default=bgpstream')
+    parser.add_argument('--backend', action='store', default='postgres',
+                        choices=['postgres', 'sqlite'],
+                        help='database server, or sqlite to store everything '
+                        'in the file given by -d (bgpstream.sqlite by '
+                        'default). default=postgres')
+    parser.add_argument('-w', '--workers', action='store', default=1,
+                        type=int, help='number of pages downloaded in '
+                        'parallel. default=1')
+    parser.add_argument('-r', '--rate', action='store', default=0,
+                        type=float, help='maximum number of requests per '
+                        'second, 0 for no limit. default=0')
+    parser.add_argument('--retries', action='store', default=3, type=int,
+                        help='number of retries for a failed download. '
+                        'default=3')
+    parser.add_argument('--stream', action='store_true',
+                        help='read the pages as they arrive and stop after '
+                        'the fields of the event, caching only that part of '
+                        'the page')
+    parser.add_argument('-b', '--batch-size', action='store', default=500,
+                        type=int, help='number of events written per '
+                        'transaction. default=500')
+    parser.add_argument('--flush-interval', action='store', default=5.0,
+                        type=float, help='maximum number of seconds between '
+                        'two writes. default=5')
+    parser.add_argument('--reparse-cache', action='store_true',
+                        help='fill the database from the html cache only, '
+                        'without Twitter nor the network')
+    parser.add_argument('--reextract', action='store_true',
+                        help='replace the events extracted by an older '
+                        'version of the parser with the pages of the cache')
+    parser.add_argument('--reextract-type', action='append', default=[],
+                        dest='reextract_types', choices=EVENT_TABLES,
+                        help='replace every event of this type with the '
+                        'pages of the cache, whatever its parser version. '
+                        'Can be repeated')
+    parser.add_argument('-j', '--processes', action='store', default=None,
+                        type=int, help='number of parsing processes used by '
+                        '--reparse-cache and --reextract. default=number of '
+                        'cores')
+    parser.add_argument('--cache', action='store', default='files',
+                        choices=['files', 'segments'], help='page cache '
+                        'backend: one file per event or compressed segments. '
+                        'default=files')
+    parser.add_argument('--cache-dir', action='store', default='html',
+                        help='directory of the page cache. default=html')
+    parser.add_argument('--migrate-cache', action='store_true',
+                        help='move the loose html files of the cache '
+                        'directory into compressed segments and exit')
+    parser.add_argument('--retry-delay', action='store', default=1.0,
+                        type=float, help='hours before a failed event is '
+                        'retried, doubled after each failure. default=1')
+    parser.add_argument('--retry-max-delay', action='store', default=168.0,
+                        type=float, help='maximum number of hours between '
+                        'two retries of a failed event. default=168')
+    parser.add_argument('--retry-max-age', action='store', default=30.0,
+                        type=float, help='number of days after which a '
+                        'failed event is not retried anymore. default=30')
+    parser.add_argument('-p', '--pipeline', action='store_true',
+                        help='run the download, parsing and insertion of the '
+                        'events as concurrent stages')
+    parser.add_argument('--parse-workers', action='store', default=1,
+                        type=int, help='number of parsing threads of '
+                        '--pipeline. default=1')
+    parser.add_argument('--queue-size', action='store', default=100,
+                        type=int, help='size of the queues between the stages '
+                        'of --pipeline. default=100')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running and insert every event tweeted by '
+                        '@bgpstream as soon as it is announced')
+    parser.add_argument('--event-feed', action='store', default=None,
+                        help='with --daemon, read the event numbers from this '
+                        'file (- for stdin) instead of Twitter')
+    parser.add_argument('--rebuild-rollups', action='store_true',
+                        help='recompute the statistics tables from the event '
+                        'tables and exit')
+    parser.add_argument('--check-rollups', action='store_true',
+                        help='check that the statistics tables match the '
+                        'event tables and exit')
+    parser.add_argument('--normalize-as-names', action='store_true',
+                        help='move the AS names stored in the event tables '
+                        'to the AutonomousSystem table and exit')
+    parser.add_argument('--strip-as-names', action='store_true',
+                        help='store the AS names of the new rows in the '
+                        'AutonomousSystem table and leave them empty in the '
+                        'rows that have the stored name. The queries must '
+                        'then read the *View views')
+    parser.add_argument('--partitioned', action='store_true',
+                        help='partition the event tables by month when they '
+                        'are created, i.e. with -c')
+    parser.add_argument('--detach-before', action='store', default=None,
+                        metavar='YYYY-MM', help='detach the partitions of the '
+                        'events that started before this month and exit')
+    parser.add_argument('--archive-schema', action='store', default=None,
+                        help='with --detach-before, move the detached '
+                        'partitions to this schema')
+    parser.add_argument('--metrics-json', action='store', default=None,
+                        metavar='PATH', help='write the counters and timers '
+                        'of the run as JSON to this file (- for stdout) at '
+                        'exit')
+    parser.add_argument('--metrics-file', action='store', default=None,
+                        metavar='PATH', help='keep this file updated with the '
+                        'counters and timers in the Prometheus text format')
+    parser.add_argument('--metrics-interval', action='store', default=15,
+                        type=float, help='seconds between two updates of '
+                        '--metrics-file. default=15')
+    parser.add_argument('--profile', action='store', default=None,
+                        metavar='PATH', help='profile the run with cProfile, '
+                        'save the stats to this file and print the slowest '
+                        'functions at exit')
+    parser.add_argument('--last-event', action='store', default=None,
+                        type=int, help='number of the latest event, instead '
+                        'of looking for the last tweet of @bgpstream')
+    parser.add_argument('--discover-head', action='store_true',
+                        help='find the latest event by probing the event '
+                        'pages after the latest processed one, instead of '
+                        'looking for the last tweet of @bgpstream')
+    parser.add_argument('--enqueue', action='store_true',
+                        help='split the events up to the latest one into '
+                        'ranges for the --worker processes and exit')
+    parser.add_argument('--range-size', action='store', default=1000,
+                        type=int, help='number of event ids per range of '
+                        '--enqueue. default=1000')
+    parser.add_argument('--worker', action='store_true',
+                        help='process the ranges queued by --enqueue until '
+                        'there are none left, with any number of other '
+                        'workers')
+    parser.add_argument('--lease-seconds', action='store', default=300,
+                        type=int, help='time after which the range of a '
+                        '--worker that stopped writing goes to another '
+                        'worker. default=300')
+    parser.add_argument('--url', action='store',
+                        default='https://bgpstream.com/event/',
+                        help='url prefix of the event pages. '
+                        'default=https://bgpstream.com/event/')
+
+    # Lookups
+    subparsers = parser.add_subparsers(dest='command')
+    query = subparsers.add_parser('query', help='print the events matching a '
+                                  'prefix, an ASN and/or a time window, one '
+                                  'JSON object per line')
+    query.add_argument('--prefix', action='store', default=None,
+                       help='prefix of the events, i.e. 192.0.2.0/24')
+    query.add_argument('--match', action='store', default='overlaps',
+                       choices=['overlaps', 'covering', 'within'],
+                       help='how the event prefix relates to --prefix: covers '
+                       'it, is inside it, or either. default=overlaps')
+    query.add_argument('--asn', action='store', default=None, type=int,
+                       help='ASN involved in the events')
+    query.add_argument('--since', action='store', default=None,
+                       help='earliest start time, i.e. 2018-01-01')
+    query.add_argument('--until', action='store', default=None,
+                       help='start time upper bound (excluded)')
+    query.add_argument('-t', '--type', action='append', default=None,
+                       choices=EVENT_TABLES, dest='types',
+                       help='event type, can be repeated. default=all')
+    query.add_argument('-l', '--limit', action='store', default=None,
+                       type=int, help='maximum number of events per type')
+
+    # Columnar export
+    export = subparsers.add_parser('export', help='write every table to a '
+                                   'compressed Parquet file (needs pyarrow)')
+    export.add_argument('--dir', action='store', default='export',
+                        help='directory of the files. default=export')
+    export.add_argument('-t', '--type', action='append', default=None,
+                        choices=EXPORT_TABLES, dest='tables',
+                        help='table to export, can be repeated. default=all')
+    export.add_argument('--compression', action='store', default='zstd',
+                        choices=['zstd', 'snappy', 'gzip', 'none'],
+                        help='compression codec. default=zstd')
 
     return parser
 
 
+###############################################################################
+# Page parsing
+
+# Page cache of a worker process of Database.reparse_cache
+worker_cache = None
+
+
+def open_worker_cache(cache_kind, dir):
+    """ Opens the page cache of a worker process """
+
+    global worker_cache
+    worker_cache = open_cache(cache_kind, dir)
+
+    # A forked worker starts with a copy of the metrics of the main process
+    METRICS.drain()
+
+
+def page_rows(event_number, status, page):
+    """ Extracts the rows of a downloaded page. 'status' is the HTTP status,
+        or the exception raised by the download
+        Returns:
+            the list of (type, columns) rows of the event, or None
+            the reason why the page cannot be used, or None
+    """
+
+    # Check for Integrity
+    if isinstance(status, requests.RequestException):
+        return None, 'HTTP error: {}'.format(type(status).__name__)
+    if page is None:
+        return None, 'HTTP {}'.format(status)
+
+    return extract_rows(event_number, page)
+
+
+def parse_cached_event(event_number):
+    """ Parses the cached page of 'event_number' in a worker process
+        Returns:
+            the event number
+            the list of (type, columns) rows of the event, or None
+            the reason why the page cannot be used, or None
+            the metrics recorded by the worker since its last event, for
+            METRICS.merge
+    """
+
+    page = worker_cache.get(event_number)
+    if page is None:
+        return event_number, None, 'not in the cache', METRICS.drain()
+
+    rows, reason = extract_rows(event_number, page)
+
+    return event_number, rows, reason, METRICS.drain()
+
+
+def report_run(metrics_json=None, metrics_file=None, profiler=None,
+               profile=None):
+    """ Writes the metrics of the run and the profile, meant to run at exit.
+        Only the main thread is profiled: the download and pipeline threads
+        show up in the metrics
+    """
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats(
+            'cumulative').print_stats(25)
+
+    if metrics_file is not None:
+        METRICS.write_prometheus(metrics_file)
+
+    if metrics_json is not None:
+        METRICS.write_json(metrics_json)
+
+
 ###############################################################################
 # Database
 
 class Database():
-    """ Creates and manages a postgresql database """
+    """ Creates and manages a postgresql (or SQLite) database """
 
-    def __init__(self, name, user, clear):
+    def __init__(self, name, user, clear, partitioned=False,
+                 backend='postgres', strip_as_names=False):
         """ Initializes the database connection and clears it if the option -c
-            is specified.
+            is specified. If 'partitioned', the tables that do not exist yet
+            are created with the event tables partitioned by month. 'backend'
+            is 'postgres' or 'sqlite', in which case 'name' is the database
+            file. If 'strip_as_names', the rows that are written only keep
+            the AS names that are not in the AutonomousSystem table
         """
 
+        self.partitioned = partitioned
+        self.strip_as_names = strip_as_names
+        self.backend = BACKENDS[backend]()
+        if partitioned and self.backend.PARTITIONED_SCHEMA is None:
+            raise ValueError('The {} backend has no partitions'.format(
+                self.backend.name))
+
         # Connect to the database
-        self.connection = psycopg2.connect("dbname='{}' user='{}' "
-                                           "password='' host=''".format(name, user))
+        self.connection = self.backend.connect(name, user)
 
         # [optional] clear it
         if clear:
@@ -70,427 +337,481 @@ class Database():
     def clear(self):
         """ Deletes every table of the database """
 
-        # Create a cursor to query the db
+        self.backend.clear(self.connection)
+
+    ###########################################################################
+
+    def check(self):
+        """ Check if every table from sql/table_names.txt exists
+            Returns: True if they all exist, else False
+        """
+
+        table_names = [line.rstrip() for line in open('sql/table_names.txt')]
+
         cursor = self.connection.cursor()
 
-        # Delete all tables (by default every table is in public)
-        cursor.execute("DROP SCHEMA IF EXISTS public CASCADE;")
+        # If a table is missing then an exception will be raised
+        try:
+            for name in table_names:
+                cursor.execute('SELECT 1 FROM {} LIMIT 1'.format(name))
+        except self.backend.MISSING_TABLE:
+            self.connection.rollback()  # Reset the transaction
+            return False
 
-        # Reset the schema
-        cursor.execute('CREATE SCHEMA public;')
+        return True
 
-        # Commit the result
-        self.connection.commit()
+    ###########################################################################
+
+    def create_tables(self):
+        """ Creates the DB tables by executing the schema file of the backend,
+            sql/schema.sql for postgresql, or sql/schema_partitioned.sql for a
+            partitioned database
+            Returns: nothing
+        """
+
+        # Create tables from the file 'sql/table_names.txt'
+        schema = (self.backend.PARTITIONED_SCHEMA if self.partitioned
+                  else self.backend.SCHEMA)
+        self.backend.execute_script(self.connection, open(schema).read())
 
     ###########################################################################
 
-    def fill(self):
-        """ Fills the database with every event described on bgpstream.com that
-            has not been added to the database yet
+    def execute_script(self, path):
+        """ Executes and commits the sql file 'path' """
+
+        self.backend.execute_script(self.connection, open(path).read())
+
+    ###########################################################################
+
+    def prepare(self):
+        """ Recreates all tables if one of them is missing, then creates the
+            tables and indexes that do not exist yet
         """
 
-        #######################################################################
+        if not self.check():
+            self.clear()
+            self.create_tables()
 
-        def check(database):
-            """ Check if every table from sql/table_names.txt exists
-                Returns: True if they all exist, else False
-            """
+        # Tables added after the first version of the schema are created
+        # separately so that existing databases are not reset
+        for path in self.backend.UPGRADE_SCRIPTS:
+            self.execute_script(path)
 
-            table_names = [line.rstrip()
-                           for line in open('sql/table_names.txt')]
+    ###########################################################################
 
-            cursor = database.connection.cursor()
+    def prepare_views(self):
+        """ Creates the views of the AS names if they do not exist yet, for
+            the lookups that do not modify the database: unlike prepare, the
+            tables are never reset and no index is built
+            Returns: False if one of the tables is missing, else True
+        """
 
-            # If a table is missing then an exception will be raised
-            try:
-                for name in table_names:
-                    cursor.execute('SELECT 1 FROM {}'.format(name))
-            except psycopg2.ProgrammingError:
-                database.connection.rollback()  # Reset the transaction
-                return False
+        if not self.check():
+            return False
 
-            return True
+        cursor = self.connection.cursor()
+        try:
+            for table_name in EVENT_TABLES + ('Leaker',):
+                cursor.execute('SELECT 1 FROM {}View LIMIT 1'.format(
+                    table_name))
+        except self.backend.MISSING_TABLE:
+            self.connection.rollback()
+            self.execute_script(self.backend.VIEWS_SCRIPT)
 
-        #######################################################################
+        return True
 
-        def create_tables(database):
-            """ Creates the DB tables by executing the sql/schema.sql file
-                Returns: nothing
-            """
+    ###########################################################################
 
-            cursor = database.connection.cursor()
+    def open_writer(self, batch_size=500, flush_interval=5.0, retry=None,
+                    replace=False, prepare=True):
+        """ Creates the tables if needed (unless 'prepare' is False) and
+            returns a BulkWriter that keeps the sync state, the negative cache
+            and the rollups of the events up to date. 'retry' holds the
+            keyword arguments of the NegativeCache that decides when failed
+            events are retried. With 'replace', the writer replaces the stored
+            events instead, and neither the sync state, the negative cache nor
+            the rollups are updated
+        """
 
-            # Create tables from the file 'sql/table_names.txt'
-            cursor.execute(open('sql/schema.sql').read())
+        # If a table is missing then recreate all tables
+        if prepare:
+            self.prepare()
+
+        state = failures = None
+        if not replace:
+            state = SyncState(self.connection)
+            failures = NegativeCache(self.connection, **(retry or {}))
+
+        # The mode of existing tables wins over the one that was asked for
+        partitions = None
+        if self.backend.ANALYTICS and is_partitioned(self.connection):
+            partitions = Partitions(self.connection)
+
+        writer = BulkWriter(self.connection, batch_size, flush_interval,
+                            DEBUG, state, failures, partitions, replace)
+
+        # Rollup tables that were just created are computed from the events
+        # that are already stored
+        if self.backend.ANALYTICS and not replace:
+            rollups = Rollups(self.connection)
+            if rollups.is_empty():
+                rollups.rebuild()
+            rollups.attach(writer)
+
+        # By default the rows keep their AS names and the AutonomousSystem
+        # table is left as it is
+        if self.strip_as_names:
+            AsNames(self.connection,
+                    locking=self.backend.ANALYTICS).attach(writer)
+
+        return writer
 
-            # Commit the result
-            database.connection.commit()
+    ###########################################################################
+
+    def fill(self, fetcher=None, cache=None, batch_size=500,
+             flush_interval=5.0, retry=None, pipeline=None, last_event=None,
+             discover_head=False, queue=None):
+        """ Fills the database with every event described on bgpstream.com that
+            has not been added to the database yet. 'fetcher' is the
+            PageFetcher used to download the pages (serial by default) and
+            'cache' the page cache backend (loose files in html/ by default).
+            Rows are written every 'batch_size' events or 'flush_interval'
+            seconds. 'retry' holds the keyword arguments of the NegativeCache
+            that decides when failed events are retried. If 'pipeline' is not
+            None, fetching, parsing and writing run as concurrent stages, and
+            'pipeline' holds the keyword arguments of pipeline_events.
+            'last_event' is the latest event number. If it is None, it is
+            found by probing bgpstream.com with 'discover_head', or else asked
+            to Twitter. With the WorkQueue 'queue', the events are instead the
+            ranges leased from the queue until it is empty, and any number of
+            processes can fill the database at the same time
+        """
+
+        if fetcher is None:
+            fetcher = PageFetcher()
+        if cache is None:
+            cache = FileCache()
 
         #######################################################################
 
-        def get_last_tweet_info(account='bgpstream'):
-            """ Look for the last tweet posted by @bgpstream
-                Returns: number of the last bgpstream event
+        def save_events(database, event_numbers, fetcher, cache, writer):
+            """ Iterate over every event of 'event_numbers'. The rows are
+                written in batches by 'writer'
             """
 
-            # Twitter authentication
-            auth = tweepy.OAuthHandler(twitterConsumerKey,
-                                       twitterConsumerSecret)
-            auth.set_access_token(twitterAccessToken, twitterAccessSecret)
-            api = tweepy.API(auth)
+            ###################################################################
+
+            def bgpstream_page_iterator(event_numbers, fetcher, cache):
+                """ Yields the html code of the event pages of
+                    'event_numbers'. Pages are read from 'cache' or downloaded
+                    concurrently by 'fetcher' and stored in 'cache', but are
+                    yielded in the order of 'event_numbers'.
+                    Returns:
+                        the page code
+                        the HTTP status
+                        the html code, or None if it could not be downloaded
+                """
 
-            # Retrieve last tweet from timeline
-            last_tweet = api.user_timeline(screen_name=account, count=1)[0]
+                for event_number, status, page in fetcher.fetch(event_numbers,
+                                                                cache.get,
+                                                                cache.put):
+                    yield event_number, status, page
 
-            # Extract bgpstream number from the last tweet
-            event_number = int(last_tweet.entities
-                               ['urls'][0]['expanded_url'].split('/')[-1])
+            ###################################################################
 
-            return event_number
+            # For each html page describing an event that is not inside the
+            # database yet:
+            try:
+                for page_number, status, page in bgpstream_page_iterator(
+                        event_numbers, fetcher, cache):
+                    # Extract the type and the columns of the html page. The
+                    # pages that could not be downloaded go to the negative
+                    # cache
+                    rows, reason = page_rows(page_number, status, page)
+                    writer.save_event(page_number, rows, reason)
+            finally:
+                # Write the remaining rows
+                writer.close()
+
+            print(writer.report())
 
         #######################################################################
 
-        def get_latest_database_entry(database, id_columns={'Leak': 'id'}):
-            """ Get the highest id from the 'Leak' table. This is because
-                tweets
-                Returns: the highest id contained in the DB or 0
+        def pipeline_events(database, event_numbers, fetcher, cache, writer,
+                            parse_workers=1, queue_size=100,
+                            report_interval=None):
+            """ Same as save_events, but the events go through fetch, parse
+                and write stages connected by queues of 'queue_size' items.
+                The fetch stage has as many workers as 'fetcher', the parse
+                stage 'parse_workers' and the write stage a single one
             """
 
-            cursor = database.connection.cursor()
+            ###################################################################
 
-            # Initialize to smallest id possible
-            res = 0
+            def fetch(event_number):
+                page = cache.get(event_number)
+                if page is not None:
+                    return event_number, 200, page
 
-            # Get the highest date from tables specified in 'time_columns'
-            for table_name, column_name in id_columns.items():
+                # A failed download goes to the negative cache, see page_rows
                 try:
-                    cursor.execute("SELECT MAX({}) FROM {};".format(column_name,
-                                                                    table_name))  # Get the highest value, or None if empty
-                    temp = cursor.fetchone()[0]
+                    status, page = fetcher.get(event_number)
+                except requests.RequestException as error:
+                    return event_number, error, None
 
-                    # Max between res and this table's value
-                    res = temp if (temp is not None and temp > res) else res
-                except psycopg2.ProgrammingError:
-                    database.connection.rollback()
+                if page is not None:
+                    cache.put(event_number, page)
 
-            return res
+                return event_number, status, page
 
-        #######################################################################
+            ###################################################################
 
-        def save_events(database, last_event_number, latest_entry_number):
-            """ Starting from the bgpstream event 'last_event_number', iterate
-                over  every event until 'latest_entry_number' is reached
-            """
+            def parse(item):
+                event_number, status, page = item
+                rows, reason = page_rows(event_number, status, page)
+
+                return event_number, rows, reason
 
             ###################################################################
 
-            def bgpstream_page_iterator(first_event, threshold,
-                                        url='https://bgpstream.com/event/', dir='html'):
-                """ Yields the html code of 'url'/x, where x is the event
-                    number. The event number goes from 'first_event" to
-                    threshold.
-                    Returns:
-                        the page code
-                        the html code
-                """
+            def write(item):
+                writer.save_event(*item)
 
-                # Object to request web pages
-                s = requests.session()
+            ###################################################################
 
-                # Iterate from 'first_event' to 'threshold':
-                current_event = first_event
-                while (current_event >= threshold):
-                    # Check if file is already stored offline
-                    if os.path.isfile('{}/{}.txt'.format(dir, current_event)):
-                        # Return its content
-                        with open('{}/{}.txt'.format(dir, current_event)) as f:
-                            yield current_event, f.readlines()
-                    else:
-                        # Download the page
-                        page = s.get(url + str(current_event))
+            stages = Pipeline([
+                Stage('fetch', fetch, fetcher.workers, queue_size),
+                Stage('parse', parse, parse_workers, queue_size),
+                Stage('write', write, 1, queue_size),
+            ], report_interval)
 
-                        # Check for Integrity
-                        if page.status_code != 500:
+            try:
+                stages.run(event_numbers)
+            finally:
+                # Write the remaining rows
+                writer.close()
 
-                            # Save it locally
-                            with open(
-                                    '{}/{}.txt'.format(dir, current_event),
-                                    'a') as f:
-                                f.write(page.text)
+            print(stages.report())
+            print(writer.report())
 
-                            # Return the result
-                            yield current_event, page.text
+        #######################################################################
 
-                    current_event -= 1
+        if queue is None:
+            writer = self.open_writer(batch_size, flush_interval, retry)
+        else:
+            # Workers that start together prepare the database one at a time,
+            # and the other workers may be writing already
+            with queue.preparing():
+                self.prepare()
+            with queue.exclusive():
+                writer = self.open_writer(batch_size, flush_interval, retry,
+                                          prepare=False)
+
+        if queue is None:
+            last_event_number = last_event
+            if last_event_number is None:
+                last_event_number = self.find_last_event(fetcher, writer.state,
+                                                         discover_head)
+            ranges = [(1, last_event_number)]
+        else:
+            # Ranges leased from the work queue shared with other workers
+            queue.attach(writer)
+            ranges = queue.leases()
+
+        for first_id, last_id in ranges:
+            # Find the events that have never been processed, leaving out the
+            # failed ones that are not due for a retry
+            event_numbers = [event_number for event_number
+                             in writer.state.missing(first_id, last_id)
+                             if writer.failures.due(event_number)]
+
+            # Save the new events inside the database
+            if pipeline is None:
+                save_events(self, event_numbers, fetcher, cache, writer)
+            else:
+                pipeline_events(self, event_numbers, fetcher, cache, writer,
+                                **pipeline)
 
-            ###################################################################
+    ###########################################################################
 
-            def parse_html_page(page_number, page):
-                """ Extracts the information that will be inserted inside the
-                    database
-                    Return:
-                        type: the event type (i.e. outage or hijack)
-                        columns: a dictionary containing {column_name: value}
-                """
+    def find_last_event(self, fetcher, state, discover_head=False):
+        """ Finds the latest bgpstream.com event number with the last tweet
+            sent by @bgpstream, or if 'discover_head' by probing the pages
+            after the latest event processed according to the SyncState
+            'state'
+            Returns: the latest event number
+        """
 
-                ###############################################################
-
-                def clean_html(raw_html):
-                    cleanr = re.compile('<.*?>')
-                    cleantext = re.sub(cleanr, '', raw_html)
-                    return cleantext
-
-                ###############################################################
-
-                # Dict containing the values to be inserted inside the
-                # database with the format {column_name: value, ...}
-                columns = {}
-
-                # Determine page type
-                type = ''
-                type += 'Outage' if ('outage' in page) else ''
-                type += 'Hijack' if ('hijack' in page) else ''
-                type += 'Leak' if ('Leak' in page) else ''
-
-                queries = {}
-                queries[type] = {}
-
-                # the id becomes the bgpstream event number
-                columns['id'] = page_number
-
-                # Variables necessary when one needs to analyze multiple lines
-                is_hj_as_name = False
-                is_leaker = False
-                sub_query_columns = {'leak': [], 'asn': [], 'as_name': []}
-
-                # for each line in the html file
-                for line in page.split('\n'):
-                    #
-                    if type == 'Outage':
-                        if "Start time:" in line:
-                            columns['start_time'] = line.split()[2] + \
-                                " " + line.split()[3]
-                        elif "End time:" in line:
-                            columns['end_time'] = line.split()[2] + \
-                                " " + line.split()[3]
-                        elif "we detected an outage" in line:
-                            # Split cases where ASN is mentioned or when the
-                            # country is mentioned
-                            if "ASN" in line:
-                                columns['asn'] = int(
-                                    line.split('ASN')[1].split('(')[0]
-                                )
-                                columns['as_name'] = line.split(
-                                    '(')[1].split(')')[0]
-                            else:
-                                columns['asn'] = 0
-                                columns['as_name'] = line.split('for '
-                                                                '')[1].split()[0]
-                        elif "Number of Prefixes" in line:
-                            columns['number_of_prefixes'] = int(
-                                line.split(':')[1].split('(')[0]
-                            )
-                            columns['percentage'] = int(
-                                line.split('(')[1].split('%')[0]
-                            ) / 100
-                    #
-                    elif type == 'Leak':
-                        if "Start time:" in line:
-                            columns['start_time'] = line.split()[2] + \
-                                " " + line.split()[3]
-                        if 'Leaked prefix:' in line:
-                            tmp = line.split(': ')[1]
-                            columns['prefix'] = tmp.split()[0]
-                            columns['original_asn'] = int(
-                                tmp.split('AS')[1].split()[0]
-                            )
-                            tmp = tmp.split('(')[1].split(')')[0].split()[1:]
-                            columns['original_as_name'] = (
-                                ' '.join(tmp)
-                            )
-                        if 'Leaked by' in line:
-                            columns['leaking_asn'] = int(
-                                line.split('AS')[1].split()[0]
-                            )
-                            columns['leaking_as_name'] = clean_html(
-                                ' '.join(line.split('AS')[1].split()[1:])
-                            )
-                        if 'Example AS path:' in line:
-                            columns['as_path'] = clean_html(
-                                line.split(': ')[1]
-                            )[:-1]
-                        if 'Number of BGPMon peers' in line:
-                            columns['number_of_peers'] = int(
-                                clean_html(line.split(': ')[1])
-                            )
-                        if 'Leaked To:' in line:
-                            is_leaker = True
-                            sub_query_columns['leak'] = page_number
-                        if '<li>' in line and is_leaker:
-                            sub_query_columns['asn'].append(
-                                clean_html(line.split()[0])
-                            )
-                            sub_query_columns['as_name'].append(
-                                line.split('(')[1].split(')')[0]
-                            )
-                        if '</td>' in line and is_leaker:
-                            if 'Leaker' not in queries:
-                                queries['Leaker'] = {}
-                            for key, value in sub_query_columns.items():
-                                queries['Leaker'][key] = value
-
-                            is_leaker = False
-                    #
-                    elif type == 'Hijack':
-                        if "Start time:" in line:
-                            columns['start_time'] = line.split()[2] + \
-                                " " + line.split()[3]
-                        if 'Expected prefix:' in line:
-                            columns['original_prefix'] = clean_html(
-                                line.split(': ')[1]
-                            )
-                        if 'Expected ASN:' in line:
-                            tmp = line.split(': ')[1]
-                            columns['original_asn'] = int(tmp.split()[0])
-
-                            is_hj_as_name = True
-                        if '(' in line and is_hj_as_name:
-                            columns['original_as_name'] = line.split(
-                                '(')[1].split(')')[0]
-                            is_hj_as_name = False
-                        if 'But beginning at' in line:
-                            columns['hj_time'] = (
-                                line.split()[3] + " " + line.split()[4]
-                            )
-                        if 'Detected advertisement:' in line:
-                            columns['hj_prefix'] = clean_html(
-                                line.split(': ')[1]
-                            )
-                        if 'Detected Origin ASN' in line:
-                            columns['hj_asn'] = int(line.split()[3])
-                            is_hj_as_name = True
-
-                        if '(' in line and is_hj_as_name:
-                            columns['hj_as_name'] = clean_html(
-                                line.split('(')[1].split(')')[0]
-                            )
-                            is_hj_as_name = False
-                        if 'Detected AS Path' in line:
-                            columns['hj_as_path'] = clean_html(
-                                line.split('Path ')[1]
-                            )
-                        if 'Detected by number of BGPMon' in line:
-                            columns['number_of_peers'] = int(
-                                clean_html(line.split(':')[1])
-                            )
-
-                queries[type] = columns
-                return queries
+        if not discover_head:
+            return get_last_tweet_info()
 
-            ###################################################################
+        last_event_number, probes = fetcher.discover_head(state.max())
+        print('Latest event: {} ({} probes)'.format(last_event_number, probes))
 
-            def query_iterator(queries):
-                """ Returns the next query to be inserted inside the database.
-                    Necessary to extract queries from arrays of values
-                """
+        return last_event_number
 
-                ##############################################################
+    ###########################################################################
 
-                def is_empty(dictionary):
-                    """ Tests if every list contained in this dictionary are
-                        empty
-                    """
+    def enqueue(self, fetcher, last_event=None, discover_head=False,
+                range_size=1000, retry=None):
+        """ Splits the events up to the latest one into ranges of
+            'range_size' ids, and adds the ranges that have events left to
+            process to the work queue of the workers (see fill). 'retry'
+            holds the keyword arguments of the NegativeCache
+            Returns: the number of queued ranges
+        """
 
-                    for key, value in dictionary.items():
-                        if isinstance(value, list) and len(value) != 0:
-                            return False
-                    else:
-                        return True
+        self.prepare()
+        state = SyncState(self.connection)
+        failures = NegativeCache(self.connection, **(retry or {}))
 
-                ##############################################################
+        if last_event is None:
+            last_event = self.find_last_event(fetcher, state, discover_head)
 
-                for type, columns in queries.items():
-                    values_list = {}
-                    query = {}
+        ranges = [(first_id, last_id) for first_id, last_id
+                  in split_ranges(1, last_event, range_size)
+                  if any(failures.due(event_number) for event_number
+                         in state.missing(first_id, last_id))]
 
-                    for key, value in columns.items():
-                        if isinstance(value, list):
-                            for v in value:
-                                values_list[key] = value
+        return WorkQueue(self.connection).enqueue(ranges)
 
-                    # Case where the query is not a complicated one
-                    if not values_list:
-                        yield type, columns
-                        continue
+    ###########################################################################
 
-                    while not is_empty(values_list):
-                        for key, value in columns.items():
-                            if key not in values_list:
-                                query[key] = value
-                            else:
-                                query[key] = values_list[key][0]
-                                values_list[key].pop(0)
+    def reparse_cache(self, cache_kind='files', dir='html', processes=None,
+                      batch_size=500, flush_interval=5.0):
+        """ Fills the database with the pages of the cache only, without
+            Twitter nor the network. The pages are parsed by a pool of
+            'processes' processes (one per core by default), each reading the
+            'cache_kind' cache stored in 'dir', and the rows are written by a
+            single BulkWriter
+        """
 
-                        yield type, query
+        writer = self.open_writer(batch_size, flush_interval)
 
-            ###################################################################
+        cache = open_cache(cache_kind, dir)
+        event_numbers = cache.event_numbers()
+        cache.close()
 
-            def insert_event_into_database(database, table_name, columns):
-                """ The table name is provided by the type and the column names
-                    and values are provided by 'columns', which means that the
-                    'INSERT INTO' is generic
-                """
+        with multiprocessing.Pool(processes, open_worker_cache,
+                                  (cache_kind, dir)) as pool:
+            for event_number, rows, reason, metrics in pool.imap_unordered(
+                    parse_cached_event, event_numbers, chunksize=64):
+                METRICS.merge(metrics)
+                writer.save_event(event_number, rows, reason)
 
-                cursor = database.connection.cursor()
+        # Write the remaining rows
+        writer.close()
+        print(writer.report())
 
-                # Formatting values
-                keys = ""
-                values = ""
-                for key, value in columns.items():
-                    keys += key + ', '
-                    values += "'" + str(value).replace("'", "") + "', "
+    ###########################################################################
 
-                # Removing trailing characters
-                keys = keys[:-2]
-                values = values[:-2]
+    def reextract(self, cache_kind='files', dir='html', types=(),
+                  processes=None, batch_size=500, flush_interval=5.0):
+        """ Parses again the cached pages of the events extracted by an older
+            parser, and of every event of the tables 'types', and replaces
+            their rows. The pages are parsed by a pool of 'processes'
+            processes as in reparse_cache. The events whose page is not in
+            the cache, or cannot be parsed anymore, keep their rows
+            Returns:
+                the number of replaced events
+                the number of events left as they were
+        """
 
-                # Inserting
-                if DEBUG:
-                    print("INSERT INTO {} ({}) VALUES ({});".format(type,
-                                                                    keys, values))
-                cursor.execute("INSERT INTO {} ({}) VALUES ({});".format(type,
-                                                                         keys, values))
+        self.prepare()
 
-            ###################################################################
+        cursor = self.connection.cursor()
+        event_numbers = set()
+        for table_name in BulkWriter.EVENT_TABLES:
+            if table_name in types:
+                cursor.execute('SELECT id FROM {};'.format(table_name))
+            else:
+                cursor.execute('SELECT id FROM {} WHERE parser_version IS NULL '
+                               'OR parser_version < %s;'.format(table_name),
+                               (PARSER_VERSION,))
+            event_numbers.update(id for id, in cursor.fetchall())
+        self.connection.commit()
 
-            # For each html page describing an event that is not inside the
-            # database yet:
-            for page_number, page in bgpstream_page_iterator(last_event_number,
-                                                             latest_entry_number):
-                # Extract the type and the columns of the html page
-                queries = parse_html_page(page_number, page)
+        writer = self.open_writer(batch_size, flush_interval, replace=True)
 
-                for type, columns in query_iterator(queries):
-                    insert_event_into_database(database, type, columns)
-                database.connection.commit()
+        replaced = skipped = 0
+        with multiprocessing.Pool(processes, open_worker_cache,
+                                  (cache_kind, dir)) as pool:
+            for event_number, rows, reason, metrics in pool.imap_unordered(
+                    parse_cached_event, sorted(event_numbers, reverse=True),
+                    chunksize=64):
+                METRICS.merge(metrics)
+                if rows is None:
+                    skipped += 1
+                    if DEBUG:
+                        print('Event {}: {}'.format(event_number, reason))
+                    continue
 
-        #######################################################################
+                writer.save_event(event_number, rows)
+                replaced += 1
 
-        # If a table is missing then recreate all tables
-        if not check(self):
-            self.clear()
-            create_tables(self)
+        # Write the remaining rows
+        writer.close()
+        print(writer.report())
 
-        # Find the latest bgpstream.com event number with the last tweet sent
-        # by @bgpstream
-        last_event_number = get_last_tweet_info()
+        # The in-memory indexes of the events load them again
+        if replaced:
+            cursor.execute('INSERT INTO Reextraction (replaced) VALUES (%s);',
+                           (replaced,))
+            self.connection.commit()
 
-        # Find the highest event number in the database to find the last tweet
-        # that had been added
-        latest_entry_number = get_latest_database_entry(self)
+        # The replaced events may have changed every statistic
+        if self.backend.ANALYTICS:
+            Rollups(self.connection).rebuild()
 
-        # Save the new events inside the database
-        save_events(self, last_event_number, latest_entry_number)
+        return replaced, skipped
+
+    ###########################################################################
+
+    def watch(self, source, fetcher=None, cache=None, retry=None):
+        """ Daemon mode: fetches, parses and inserts every event announced by
+            'source' (TwitterEventSource or FeedEventSource) as soon as it
+            arrives. The database connection and the HTTP session stay open
+            between events, and every event is committed on its own
+        """
+
+        if fetcher is None:
+            fetcher = PageFetcher()
+        if cache is None:
+            cache = FileCache()
+
+        writer = self.open_writer(batch_size=1, flush_interval=0, retry=retry)
+
+        source.start()
+        try:
+            for event_number in source.events():
+                # Events announced twice, or already fetched by a batch run
+                if event_number in writer.state.ids:
+                    continue
+
+                start = time.monotonic()
+
+                # The daemon outlives the outages of bgpstream.com: the event
+                # goes to the negative cache, and is retried by the next fill
+                try:
+                    status, page = fetcher.get(event_number)
+                except requests.RequestException as error:
+                    status, page = error, None
+
+                if page is not None:
+                    cache.put(event_number, page)
+
+                rows, reason = page_rows(event_number, status, page)
+                writer.save_event(event_number, rows, reason)
+
+                print('Event {}: {} in {:.2f}s'.format(
+                    event_number, reason or 'saved',
+                    time.monotonic() - start))
+                sys.stdout.flush()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            source.stop()
+            writer.close()
 
     ###########################################################################
 
@@ -509,15 +830,162 @@ if __name__ == "__main__":
     clear_database = args.clear_database
     db_username = args.username
     db_name = args.database
+    fetcher = PageFetcher(url=args.url, workers=args.workers, rate=args.rate,
+                          retries=args.retries, stream=args.stream)
 
-    global DEBUG
     DEBUG = args.debug
 
-    # Create html directory
-    if not os.path.exists('html/'):
-        os.makedirs('html/')
+    # Features that only postgresql provides
+    if args.backend != 'postgres' and (
+            args.command == 'query' or args.partitioned or
+            args.detach_before or args.rebuild_rollups or
+            args.check_rollups or args.enqueue or args.worker):
+        parser.error('queries, partitions, rollups and the work queue need '
+                     '--backend postgres')
+
+    # Instrumentation of the run, reported at exit
+    profiler = None
+    if args.profile is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if args.metrics_file is not None:
+        METRICS.export(args.metrics_file, args.metrics_interval)
+    atexit.register(report_run, args.metrics_json, args.metrics_file,
+                    profiler, args.profile)
+
+    if args.command == 'query':
+        # Lookups only, the events are not modified. The views that add the
+        # AS names are created if needed
+        database = Database(db_name, db_username, False)
+        if not database.prepare_views():
+            sys.exit('The tables of {} do not exist yet'.format(db_name))
+        events = find_events(database.connection,
+                             args.types or EVENT_TABLES,
+                             prefix=args.prefix, match=args.match,
+                             asn=args.asn, since=args.since, until=args.until,
+                             limit=args.limit)
+        for type, row in events:
+            row['type'] = type
+            print(json.dumps(row, default=str))
+        sys.exit()
+
+    if args.command == 'export':
+        # Snapshot of the tables for the analyses, which are not modified
+        database = Database(db_name, db_username, False,
+                            backend=args.backend)
+        if not database.prepare_views():
+            sys.exit('The tables of {} do not exist yet'.format(db_name))
+        counts = export_tables(database.connection, args.dir,
+                               args.tables or EXPORT_TABLES,
+                               args.compression)
+        for table_name, count in counts.items():
+            print('Exported {} rows of {}'.format(count, table_name))
+        sys.exit()
+
+    if args.migrate_cache:
+        # One-time conversion of the loose files to the segment store
+        print('Migrated {} pages'.format(migrate(args.cache_dir)))
+        sys.exit()
+
+    # Open the page cache, which creates its directory
+    cache = open_cache(args.cache, args.cache_dir)
 
     # Preparing the database, and resetting it if clear_database is true
-    database = Database(db_name, db_username, clear_database)
-
-    database.fill()  # Fill the database with tweets
+    database = Database(db_name, db_username, clear_database,
+                        args.partitioned, args.backend, args.strip_as_names)
+
+    if args.detach_before:
+        # Old events leave the event tables, and therefore the rollups
+        cache.close()
+        database.prepare()
+        if not is_partitioned(database.connection):
+            sys.exit('The event tables are not partitioned')
+        partitions = Partitions(database.connection)
+        for name in partitions.detach(args.detach_before,
+                                      args.archive_schema):
+            print('Detached {}'.format(name))
+        Rollups(database.connection).rebuild()
+        sys.exit()
+
+    if args.normalize_as_names:
+        # Names stored in the rows of the events, once the queries read the
+        # views (see --strip-as-names)
+        cache.close()
+        database.prepare()
+        removed = AsNames(database.connection,
+                          locking=database.backend.ANALYTICS).normalize()
+        for table_name, count in sorted(removed.items()):
+            print('Removed the AS names of {} rows of {}'.format(count,
+                                                                table_name))
+        sys.exit()
+
+    if args.rebuild_rollups or args.check_rollups:
+        # Maintenance of the statistics tables
+        cache.close()
+        database.prepare()
+        rollups = Rollups(database.connection)
+        if args.rebuild_rollups:
+            rollups.rebuild()
+        if args.check_rollups:
+            valid = rollups.check()
+            print('Rollups are {}'.format('valid' if valid else 'invalid'))
+            sys.exit(0 if valid else 1)
+        sys.exit()
+
+    # Schedule of the retries of failed events
+    retry = {
+        'delay': datetime.timedelta(hours=args.retry_delay),
+        'max_delay': datetime.timedelta(hours=args.retry_max_delay),
+        'max_age': datetime.timedelta(days=args.retry_max_age),
+    }
+
+    if args.enqueue:
+        # Ranges of events for the workers, which may run on other hosts
+        cache.close()
+        queued = database.enqueue(fetcher, args.last_event, args.discover_head,
+                                  args.range_size, retry)
+        print('Queued {} ranges'.format(queued))
+        for state, (ranges, ids) in WorkQueue(
+                database.connection).status().items():
+            print('{}: {} ranges, {} events'.format(state, ranges, ids))
+        sys.exit()
+
+    if args.reparse_cache:
+        # Rebuild the database from the pages that are stored offline
+        cache.close()
+        database.reparse_cache(args.cache, args.cache_dir, args.processes,
+                               args.batch_size, args.flush_interval)
+    elif args.reextract or args.reextract_types:
+        # Replace the events whose extraction changed, from the pages that
+        # are stored offline
+        cache.close()
+        replaced, skipped = database.reextract(
+            args.cache, args.cache_dir, args.reextract_types, args.processes,
+            args.batch_size, args.flush_interval)
+        print('Replaced {} events, {} left as they were'.format(replaced,
+                                                                skipped))
+    elif args.daemon:
+        # Insert the events as they are announced
+        if args.event_feed is not None:
+            source = FeedEventSource(args.event_feed)
+        else:
+            source = TwitterEventSource()
+        database.watch(source, fetcher, cache, retry)
+        cache.close()
+    else:
+        # Fill the database with tweets
+        pipeline = None
+        if args.pipeline:
+            pipeline = {
+                'parse_workers': args.parse_workers,
+                'queue_size': args.queue_size,
+                'report_interval': 10 if DEBUG else None,
+            }
+        queue = None
+        if args.worker:
+            queue = WorkQueue(database.connection,
+                              lease_seconds=args.lease_seconds)
+        database.fill(fetcher, cache, args.batch_size, args.flush_interval,
+                      retry, pipeline, args.last_event, args.discover_head,
+                      queue)
+        cache.close()
@@ -0,0 +1,180 @@
+###############################################################################
+# Imports
+
+# BGPStream Twitter mining
+import tweepy
+from tweepy import Stream
+from tweepy import OAuthHandler
+from tweepy.streaming import StreamListener
+
+# Twitter app credentials
+from credentials import *
+
+# Run statistics
+from metrics import METRICS
+
+# General utility
+import queue
+import sys
+
+###############################################################################
+# Twitter
+
+
+def twitter_auth():
+    """ Returns: the OAuthHandler of the Twitter app """
+
+    auth = OAuthHandler(twitterConsumerKey, twitterConsumerSecret)
+    auth.set_access_token(twitterAccessToken, twitterAccessSecret)
+
+    return auth
+
+###############################################################################
+
+
+def tweet_event_number(entities):
+    """ Extracts the bgpstream number from the entities of a tweet
+        Returns: the event number, or None if the tweet has no event link
+    """
+
+    for url in entities.get('urls', []):
+        expanded_url = url.get('expanded_url') or ''
+        if '/event/' in expanded_url:
+            return int(expanded_url.rstrip('/').split('/')[-1])
+
+    return None
+
+###############################################################################
+
+
+def get_last_tweet_info(account='bgpstream'):
+    """ Look for the last tweet posted by @bgpstream
+        Returns: number of the last bgpstream event
+    """
+
+    api = tweepy.API(twitter_auth())
+
+    # Retrieve last tweet from timeline
+    with METRICS.timer('twitter_seconds'):
+        last_tweet = api.user_timeline(screen_name=account, count=1)[0]
+
+    # Extract bgpstream number from the last tweet
+    event_number = int(last_tweet.entities
+                       ['urls'][0]['expanded_url'].split('/')[-1])
+
+    return event_number
+
+###############################################################################
+# Event sources
+
+
+class TwitterEventSource(StreamListener):
+    """ Listens to the tweets of @bgpstream with the streaming API and yields
+        the number of every new event
+    """
+
+    def __init__(self, account='bgpstream'):
+        super().__init__()
+        self.account = account
+        self.queue = queue.Queue()
+        self.stream = None
+
+    ###########################################################################
+
+    def start(self):
+        """ Connects to the streaming API in a background thread """
+
+        auth = twitter_auth()
+        user = tweepy.API(auth).get_user(screen_name=self.account)
+
+        self.stream = Stream(auth, self)
+        self.stream.filter(follow=[user.id_str], is_async=True)
+
+    ###########################################################################
+
+    def on_status(self, status):
+        # Following a user also delivers the replies and retweets of others
+        if status.user.screen_name.lower() != self.account.lower():
+            return True
+
+        event_number = tweet_event_number(status.entities)
+        if event_number is not None:
+            METRICS.count('tweeted_events')
+            self.queue.put(event_number)
+
+        return True
+
+    ###########################################################################
+
+    def on_error(self, status_code):
+        print('Twitter stream error {}'.format(status_code), file=sys.stderr)
+
+        # Returning True makes tweepy reconnect with its own backoff
+        return True
+
+    ###########################################################################
+
+    def events(self):
+        """ Yields the event numbers as they are tweeted """
+
+        while True:
+            yield self.queue.get()
+
+    ###########################################################################
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.disconnect()
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('TwitterEventSource({!r})'.format(self.account))
+
+
+###############################################################################
+
+
+class FeedEventSource():
+    """ Reads event numbers, one per line, from a file, a named pipe or the
+        standard input ('-'). Replaces Twitter to run the daemon offline
+    """
+
+    def __init__(self, path='-'):
+        self.path = path
+        self.file = None
+
+    ###########################################################################
+
+    def start(self):
+        self.file = sys.stdin if self.path == '-' else open(self.path)
+
+    ###########################################################################
+
+    def events(self):
+        """ Yields the event numbers until the end of the feed. The lines that
+            are not event numbers are skipped
+        """
+
+        for line in self.file:
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                yield int(line)
+            except ValueError:
+                METRICS.count('feed_errors')
+                print('Skipping invalid event number {!r}'.format(line),
+                      file=sys.stderr)
+
+    ###########################################################################
+
+    def stop(self):
+        if self.file is not None and self.file is not sys.stdin:
+            self.file.close()
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('FeedEventSource({!r})'.format(self.path))
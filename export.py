@@ -0,0 +1,130 @@
+###############################################################################
+# Imports
+
+# Columnar files, optional: only needed by the export
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# General utility
+import os
+
+###############################################################################
+# Column types
+
+# Arrow type of every exported column. ASNs are unsigned 32 bits integers
+# and times are timestamps, so that they can be compared and grouped without
+# any conversion once loaded
+COLUMNS = {
+    'Outage': (
+        ('id', 'int32'),
+        ('start_time', 'timestamp'),
+        ('end_time', 'timestamp'),
+        ('asn', 'uint32'),
+        ('as_name', 'string'),
+        ('number_of_prefixes', 'int16'),
+        ('percentage', 'float32'),
+    ),
+    'Hijack': (
+        ('id', 'int32'),
+        ('start_time', 'timestamp'),
+        ('original_prefix', 'string'),
+        ('original_asn', 'uint32'),
+        ('original_as_name', 'string'),
+        ('hj_time', 'timestamp'),
+        ('hj_prefix', 'string'),
+        ('hj_asn', 'uint32'),
+        ('hj_as_name', 'string'),
+        ('hj_as_path', 'string'),
+        ('number_of_peers', 'int16'),
+    ),
+    'Leak': (
+        ('id', 'int32'),
+        ('start_time', 'timestamp'),
+        ('prefix', 'string'),
+        ('original_asn', 'uint32'),
+        ('original_as_name', 'string'),
+        ('leaking_asn', 'uint32'),
+        ('leaking_as_name', 'string'),
+        ('as_path', 'string'),
+        ('number_of_peers', 'int16'),
+    ),
+    'Leaker': (
+        ('id', 'int32'),
+        ('asn', 'uint32'),
+        ('as_name', 'string'),
+        ('leak', 'int32'),
+    ),
+}
+
+# Tables in the order in which they are exported
+EXPORT_TABLES = ('Outage', 'Hijack', 'Leak', 'Leaker')
+
+
+def arrow_schema(table_name):
+    """ Returns: the pyarrow schema of the export of 'table_name' """
+
+    return pyarrow.schema([
+        (column, pyarrow.timestamp('s') if type == 'timestamp'
+         else getattr(pyarrow, type)())
+        for column, type in COLUMNS[table_name]])
+
+###############################################################################
+# Export
+
+
+def export_table(connection, table_name, path, compression='zstd',
+                 batch_size=100000):
+    """ Writes every row of 'table_name' to the Parquet file 'path', reading
+        'batch_size' rows at a time so that the memory stays flat
+        Returns: the number of exported rows
+    """
+
+    if pyarrow is None:
+        raise RuntimeError('The export needs pyarrow: pip install pyarrow')
+
+    schema = arrow_schema(table_name)
+    columns = [column for column, _ in COLUMNS[table_name]]
+
+    # Server side cursor on postgresql: the rows are not all loaded at once
+    cursor = connection.cursor('export_{}'.format(table_name.lower()))
+    # The views add the AS names, which are stored once per AS
+    cursor.execute('SELECT {} FROM {}View ORDER BY id;'.format(
+        ', '.join(columns), table_name))
+
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema,
+                                       compression=compression) as writer:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+
+            arrays = [pyarrow.array([row[index] for row in rows],
+                                    type=field.type)
+                      for index, field in enumerate(schema)]
+            writer.write_batch(pyarrow.record_batch(arrays, schema=schema))
+            count += len(rows)
+
+    cursor.close()
+    connection.rollback()
+
+    return count
+
+###############################################################################
+
+
+def export_tables(connection, dir, tables=EXPORT_TABLES, compression='zstd'):
+    """ Exports every table of 'tables' to '<dir>/<table>.parquet'
+        Returns: {table_name: number of exported rows}
+    """
+
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+
+    return {table_name: export_table(connection, table_name,
+                                     os.path.join(dir, table_name + '.parquet'),
+                                     compression)
+            for table_name in tables}
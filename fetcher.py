@@ -0,0 +1,336 @@
+###############################################################################
+# Imports
+
+import requests  # Webpage requests
+
+# Early-terminating page reads
+from page_parser import PageBlock
+
+# Concurrency
+import threading
+import collections
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Run statistics
+from metrics import METRICS
+
+# General utility
+import codecs
+import time
+
+###############################################################################
+# Rate limiting
+
+
+class RateLimiter():
+    """ Token bucket shared by every worker thread so that the total number of
+        requests per second never exceeds 'rate'
+    """
+
+    def __init__(self, rate):
+        """ A rate of 0 (or None) disables the limit """
+
+        self.rate = rate
+        self.tokens = max(1.0, rate or 0)
+        self.capacity = self.tokens
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    ###########################################################################
+
+    def acquire(self):
+        """ Blocks until a request can be sent """
+
+        if not self.rate:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+
+                # Refill the bucket with the tokens earned since last time
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.last) * self.rate)
+                self.last = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                # Time needed to earn the missing token
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+###############################################################################
+# Page fetcher
+
+
+class PageFetcher():
+    """ Downloads bgpstream.com event pages with a pool of worker threads, a
+        global requests-per-second cap and a retry policy with exponential
+        backoff
+    """
+
+    # Status codes that are worth retrying. A 500 is what bgpstream.com
+    # answers for an event that does not exist, so it is not retried.
+    RETRY_STATUS = (429, 502, 503, 504)
+
+    # Status codes of the events that do not exist
+    MISSING_STATUS = (404, 500)
+
+    # Status codes of the servers that do not answer HEAD requests
+    HEAD_REFUSED = (405, 501)
+
+    # Number of bytes read at a time in streaming mode
+    CHUNK_SIZE = 4096
+
+    # In streaming mode, the end of a page is still read when it is shorter
+    # than this, so that the connection is kept alive rather than reopened
+    DRAIN_SIZE = 16384
+
+    def __init__(self, url='https://bgpstream.com/event/', workers=1, rate=0,
+                 retries=3, backoff=0.5, timeout=30, stream=False):
+        """ With 'stream', a page is read as it arrives and only until the
+            block that the parser needs is complete: only that block is
+            returned (see PageBlock)
+        """
+
+        self.url = url
+        self.workers = max(1, workers)
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.stream = stream
+
+        # One session per thread: sessions keep connections alive but they
+        # are not meant to be shared between threads
+        self.local = threading.local()
+
+        # Method of the existence probes, GET if the server refuses HEAD
+        self.probe_method = 'HEAD'
+
+    ###########################################################################
+
+    def session(self):
+        """ Returns: the requests session of the calling thread """
+
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.session()
+
+        return self.local.session
+
+    ###########################################################################
+
+    def get(self, event_number, method='GET'):
+        """ Downloads a single event page, retrying transient failures. With
+            the 'HEAD' method only the status is asked
+            Returns:
+                the status code
+                the page text (empty for HEAD), or only its block in
+                streaming mode, or None if the event does not exist
+        """
+
+        attempt = 0
+        while True:
+            with METRICS.timer('rate_limit_wait_seconds'):
+                self.limiter.acquire()
+
+            start = time.perf_counter()
+            try:
+                page = self.session().request(method,
+                                              self.url + str(event_number),
+                                              timeout=self.timeout,
+                                              stream=self.stream)
+                text = self.read(page)
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as error:
+                METRICS.count('http_errors', error=type(error).__name__)
+                if attempt >= self.retries:
+                    raise
+            else:
+                METRICS.observe('http_seconds', time.perf_counter() - start)
+                METRICS.count('http_responses', status=page.status_code)
+                if page.status_code not in self.RETRY_STATUS:
+                    if page.status_code == 200:
+                        return page.status_code, text
+                    return page.status_code, None
+                if attempt >= self.retries:
+                    return page.status_code, None
+
+            # Wait before retrying: backoff, 2 * backoff, 4 * backoff...
+            METRICS.count('http_retries')
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    ###########################################################################
+
+    def read(self, response):
+        """ Returns: the text of 'response', or in streaming mode the block of
+            the page that the parser needs. The rest of the page is only read
+            when it is short, so that the connection can be kept alive
+        """
+
+        if not self.stream or response.status_code != 200 or \
+                response.request.method != 'GET':
+            text = response.text
+        else:
+            # The body is decompressed as it arrives, then decoded
+            decoder = codecs.getincrementaldecoder(
+                response.encoding or 'utf-8')(errors='replace')
+            block = PageBlock()
+            for chunk in response.iter_content(self.CHUNK_SIZE):
+                if block.feed(decoder.decode(chunk)):
+                    break
+            else:
+                block.feed(decoder.decode(b'', final=True))
+                block.close()
+
+            text = block.page
+
+            remaining = response.raw.length_remaining
+            if remaining is not None and remaining <= self.DRAIN_SIZE:
+                for _ in response.iter_content(self.CHUNK_SIZE):
+                    pass
+
+        # Bytes received, compressed if the server compressed the page
+        METRICS.count('http_bytes', response.raw.tell())
+        response.close()
+
+        return text
+
+    ###########################################################################
+
+    def exists(self, event_number):
+        """ Returns: True if the page of 'event_number' exists, without
+            downloading it when the server answers HEAD requests
+        """
+
+        METRICS.count('head_probes')
+        status, _ = self.get(event_number, self.probe_method)
+
+        if status in self.HEAD_REFUSED and self.probe_method == 'HEAD':
+            self.probe_method = 'GET'
+            return self.exists(event_number)
+
+        if status == 200:
+            return True
+        if status in self.MISSING_STATUS:
+            return False
+
+        raise RuntimeError('Unexpected status {} for event {}'.format(
+            status, event_number))
+
+    ###########################################################################
+
+    def discover_head(self, start=0, window=4):
+        """ Finds the latest event without Twitter, from 'start', the latest
+            known event (or 0). The probes gallop forward, doubling their step
+            until they find no event, then a binary search narrows the gap.
+            Event numbers may be missing, so a probe of n looks at up to
+            'window' consecutive numbers from n: the head is underestimated
+            only if 'window' consecutive events are missing right after it
+            Returns:
+                the number of the latest event, or 'start' if there is no
+                event after it
+                the number of requests sent
+        """
+
+        requests_sent = 0
+
+        def probe(event_number, limit=None):
+            """ Returns: the first existing event of the window that starts at
+                'event_number', or None
+            """
+
+            nonlocal requests_sent
+
+            end = event_number + window
+            if limit is not None:
+                end = min(end, limit)
+
+            for candidate in range(event_number, end):
+                requests_sent += 1
+                if self.exists(candidate):
+                    return candidate
+
+            return None
+
+        # Gallop: 'low' exists (or is 'start'), nothing is found at 'high'
+        low, step = start, 1
+        while True:
+            found = probe(low + step)
+            if found is None:
+                high = low + step
+                break
+            low, step = found, step * 2
+
+        # Binary search between the last hit and the first miss
+        while high - low > 1:
+            middle = (low + high) // 2
+            found = probe(middle, high)
+            if found is None:
+                high = middle
+            else:
+                low = found
+
+        return low, requests_sent
+
+    ###########################################################################
+
+    def fetch(self, event_numbers, load=None, store=None):
+        """ Downloads every event of 'event_numbers' in parallel. Pages are
+            yielded in the order of 'event_numbers' whatever the order in
+            which the downloads complete.
+            'load(event_number)' is tried before downloading and may return
+            the page from a cache, 'store(event_number, page)' is called by
+            the workers after every successful download.
+            Returns:
+                the event number
+                the status code, or the exception of the last attempt if the
+                page could not be downloaded
+                the page text, or None if the event does not exist
+        """
+
+        def download(event_number):
+            # A failed download does not stop the other events
+            try:
+                status, page = self.get(event_number)
+            except requests.RequestException as error:
+                return error, None
+
+            if page is not None and store is not None:
+                store(event_number, page)
+            return status, page
+
+        # Number of pages that can be downloaded ahead of the consumer. This
+        # bounds the memory used when the consumer is slower than the network
+        window = self.workers * 4
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = collections.deque()
+
+            for event_number in event_numbers:
+                page = load(event_number) if load is not None else None
+
+                if page is not None:
+                    # Cache hit: no need to bother a worker
+                    future = Future()
+                    future.set_result((200, page))
+                else:
+                    future = executor.submit(download, event_number)
+
+                pending.append((event_number, future))
+
+                # Hand the oldest pages to the consumer, in order
+                while len(pending) >= window:
+                    event_number, future = pending.popleft()
+                    status, page = future.result()
+                    yield event_number, status, page
+
+            while pending:
+                event_number, future = pending.popleft()
+                status, page = future.result()
+                yield event_number, status, page
@@ -0,0 +1,298 @@
+###############################################################################
+# Imports
+
+# Concurrency
+import threading
+
+# General utility
+import bisect
+import contextlib
+import json
+import os
+import time
+
+###############################################################################
+# Histograms
+
+# Upper bounds in seconds of the latency buckets. The parsing of a page takes
+# a few tens of microseconds
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+           0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+           10.0, 30.0)
+
+
+class Histogram():
+    """ Number of observations per latency bucket, with their sum and maximum
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)  # The last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    ###########################################################################
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    ###########################################################################
+
+    def merge(self, other):
+        """ Adds the observations of the Histogram 'other' """
+
+        self.buckets = [count + other_count for count, other_count
+                        in zip(self.buckets, other.buckets)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    ###########################################################################
+
+    def quantile(self, q):
+        """ Returns: the upper bound of the bucket holding the 'q' quantile,
+            or the maximum if it is in the last bucket
+        """
+
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+    ###########################################################################
+
+    def summary(self):
+        """ Returns: a dictionary describing the observations """
+
+        return {
+            'count': self.count,
+            'seconds': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+        }
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('Histogram({} observations)'.format(self.count))
+
+
+###############################################################################
+# Metrics
+
+
+class Metrics():
+    """ Thread-safe counters and latency histograms of a run, identified by a
+        name and optional labels, i.e. count('rows', table='Leak')
+    """
+
+    def __init__(self, prefix='bgpstream'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+        # {(name, ((label, value), ...)): value or Histogram}
+        self.counters = {}
+        self.histograms = {}
+
+    ###########################################################################
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    ###########################################################################
+
+    def count(self, name, value=1, **labels):
+        """ Adds 'value' to a counter """
+
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    ###########################################################################
+
+    def observe(self, name, seconds, **labels):
+        """ Adds a duration to a histogram """
+
+        key = self.key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    ###########################################################################
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """ Observes the duration of the 'with' block in a histogram """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    ###########################################################################
+
+    def drain(self):
+        """ Resets the counters and histograms, i.e. in a worker process
+            whose metrics are sent to the main one
+            Returns: the (counters, histograms) recorded since the last drain
+        """
+
+        with self.lock:
+            drained = self.counters, self.histograms
+            self.counters = {}
+            self.histograms = {}
+
+        return drained
+
+    ###########################################################################
+
+    def merge(self, drained):
+        """ Adds the (counters, histograms) 'drained' from another process """
+
+        counters, histograms = drained
+        with self.lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, histogram in histograms.items():
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram()
+                self.histograms[key].merge(histogram)
+
+    ###########################################################################
+
+    @staticmethod
+    def label_name(name, labels):
+        """ Returns: 'name' followed by its labels, i.e. 'rows{table=Leak}' """
+
+        if not labels:
+            return name
+
+        return '{}{{{}}}'.format(name, ','.join(
+            '{}={}'.format(label, value) for label, value in labels))
+
+    ###########################################################################
+
+    def summary(self):
+        """ Returns: every counter and histogram as a dictionary """
+
+        with self.lock:
+            return {
+                'elapsed_seconds': time.time() - self.start,
+                'counters': {self.label_name(*key): value
+                             for key, value in sorted(self.counters.items())},
+                'timers': {self.label_name(*key): histogram.summary()
+                           for key, histogram
+                           in sorted(self.histograms.items())},
+            }
+
+    ###########################################################################
+
+    def prometheus(self):
+        """ Returns: every counter and histogram in the Prometheus text
+            exposition format
+        """
+
+        def labels_text(labels, extra=()):
+            labels = list(labels) + list(extra)
+            if not labels:
+                return ''
+            return '{' + ','.join(
+                '{}="{}"'.format(label, str(value).replace('"', '\\"'))
+                for label, value in labels) + '}'
+
+        lines = []
+        with self.lock:
+            names = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = '{}_{}_total'.format(self.prefix, name)
+                if metric not in names:
+                    lines.append('# TYPE {} counter'.format(metric))
+                    names.add(metric)
+                lines.append('{}{} {}'.format(metric, labels_text(labels),
+                                              value))
+
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = '{}_{}'.format(self.prefix, name)
+                if metric not in names:
+                    lines.append('# TYPE {} histogram'.format(metric))
+                    names.add(metric)
+
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',),
+                                        histogram.buckets):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(
+                        metric, labels_text(labels, [('le', bound)]),
+                        cumulative))
+                lines.append('{}_sum{} {}'.format(metric, labels_text(labels),
+                                                  histogram.sum))
+                lines.append('{}_count{} {}'.format(
+                    metric, labels_text(labels), histogram.count))
+
+        return '\n'.join(lines) + '\n'
+
+    ###########################################################################
+
+    def write_json(self, path):
+        """ Writes the summary to 'path', '-' for the standard output """
+
+        text = json.dumps(self.summary(), indent=2, sort_keys=True)
+        if path == '-':
+            print(text)
+        else:
+            with open(path, 'w') as file:
+                file.write(text + '\n')
+
+    ###########################################################################
+
+    def write_prometheus(self, path):
+        """ Replaces 'path' with the Prometheus text, so that a scraper never
+            reads a partial file
+        """
+
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as file:
+            file.write(self.prometheus())
+        os.replace(temporary, path)
+
+    ###########################################################################
+
+    def export(self, path, interval=15.0):
+        """ Writes the Prometheus file every 'interval' seconds in a
+            background thread
+            Returns: a threading.Event that stops the thread once set
+        """
+
+        done = threading.Event()
+
+        def run():
+            while not done.wait(interval):
+                self.write_prometheus(path)
+
+        threading.Thread(target=run, daemon=True).start()
+        return done
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('Metrics({} counters, {} timers)'.format(
+            len(self.counters), len(self.histograms)))
+
+
+###############################################################################
+
+# Metrics of the running process, shared by every module
+METRICS = Metrics()
@@ -0,0 +1,121 @@
+###############################################################################
+# Imports
+
+from storage import execute_values  # Multi-row inserts
+
+# General utility
+import datetime
+
+###############################################################################
+# Negative cache
+
+
+class NegativeCache():
+    """ Keeps track of the bgpstream.com events that could not be downloaded
+        or parsed, in the FailedEvent table. A failed event is retried after
+        'delay', then after twice that delay and so on up to 'max_delay'. It
+        is never retried once 'max_age' has passed since its first failure.
+    """
+
+    def __init__(self, connection, delay=datetime.timedelta(hours=1),
+                 max_delay=datetime.timedelta(days=7),
+                 max_age=datetime.timedelta(days=30)):
+        self.connection = connection
+        self.delay = delay
+        self.max_delay = max_delay
+        self.max_age = max_age
+
+        # {id: (reason, attempts, first_failure, last_attempt)}
+        cursor = connection.cursor()
+        cursor.execute('SELECT id, reason, attempts, first_failure, '
+                       'last_attempt FROM FailedEvent;')
+        self.failures = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        # Changes since the last save
+        self.updated = set()
+        self.deleted = set()
+
+    ###########################################################################
+
+    def due(self, event_number, now=None):
+        """ Returns: True if 'event_number' never failed or if it is time to
+            retry it
+        """
+
+        if event_number not in self.failures:
+            return True
+
+        now = now or datetime.datetime.utcnow()
+        reason, attempts, first_failure, last_attempt = \
+            self.failures[event_number]
+
+        # Given up
+        if now - first_failure >= self.max_age:
+            return False
+
+        # Exponential backoff: delay, 2 * delay, 4 * delay... The doubling
+        # stops at max_delay, so that the delay cannot overflow
+        delay = self.delay
+        for _ in range(attempts - 1):
+            if delay >= self.max_delay:
+                break
+            delay *= 2
+        delay = min(delay, self.max_delay)
+
+        return now - last_attempt >= delay
+
+    ###########################################################################
+
+    def fail(self, event_number, reason, now=None):
+        """ Records a failed attempt to process 'event_number' """
+
+        now = now or datetime.datetime.utcnow()
+
+        if event_number in self.failures:
+            _, attempts, first_failure, _ = self.failures[event_number]
+            self.failures[event_number] = (reason, attempts + 1,
+                                           first_failure, now)
+        else:
+            self.failures[event_number] = (reason, 1, now, now)
+
+        self.updated.add(event_number)
+        self.deleted.discard(event_number)
+
+    ###########################################################################
+
+    def succeed(self, event_number):
+        """ Forgets the failures of 'event_number' """
+
+        if event_number in self.failures:
+            del self.failures[event_number]
+            self.deleted.add(event_number)
+            self.updated.discard(event_number)
+
+    ###########################################################################
+
+    def save(self, cursor):
+        """ Writes the changes since the last save. Meant to be called right
+            before the commit of the rows of the events
+        """
+
+        if self.deleted:
+            cursor.executemany('DELETE FROM FailedEvent WHERE id = %s;',
+                               [(id,) for id in self.deleted])
+
+        if self.updated:
+            execute_values(
+                cursor,
+                'INSERT INTO FailedEvent (id, reason, attempts, '
+                'first_failure, last_attempt) VALUES %s '
+                'ON CONFLICT (id) DO UPDATE SET reason = EXCLUDED.reason, '
+                'attempts = EXCLUDED.attempts, '
+                'last_attempt = EXCLUDED.last_attempt',
+                [(id,) + self.failures[id] for id in self.updated])
+
+        self.updated = set()
+        self.deleted = set()
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('NegativeCache')
@@ -0,0 +1,393 @@
+###############################################################################
+# Imports
+
+import fcntl    # Locks shared with the other processes
+import mmap     # Zero-copy reads of the segments
+import struct   # Binary index records
+import zlib     # Page compression
+
+# Run statistics
+from metrics import METRICS
+
+# General utility
+import os
+import threading
+
+###############################################################################
+# Loose files
+
+
+class FileCache():
+    """ Stores every event page in its own '<dir>/<event number>.txt' file """
+
+    def __init__(self, dir='html'):
+        self.dir = dir
+
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+
+    ###########################################################################
+
+    def path(self, event_number):
+        return '{}/{}.txt'.format(self.dir, event_number)
+
+    ###########################################################################
+
+    def get(self, event_number):
+        """ Returns: the page of 'event_number', or None if it is not cached
+        """
+
+        try:
+            with open(self.path(event_number)) as f:
+                page = f.read()
+        except FileNotFoundError:
+            METRICS.count('cache_misses', cache='files')
+            return None
+
+        METRICS.count('cache_hits', cache='files')
+        return page
+
+    ###########################################################################
+
+    def put(self, event_number, page):
+        """ Stores the page of 'event_number' """
+
+        with open(self.path(event_number), 'w') as f:
+            f.write(page)
+
+    ###########################################################################
+
+    def remove(self, event_number):
+        """ Deletes the page of 'event_number' """
+
+        os.remove(self.path(event_number))
+
+    ###########################################################################
+
+    def event_numbers(self):
+        """ Returns: the sorted list of the cached event numbers """
+
+        return sorted(int(name[:-len('.txt')]) for name in os.listdir(self.dir)
+                      if name.endswith('.txt') and name[:-len('.txt')].isdigit())
+
+    ###########################################################################
+
+    def __contains__(self, event_number):
+        return os.path.isfile(self.path(event_number))
+
+    ###########################################################################
+
+    def close(self):
+        pass
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('FileCache({!r})'.format(self.dir))
+
+
+###############################################################################
+# Segment store
+
+
+class SegmentCache():
+    """ Appends the compressed event pages to large segment files. An index
+        file maps every event number to its segment, offset and length, and
+        the pages are decompressed straight from a read-only memory map of
+        the segment.
+
+        Every page is compressed with zlib using the first stored page as a
+        preset dictionary: bgpstream.com pages share most of their html, so
+        each page only costs what differs from the first one.
+
+        Several processes can append to the same store, i.e. the backfill
+        workers of a host: a page is appended with the index file locked, at
+        the actual end of the segment. The pages stored by another process
+        after the store was opened are not seen by this one.
+
+        Layout of 'dir':
+            dictionary: the preset dictionary
+            index: (event number, segment, offset, length) records
+            <segment>.seg: concatenated compressed pages
+    """
+
+    # Index record: event number, segment number, offset, length
+    RECORD = struct.Struct('<IIQI')
+
+    # Size after which a new segment is started
+    SEGMENT_SIZE = 64 * 1024 * 1024
+
+    # zlib only uses the last 32KiB of a preset dictionary
+    DICTIONARY_SIZE = 32 * 1024
+
+    def __init__(self, dir='html', segment_size=SEGMENT_SIZE):
+        self.dir = dir
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+
+        # Preset dictionary, created with the first page
+        self.dictionary = None
+        if os.path.isfile(self.path('dictionary')):
+            with open(self.path('dictionary'), 'rb') as f:
+                self.dictionary = f.read()
+
+        # {event number: (segment, offset, length)}
+        self.index = {}
+        self.load_index()
+
+        # Read-only memory maps of the segments: {segment: mmap}
+        self.maps = {}
+
+        # Segment that is being appended
+        self.segment = max([entry[0] for entry in self.index.values()] or [1])
+        self.segment_file = None
+        self.index_file = None
+
+    ###########################################################################
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    ###########################################################################
+
+    def segment_path(self, segment):
+        return self.path('{:08d}.seg'.format(segment))
+
+    ###########################################################################
+
+    def load_index(self):
+        """ Reads the index file. A record truncated by a crash is ignored,
+            and the last record of an event wins
+        """
+
+        if not os.path.isfile(self.path('index')):
+            return
+
+        with open(self.path('index'), 'rb') as f:
+            data = f.read()
+
+        size = self.RECORD.size
+        for start in range(0, len(data) - size + 1, size):
+            event_number, segment, offset, length = self.RECORD.unpack_from(
+                data, start)
+            self.index[event_number] = (segment, offset, length)
+
+    ###########################################################################
+
+    def open_for_append(self):
+        """ Opens the current segment for writing, moving to the next segment
+            while the current one is full. Called with the index locked
+        """
+
+        if self.segment_file is None:
+            self.segment_file = open(self.segment_path(self.segment), 'ab')
+
+        # The segment may have been filled by another process
+        while self.segment_size_now() >= self.segment_size:
+            self.segment_file.close()
+            self.segment += 1
+            self.segment_file = open(self.segment_path(self.segment), 'ab')
+
+    ###########################################################################
+
+    def segment_size_now(self):
+        """ Returns: the size of the current segment, including what the other
+            processes appended to it
+        """
+
+        return os.fstat(self.segment_file.fileno()).st_size
+
+    ###########################################################################
+
+    def create_dictionary(self, data):
+        """ Makes the page 'data' the preset dictionary of every page, unless
+            another process created it since the store was opened. Called with
+            the index locked
+        """
+
+        if os.path.isfile(self.path('dictionary')):
+            with open(self.path('dictionary'), 'rb') as f:
+                self.dictionary = f.read()
+            return
+
+        # Renamed once complete, so that it is never read half written
+        self.dictionary = data[-self.DICTIONARY_SIZE:]
+        with open(self.path('dictionary.tmp'), 'wb') as f:
+            f.write(self.dictionary)
+        os.replace(self.path('dictionary.tmp'), self.path('dictionary'))
+
+    ###########################################################################
+
+    def compressor(self):
+        if self.dictionary:
+            return zlib.compressobj(9, zdict=self.dictionary)
+        return zlib.compressobj(9)
+
+    ###########################################################################
+
+    def decompressor(self):
+        if self.dictionary:
+            return zlib.decompressobj(zdict=self.dictionary)
+        return zlib.decompressobj()
+
+    ###########################################################################
+
+    def put(self, event_number, page):
+        """ Appends the page of 'event_number' to the current segment """
+
+        data = page.encode('utf-8')
+
+        with self.lock:
+            if self.index_file is None:
+                self.index_file = open(self.path('index'), 'ab')
+
+            # The other processes wait until the page and its record are
+            # written
+            fcntl.flock(self.index_file, fcntl.LOCK_EX)
+            try:
+                # The first page becomes the preset dictionary of every page
+                if self.dictionary is None:
+                    self.create_dictionary(data)
+
+                compressor = self.compressor()
+                data = compressor.compress(data) + compressor.flush()
+
+                # With 'ab', the page is written at the end of the segment,
+                # which tell() does not know if another process appended to it
+                self.open_for_append()
+                offset = self.segment_size_now()
+                self.segment_file.write(data)
+                self.segment_file.flush()
+
+                # The index is written after the page so that it never points
+                # to missing data
+                self.index_file.write(self.RECORD.pack(
+                    event_number, self.segment, offset, len(data)))
+                self.index_file.flush()
+            finally:
+                fcntl.flock(self.index_file, fcntl.LOCK_UN)
+
+            self.index[event_number] = (self.segment, offset, len(data))
+
+    ###########################################################################
+
+    def map(self, segment, end):
+        """ Returns: a memory map of 'segment' that covers at least 'end'
+            bytes. Segments that grew since they were mapped are remapped
+        """
+
+        mapping = self.maps.get(segment)
+        if mapping is None or len(mapping) < end:
+            if mapping is not None:
+                mapping.close()
+            with open(self.segment_path(segment), 'rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment] = mapping
+
+        return mapping
+
+    ###########################################################################
+
+    def get(self, event_number):
+        """ Returns: the page of 'event_number', or None if it is not cached
+        """
+
+        with self.lock:
+            entry = self.index.get(event_number)
+            if entry is None:
+                METRICS.count('cache_misses', cache='segments')
+                return None
+
+            segment, offset, length = entry
+            mapping = self.map(segment, offset + length)
+
+            # Decompress straight from the mapped segment
+            with memoryview(mapping) as view:
+                with view[offset:offset + length] as record:
+                    data = self.decompressor().decompress(record)
+
+        METRICS.count('cache_hits', cache='segments')
+        return data.decode('utf-8')
+
+    ###########################################################################
+
+    def event_numbers(self):
+        """ Returns: the sorted list of the cached event numbers """
+
+        return sorted(self.index)
+
+    ###########################################################################
+
+    def __contains__(self, event_number):
+        return event_number in self.index
+
+    ###########################################################################
+
+    def close(self):
+        with self.lock:
+            for mapping in self.maps.values():
+                mapping.close()
+            self.maps = {}
+
+            if self.segment_file is not None:
+                self.segment_file.close()
+                self.segment_file = None
+            if self.index_file is not None:
+                self.index_file.close()
+                self.index_file = None
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('SegmentCache({!r})'.format(self.dir))
+
+
+###############################################################################
+# Backends
+
+# Page cache backends, selected with --cache
+CACHES = {
+    'files': FileCache,
+    'segments': SegmentCache,
+}
+
+###############################################################################
+
+
+def open_cache(kind='files', dir='html'):
+    """ Returns: the page cache backend 'kind' stored in 'dir' """
+
+    return CACHES[kind](dir)
+
+###############################################################################
+
+
+def migrate(dir='html'):
+    """ Moves the loose '<dir>/<event number>.txt' pages into the segment
+        store of 'dir'. Each file is deleted once its page can be read back
+        from the segments, so an interrupted migration can be restarted
+        Returns: the number of migrated pages
+    """
+
+    files = FileCache(dir)
+    segments = SegmentCache(dir)
+
+    count = 0
+    try:
+        for event_number in files.event_numbers():
+            page = files.get(event_number)
+            segments.put(event_number, page)
+
+            if segments.get(event_number) != page:
+                raise RuntimeError('Event {} could not be read back from the '
+                                   'segments'.format(event_number))
+
+            files.remove(event_number)
+            count += 1
+    finally:
+        segments.close()
+
+    return count
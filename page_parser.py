@@ -0,0 +1,506 @@
+###############################################################################
+# Imports
+
+import re       # Regular expressions
+
+# Run statistics
+from metrics import METRICS
+
+# General utility
+import time
+
+###############################################################################
+# Parser version
+
+# Stored with every event row, so that the rows of an older parser can be
+# extracted again from the page cache (see Database.reextract). Increment it
+# when a change of the parser changes the extracted columns:
+# 1: first version
+# 2: the AS names of the hijacks no longer overlap
+PARSER_VERSION = 2
+
+###############################################################################
+# Field markers
+
+# Html tags
+TAG = re.compile('<.*?>')
+
+# Strings announcing the fields of each event type
+OUTAGE_FIELDS = ('Start time:', 'End time:', 'we detected an outage',
+                 'Number of Prefixes')
+LEAK_FIELDS = ('Start time:', 'Leaked prefix:', 'Leaked by',
+               'Example AS path:', 'Number of BGPMon peers', 'Leaked To:')
+HIJACK_FIELDS = ('Start time:', 'Expected prefix:', 'Expected ASN:',
+                 'But beginning at', 'Detected advertisement:',
+                 'Detected Origin ASN', 'Detected AS Path',
+                 'Detected by number of BGPMon')
+
+# Words that give away the type of a page, in the order of page_type
+TYPE_WORDS = (('outage', 'Outage'), ('hijack', 'Hijack'), ('Leak', 'Leak'))
+
+###############################################################################
+# Parsing
+
+
+def clean_html(raw_html):
+    """ Removes the html tags of 'raw_html' """
+
+    return TAG.sub('', raw_html)
+
+###############################################################################
+
+
+def page_type(page):
+    """ Determines the type of an event page
+        Returns: 'Outage', 'Hijack', 'Leak', or the concatenation of the types
+        mentioned by the page if there are several
+    """
+
+    return ''.join(type for word, type in TYPE_WORDS if word in page)
+
+###############################################################################
+
+
+class FieldLines():
+    """ Iterates over the lines of a page that contain one of 'fields'. The
+        other lines are skipped without being split or searched: the
+        position of every field is found beforehand with str.find.
+        Setting 'follow' makes the next line be returned whatever its content,
+        for the values that span several lines.
+    """
+
+    def __init__(self, page, fields):
+        self.page = page
+        self.follow = False
+        self.position = 0
+        self.index = 0
+
+        # Start offset of every line that contains a field
+        starts = set()
+        for field in fields:
+            found = page.find(field)
+            while found != -1:
+                starts.add(page.rfind('\n', 0, found) + 1)
+                end = page.find('\n', found)
+                if end == -1:
+                    break
+                found = page.find(field, end)
+
+        self.starts = sorted(starts)
+
+    ###########################################################################
+
+    def __iter__(self):
+        return self
+
+    ###########################################################################
+
+    def __next__(self):
+        if self.follow:
+            if self.position > len(self.page):
+                raise StopIteration
+        else:
+            # Jump to the next line that contains a field
+            while (self.index < len(self.starts) and
+                   self.starts[self.index] < self.position):
+                self.index += 1
+            if self.index == len(self.starts):
+                raise StopIteration
+            self.position = self.starts[self.index]
+
+        end = self.page.find('\n', self.position)
+        if end == -1:
+            end = len(self.page)
+
+        line = self.page[self.position:end]
+        self.position = end + 1
+
+        return line
+
+###############################################################################
+
+
+def parse_outage(page_number, page, queries, columns):
+    """ Extracts the columns of an Outage page """
+
+    for line in FieldLines(page, OUTAGE_FIELDS):
+        if "Start time:" in line:
+            words = line.split()
+            columns['start_time'] = words[2] + " " + words[3]
+        elif "End time:" in line:
+            words = line.split()
+            columns['end_time'] = words[2] + " " + words[3]
+        elif "we detected an outage" in line:
+            # Split cases where ASN is mentioned or when the country is
+            # mentioned
+            if "ASN" in line:
+                columns['asn'] = int(line.split('ASN')[1].split('(')[0])
+                columns['as_name'] = line.split('(')[1].split(')')[0]
+            else:
+                columns['asn'] = 0
+                columns['as_name'] = line.split('for ')[1].split()[0]
+        elif "Number of Prefixes" in line:
+            columns['number_of_prefixes'] = int(
+                line.split(':')[1].split('(')[0]
+            )
+            columns['percentage'] = int(
+                line.split('(')[1].split('%')[0]
+            ) / 100
+
+###############################################################################
+
+
+def parse_leak(page_number, page, queries, columns):
+    """ Extracts the columns of a Leak page, and the columns of its Leaker
+        rows which are stored in queries['Leaker']
+    """
+
+    # The list of leakers spans multiple lines
+    is_leaker = False
+    sub_query_columns = {'leak': [], 'asn': [], 'as_name': []}
+
+    lines = FieldLines(page, LEAK_FIELDS)
+    for line in lines:
+        if "Start time:" in line:
+            words = line.split()
+            columns['start_time'] = words[2] + " " + words[3]
+        if 'Leaked prefix:' in line:
+            tmp = line.split(': ')[1]
+            columns['prefix'] = tmp.split()[0]
+            columns['original_asn'] = int(tmp.split('AS')[1].split()[0])
+            tmp = tmp.split('(')[1].split(')')[0].split()[1:]
+            columns['original_as_name'] = ' '.join(tmp)
+        if 'Leaked by' in line:
+            words = line.split('AS')[1].split()
+            columns['leaking_asn'] = int(words[0])
+            columns['leaking_as_name'] = clean_html(' '.join(words[1:]))
+        if 'Example AS path:' in line:
+            columns['as_path'] = clean_html(line.split(': ')[1])[:-1]
+        if 'Number of BGPMon peers' in line:
+            columns['number_of_peers'] = int(clean_html(line.split(': ')[1]))
+        if 'Leaked To:' in line:
+            is_leaker = True
+            sub_query_columns['leak'] = page_number
+        if '<li>' in line and is_leaker:
+            sub_query_columns['asn'].append(clean_html(line.split()[0]))
+            sub_query_columns['as_name'].append(
+                line.split('(')[1].split(')')[0]
+            )
+        if '</td>' in line and is_leaker:
+            if 'Leaker' not in queries:
+                queries['Leaker'] = {}
+            for key, value in sub_query_columns.items():
+                queries['Leaker'][key] = value
+
+            is_leaker = False
+
+        # Every line of the list of leakers has to be read
+        lines.follow = is_leaker
+
+###############################################################################
+
+
+def parse_hijack(page_number, page, queries, columns):
+    """ Extracts the columns of a Hijack page """
+
+    # AS names are written after the line that announces the ASN: the column
+    # of the name that is expected, until the line of another field
+    name_column = None
+
+    lines = FieldLines(page, HIJACK_FIELDS)
+    for line in lines:
+        if name_column is not None and any(field in line
+                                           for field in HIJACK_FIELDS):
+            name_column = None
+
+        if "Start time:" in line:
+            words = line.split()
+            columns['start_time'] = words[2] + " " + words[3]
+        if 'Expected prefix:' in line:
+            columns['original_prefix'] = clean_html(line.split(': ')[1])
+        if 'Expected ASN:' in line:
+            columns['original_asn'] = int(line.split(': ')[1].split()[0])
+            name_column = 'original_as_name'
+        if 'But beginning at' in line:
+            words = line.split()
+            columns['hj_time'] = words[3] + " " + words[4]
+        if 'Detected advertisement:' in line:
+            columns['hj_prefix'] = clean_html(line.split(': ')[1])
+        if 'Detected Origin ASN' in line:
+            columns['hj_asn'] = int(line.split()[3])
+            name_column = 'hj_as_name'
+        if '(' in line and name_column == 'original_as_name':
+            columns['original_as_name'] = line.split('(')[1].split(')')[0]
+            name_column = None
+        if '(' in line and name_column == 'hj_as_name':
+            columns['hj_as_name'] = clean_html(
+                line.split('(')[1].split(')')[0]
+            )
+            name_column = None
+        if 'Detected AS Path' in line:
+            columns['hj_as_path'] = clean_html(line.split('Path ')[1])
+        if 'Detected by number of BGPMon' in line:
+            columns['number_of_peers'] = int(clean_html(line.split(':')[1]))
+
+        # The AS name may be on one of the next lines
+        lines.follow = name_column is not None
+
+###############################################################################
+
+# Field extractor of each event type
+PARSERS = {
+    'Outage': parse_outage,
+    'Leak': parse_leak,
+    'Hijack': parse_hijack,
+}
+
+###############################################################################
+
+
+def parse_html_page(page_number, page):
+    """ Extracts the information that will be inserted inside the database
+        Return: a dictionary {type: columns} where type is the event type
+        (i.e. Outage or Hijack) and columns a dictionary containing
+        {column_name: value}. Leak pages also have a 'Leaker' entry whose
+        values are lists.
+    """
+
+    # Determine page type
+    type = page_type(page)
+
+    queries = {}
+    queries[type] = {}
+
+    # the id becomes the bgpstream event number
+    columns = {'id': page_number}
+
+    if type in PARSERS:
+        PARSERS[type](page_number, page, queries, columns)
+
+    queries[type] = columns
+    return queries
+
+###############################################################################
+
+
+def query_iterator(queries):
+    """ Returns the next query to be inserted inside the database.
+        Necessary to extract queries from arrays of values
+    """
+
+    ###########################################################################
+
+    def is_empty(dictionary):
+        """ Tests if every list contained in this dictionary are empty """
+
+        for key, value in dictionary.items():
+            if isinstance(value, list) and len(value) != 0:
+                return False
+        else:
+            return True
+
+    ###########################################################################
+
+    for type, columns in queries.items():
+        values_list = {}
+        query = {}
+
+        for key, value in columns.items():
+            if isinstance(value, list):
+                for v in value:
+                    values_list[key] = value
+
+        # Case where the query is not a complicated one
+        if not values_list:
+            yield type, columns
+            continue
+
+        while not is_empty(values_list):
+            for key, value in columns.items():
+                if key not in values_list:
+                    query[key] = value
+                else:
+                    query[key] = values_list[key][0]
+                    values_list[key].pop(0)
+
+            yield type, query
+
+###############################################################################
+
+
+def extract_rows(page_number, page):
+    """ Parses an event page and flattens its queries into rows
+        Returns:
+            the list of (type, columns) rows, or None if the page cannot be
+            used
+            the reason why the page cannot be used, or None
+    """
+
+    start = time.perf_counter()
+    try:
+        queries = parse_html_page(page_number, page)
+    except (IndexError, ValueError) as error:
+        METRICS.observe('parse_seconds', time.perf_counter() - start,
+                        type='error')
+        return None, 'parse error: {!r}'.format(error)
+
+    # The event type is the first entry of the queries
+    type = next(iter(queries))
+    if type not in PARSERS:
+        METRICS.observe('parse_seconds', time.perf_counter() - start,
+                        type='unknown')
+        if type == '':
+            return None, 'empty page'
+        return None, 'unknown type: {}'.format(type)
+
+    # query_iterator reuses its dictionaries, they are copied
+    rows = [(type, dict(columns))
+            for type, columns in query_iterator(queries)]
+
+    # The row of the event comes first, before its Leaker rows
+    rows[0][1]['parser_version'] = PARSER_VERSION
+    METRICS.observe('parse_seconds', time.perf_counter() - start, type=type)
+
+    return rows, None
+
+###############################################################################
+# Streaming
+
+# Fields of every event type
+FIELDS = {
+    'Outage': OUTAGE_FIELDS,
+    'Leak': LEAK_FIELDS,
+    'Hijack': HIJACK_FIELDS,
+}
+
+# Line that ends the part of a page that the parser needs, once every field
+# of its type has been seen. The list of leakers ends with the table cell
+BLOCK_ENDS = {
+    'Outage': 'Number of Prefixes',
+    'Leak': '</td>',
+    'Hijack': 'Detected by number of BGPMon',
+}
+
+# Every field of every type
+ALL_FIELDS = tuple(sorted(set(OUTAGE_FIELDS + LEAK_FIELDS + HIJACK_FIELDS)))
+
+# Anything that makes a line worth looking at
+MARKERS = re.compile('|'.join(
+    re.escape(marker) for marker in sorted(
+        set(ALL_FIELDS + tuple(BLOCK_ENDS.values()) +
+            tuple(word for word, _ in TYPE_WORDS)), key=len, reverse=True)))
+
+
+class PageBlock():
+    """ Keeps the block of a page that the parser needs while the page is
+        received one chunk at a time: from the first line that mentions an
+        event type or a field, to the line that ends the fields of the type
+        (see BLOCK_ENDS). The text before the block is dropped as it
+        arrives, and the text after it is not needed: the parser extracts
+        the same rows from the block as from the whole page.
+    """
+
+    def __init__(self):
+        # Text of the block received so far
+        self.parts = []
+
+        # Incomplete last line of the text received so far
+        self.partial = ''
+
+        # Event types mentioned and fields seen so far
+        self.types = set()
+        self.fields = set()
+
+        self.complete = False
+
+    ###########################################################################
+
+    def feed(self, text):
+        """ Adds the next chunk of text of the page
+            Returns: True once the block is complete, i.e. the rest of the
+            page can be left unread
+        """
+
+        if self.complete:
+            return True
+
+        text = self.partial + text
+        end = text.rfind('\n') + 1
+        self.partial = text[end:]
+        self.scan(text[:end])
+
+        return self.complete
+
+    ###########################################################################
+
+    def close(self):
+        """ Adds the last line of the page, which has no end of line """
+
+        if self.partial and not self.complete:
+            self.scan(self.partial)
+        self.partial = ''
+
+    ###########################################################################
+
+    def scan(self, text):
+        """ Adds the complete lines of 'text' to the block. Only the lines
+            that contain a marker are looked at
+        """
+
+        # Start of the block in 'text', or None before the block
+        start = 0 if self.parts else None
+
+        # End of the last line looked at
+        position = 0
+
+        for match in MARKERS.finditer(text):
+            if match.start() < position:
+                continue
+
+            line_start = text.rfind('\n', 0, match.start()) + 1
+            position = text.find('\n', match.start()) + 1 or len(text)
+            line = text[line_start:position]
+
+            types = {type for word, type in TYPE_WORDS if word in line}
+            fields = {field for field in ALL_FIELDS if field in line}
+            if start is None:
+                if not types and not fields:
+                    continue
+                start = line_start
+
+            self.types |= types
+            self.fields |= fields
+
+            type = self.type
+            if type in BLOCK_ENDS and BLOCK_ENDS[type] in line and \
+                    self.fields.issuperset(FIELDS[type]):
+                self.complete = True
+                self.parts.append(text[start:position])
+                return
+
+        if start is not None:
+            self.parts.append(text[start:])
+
+    ###########################################################################
+
+    @property
+    def type(self):
+        """ Returns: the type of the page so far, as page_type """
+
+        return ''.join(type for _, type in TYPE_WORDS if type in self.types)
+
+    ###########################################################################
+
+    @property
+    def page(self):
+        """ Returns: the block, to be parsed and cached instead of the page
+        """
+
+        return ''.join(self.parts)
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('PageBlock({} characters, {})'.format(
+            sum(len(part) for part in self.parts),
+            'complete' if self.complete else 'incomplete'))
@@ -0,0 +1,165 @@
+###############################################################################
+# Imports
+
+# General utility
+import re
+
+###############################################################################
+# Partitioned schema
+
+# Event tables partitioned by month of start_time in sql/schema_partitioned.sql
+PARTITIONED_TABLES = ('Outage', 'Hijack', 'Leak')
+
+# Year and month of a start_time such as '2018-01-02 10:00:00'
+MONTH = re.compile(r'^(\d{4})-(\d{2})-\d{2}')
+
+# Key of the advisory lock under which the partitions are created: IF NOT
+# EXISTS does not prevent the error of two concurrent creations
+PARTITION_LOCK = 0x6267707370
+
+###############################################################################
+
+
+def is_partitioned(connection):
+    """ Returns: True if the event tables are partitioned """
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT relkind = 'p' FROM pg_class "
+                   "WHERE relname = 'outage' AND "
+                   "relnamespace = 'public'::regnamespace;")
+    row = cursor.fetchone()
+
+    return row is not None and row[0]
+
+###############################################################################
+
+
+def month_bounds(year, month):
+    """ Returns: the first day of the month and the first day of the next
+        month, as 'YYYY-MM-DD' strings
+    """
+
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    return ('{:04d}-{:02d}-01'.format(year, month),
+            '{:04d}-{:02d}-01'.format(next_year, next_month))
+
+###############################################################################
+# Partitions
+
+
+class Partitions():
+    """ Creates the monthly partitions of the event tables as events arrive,
+        and routes the rows to them so that a batch is written to each
+        partition directly. Rows without a usable start_time are left to the
+        default partition
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+        # Names of the partitions that exist
+        cursor = connection.cursor()
+        cursor.execute('SELECT child.relname FROM pg_inherits '
+                       'JOIN pg_class child ON child.oid = inhrelid '
+                       'JOIN pg_class parent ON parent.oid = inhparent '
+                       'WHERE parent.relname = ANY(%s);',
+                       ([table.lower() for table in PARTITIONED_TABLES],))
+        self.existing = set(row[0] for row in cursor.fetchall())
+
+    ###########################################################################
+
+    @staticmethod
+    def name(table_name, year, month):
+        """ Returns: the name of the partition of 'table_name' for a month """
+
+        return '{}_{:04d}_{:02d}'.format(table_name.lower(), year, month)
+
+    ###########################################################################
+
+    def create(self, cursor, table_name, year, month):
+        """ Creates the partition of 'table_name' for a month if needed. The
+            processes that write at the same time create it one at a time,
+            the lock being held until the commit
+            Returns: the name of the partition
+        """
+
+        name = self.name(table_name, year, month)
+
+        if name not in self.existing:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s);',
+                           (PARTITION_LOCK,))
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS {} PARTITION OF {} '
+                'FOR VALUES FROM (%s) TO (%s);'.format(name, table_name),
+                month_bounds(year, month))
+            self.existing.add(name)
+
+        return name
+
+    ###########################################################################
+
+    def route(self, cursor, table_name, rows):
+        """ Groups the rows of 'table_name' by partition, creating the
+            partitions that are missing
+            Returns: {table or partition name: [columns, ...]}
+        """
+
+        groups = {}
+
+        for columns in rows:
+            match = MONTH.match(columns.get('start_time') or '')
+            year, month = (int(match.group(1)), int(match.group(2))) \
+                if match else (0, 0)
+
+            if 1 <= month <= 12:
+                target = self.create(cursor, table_name, year, month)
+            else:
+                target = table_name
+
+            groups.setdefault(target, []).append(columns)
+
+        return groups
+
+    ###########################################################################
+
+    def detach(self, before, schema=None):
+        """ Detaches the monthly partitions that end before 'before', a
+            'YYYY-MM' string, and moves them to 'schema' if given. Neither
+            rewrites the data
+            Returns: the names of the detached partitions
+        """
+
+        year, month = (int(part) for part in before.split('-'))
+        cursor = self.connection.cursor()
+        detached = []
+
+        if schema is not None:
+            cursor.execute('CREATE SCHEMA IF NOT EXISTS {};'.format(schema))
+
+        for table_name in PARTITIONED_TABLES:
+            prefix = table_name.lower() + '_'
+            for name in sorted(self.existing):
+                bounds = name[len(prefix):].split('_')
+                if not name.startswith(prefix) or bounds == ['default']:
+                    continue
+
+                if (int(bounds[0]), int(bounds[1])) >= (year, month):
+                    continue
+
+                cursor.execute('ALTER TABLE {} DETACH PARTITION {};'.format(
+                    table_name, name))
+                if schema is not None:
+                    cursor.execute('ALTER TABLE {} SET SCHEMA {};'.format(
+                        name, schema))
+
+                self.existing.discard(name)
+                detached.append(name)
+
+        self.connection.commit()
+        return detached
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('Partitions({})'.format(len(self.existing)))
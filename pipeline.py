@@ -0,0 +1,214 @@
+###############################################################################
+# Imports
+
+# Concurrency
+import queue
+import threading
+
+# General utility
+import sys
+import time
+
+###############################################################################
+# Stages
+
+
+class Stage():
+    """ Pool of 'workers' threads applying 'function' to the items of a
+        bounded input queue. What 'function' returns is put in the input
+        queue of the next stage, unless it is None. A full queue blocks the
+        previous stage, which keeps the memory flat when a stage falls behind
+    """
+
+    def __init__(self, name, function, workers=1, queue_size=100):
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        # Set by the Pipeline
+        self.next = None
+        self.pipeline = None
+
+        # Statistics
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.busy = 0.0
+        self.running = 0
+        self.start = None
+
+    ###########################################################################
+
+    def depth(self):
+        """ Returns: the number of items waiting in the input queue """
+
+        return self.queue.qsize()
+
+    ###########################################################################
+
+    def throughput(self):
+        """ Returns: the number of items processed per second since the start
+        """
+
+        elapsed = time.monotonic() - self.start if self.start else 0
+        return self.processed / elapsed if elapsed else 0.0
+
+    ###########################################################################
+
+    def stats(self):
+        """ Returns: a dictionary describing the state of the stage """
+
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'queue_depth': self.depth(),
+            'processed': self.processed,
+            'items_per_second': self.throughput(),
+            'busy_seconds': self.busy,
+        }
+
+    ###########################################################################
+
+    def run(self):
+        """ Body of a worker thread """
+
+        while True:
+            item = self.queue.get()
+            if item is Pipeline.END:
+                break
+
+            # After a failure the items are drained without being processed
+            # so that no thread stays blocked on a full queue
+            if self.pipeline.error is not None:
+                continue
+
+            start = time.monotonic()
+            try:
+                result = self.function(item)
+            except BaseException as error:
+                self.pipeline.fail(self, error)
+                continue
+
+            with self.lock:
+                self.processed += 1
+                self.busy += time.monotonic() - start
+
+            if result is not None and self.next is not None:
+                self.next.queue.put(result)
+
+        # The last worker of the stage tells the next stage to stop
+        with self.lock:
+            self.running -= 1
+            last = self.running == 0
+
+        if last and self.next is not None:
+            for _ in range(self.next.workers):
+                self.next.queue.put(Pipeline.END)
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('Stage({!r})'.format(self.name))
+
+
+###############################################################################
+# Pipeline
+
+
+class Pipeline():
+    """ Chain of stages connected by bounded queues. Every stage runs its own
+        threads, so that fetching, parsing and writing overlap
+    """
+
+    # Marks the end of the items
+    END = object()
+
+    def __init__(self, stages, report_interval=None):
+        """ 'report_interval' is the number of seconds between two prints of
+            the statistics of the stages, None to never print them
+        """
+
+        self.stages = stages
+        self.report_interval = report_interval
+        self.error = None
+
+        for stage, next in zip(stages, stages[1:] + [None]):
+            stage.next = next
+            stage.pipeline = self
+
+    ###########################################################################
+
+    def fail(self, stage, error):
+        """ Records the first error raised by a stage """
+
+        if self.error is None:
+            self.error = error
+            print('Stage {} failed: {!r}'.format(stage.name, error),
+                  file=sys.stderr)
+
+    ###########################################################################
+
+    def run(self, items):
+        """ Feeds 'items' to the first stage and waits until every stage is
+            done. Raises the first error raised by a stage
+        """
+
+        threads = []
+        for stage in self.stages:
+            stage.start = time.monotonic()
+            stage.running = stage.workers
+            for _ in range(stage.workers):
+                thread = threading.Thread(target=stage.run, daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        done = threading.Event()
+        if self.report_interval:
+            monitor = threading.Thread(target=self.monitor, args=(done,),
+                                       daemon=True)
+            monitor.start()
+
+        # Blocks whenever the first queue is full
+        first = self.stages[0]
+        for item in items:
+            if self.error is not None:
+                break
+            first.queue.put(item)
+
+        for _ in range(first.workers):
+            first.queue.put(self.END)
+
+        for thread in threads:
+            thread.join()
+        done.set()
+
+        if self.error is not None:
+            raise self.error
+
+    ###########################################################################
+
+    def monitor(self, done):
+        """ Prints the statistics of the stages every 'report_interval'
+            seconds until 'done' is set
+        """
+
+        while not done.wait(self.report_interval):
+            print(self.report())
+            sys.stdout.flush()
+
+    ###########################################################################
+
+    def report(self):
+        """ Returns: the queue depth and throughput of every stage """
+
+        return '\n'.join(
+            '{stage:>6}: {workers:3} workers, queue {queue_depth:5}, '
+            '{processed:8} items, {items_per_second:8.1f} items/s'.format(
+                **stage.stats())
+            for stage in self.stages)
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('Pipeline({})'.format(
+            ' -> '.join(stage.name for stage in self.stages)))
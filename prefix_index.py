@@ -0,0 +1,535 @@
+###############################################################################
+# Imports
+
+# Searchable columns
+from query import PREFIX_COLUMNS, PREFIX_OPERATORS
+
+# Ranges of event ids
+from sync_state import IdSet
+
+# General utility
+import bisect
+import datetime
+import ipaddress
+import socket
+
+###############################################################################
+# Intervals
+
+# Maximum number of id ranges per query of a refresh
+RANGES_PER_QUERY = 500
+
+
+def as_datetime(value):
+    """ Returns: 'value', a timestamp of postgresql or a string of SQLite, as
+        a datetime, or None
+    """
+
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+
+    return value
+
+
+class IntervalList():
+    """ Time intervals [start, end] of events, sorted by start when they are
+        looked up. 'span' is the longest interval, so that the events that
+        overlap a window are found with a binary search on their start. The
+        events without a start time are kept apart: as with the SQL queries,
+        they are only found without a time window.
+    """
+
+    __slots__ = ('events', 'undated', 'span', 'dirty')
+
+    def __init__(self):
+        # (start, end, table_name, id)
+        self.events = []
+        self.undated = []
+        self.span = datetime.timedelta(0)
+        self.dirty = False
+
+    ###########################################################################
+
+    def add(self, start, end, table_name, id):
+        if start is None:
+            self.undated.append((start, end, table_name, id))
+            return
+
+        self.events.append((start, end, table_name, id))
+        self.span = max(self.span, end - start)
+        self.dirty = True
+
+    ###########################################################################
+
+    def overlapping(self, since=None, until=None):
+        """ Returns: the (start, end, table_name, id) events that overlap the
+            window that starts at 'since' (included) and ends at 'until'
+            (excluded), as the filters of query.py
+        """
+
+        if self.dirty:
+            self.events.sort()
+            self.dirty = False
+
+        if since is None and until is None:
+            return self.events + self.undated
+
+        # (time,) sorts before the events that start at 'time'
+        stop = (len(self.events) if until is None
+                else bisect.bisect_left(self.events, (until,)))
+        if since is None:
+            return self.events[:stop]
+
+        start = bisect.bisect_left(self.events, (since - self.span,))
+        return [event for event in self.events[start:stop]
+                if event[1] >= since]
+
+    ###########################################################################
+
+    def __len__(self):
+        return len(self.events) + len(self.undated)
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('IntervalList({} events)'.format(len(self.events)))
+
+###############################################################################
+# Prefix trie
+
+
+def common_length(a, b, limit, bits):
+    """ Returns: the number of leading bits, up to 'limit', that the 'bits'
+        bits integers 'a' and 'b' have in common
+    """
+
+    different = a ^ b
+    if different == 0:
+        return limit
+
+    return min(limit, bits - different.bit_length())
+
+
+class Node():
+    """ Node of a PrefixTrie: the prefix 'key'/'length', with the events of
+        the prefix, or None for the nodes that only join two branches
+    """
+
+    __slots__ = ('key', 'length', 'children', 'events')
+
+    def __init__(self, key, length):
+        self.key = key
+        self.length = length
+        self.children = [None, None]
+        self.events = None
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('Node({:x}/{})'.format(self.key, self.length))
+
+###############################################################################
+
+
+class PrefixTrie():
+    """ Patricia trie of the IPv4 and IPv6 prefixes: the chains of nodes with
+        a single child are collapsed, so that the trie has less than two nodes
+        per stored prefix
+    """
+
+    # Number of bits and address family of each IP version
+    BITS = {4: 32, 6: 128}
+    FAMILIES = {4: socket.AF_INET, 6: socket.AF_INET6}
+
+    def __init__(self):
+        self.roots = {4: None, 6: None}
+        self.nodes = 0
+
+    ###########################################################################
+
+    @classmethod
+    def key(cls, prefix):
+        """ Returns: the IP version, key and length of 'prefix', a string such
+            as '192.0.2.0/24' or an ip_network. An address without a length
+            is a prefix of a single address, and the bits of the address
+            after the length are ignored, as postgresql does
+        """
+
+        address, _, length = str(prefix).partition('/')
+        version = 6 if ':' in address else 4
+        bits = cls.BITS[version]
+
+        try:
+            key = int.from_bytes(socket.inet_pton(cls.FAMILIES[version],
+                                                  address), 'big')
+            length = int(length) if length else bits
+        except (OSError, ValueError):
+            raise ValueError('Invalid prefix: {!r}'.format(prefix))
+        if not 0 <= length <= bits:
+            raise ValueError('Invalid prefix: {!r}'.format(prefix))
+
+        return version, key >> (bits - length) << (bits - length), length
+
+    ###########################################################################
+
+    def insert(self, version, key, length):
+        """ Returns: the node of the prefix 'key'/'length', created if needed
+        """
+
+        bits = self.BITS[version]
+        parent, branch = None, None
+        node = self.roots[version]
+
+        while node is not None:
+            # 'node' covers the prefix: one level down
+            if node.length < length and \
+                    (node.key ^ key) >> (bits - node.length) == 0:
+                parent, branch = node, (key >> (bits - node.length - 1)) & 1
+                node = node.children[branch]
+                continue
+
+            common = common_length(node.key, key, min(node.length, length),
+                                   bits)
+
+            if common < node.length:
+                # The prefix branches off above 'node': it becomes the parent
+                # of 'node', or a new node joins them
+                self.nodes += 1
+                if common == length:
+                    top = new = Node(key, length)
+                else:
+                    self.nodes += 1
+                    top = Node(key >> (bits - common) << (bits - common),
+                               common)
+                    new = Node(key, length)
+                    top.children[(key >> (bits - common - 1)) & 1] = new
+
+                top.children[(node.key >> (bits - common - 1)) & 1] = node
+                self.attach(version, parent, branch, top)
+                return new
+
+            # Same prefix
+            return node
+
+        self.nodes += 1
+        new = Node(key, length)
+        self.attach(version, parent, branch, new)
+        return new
+
+    ###########################################################################
+
+    def attach(self, version, parent, branch, node):
+        if parent is None:
+            self.roots[version] = node
+        else:
+            parent.children[branch] = node
+
+    ###########################################################################
+
+    def covering(self, version, key, length):
+        """ Yields the nodes with events whose prefix covers (or is) the
+            prefix 'key'/'length'
+        """
+
+        bits = self.BITS[version]
+        node = self.roots[version]
+
+        while node is not None and node.length <= length and \
+                (node.key ^ key) >> (bits - node.length) == 0:
+            if node.events is not None:
+                yield node
+            if node.length == length:
+                return
+            node = node.children[(key >> (bits - node.length - 1)) & 1]
+
+    ###########################################################################
+
+    def within(self, version, key, length):
+        """ Yields the nodes with events whose prefix is inside (or is) the
+            prefix 'key'/'length'
+        """
+
+        bits = self.BITS[version]
+        node = self.roots[version]
+
+        # The top of the subtree of the prefix
+        while node is not None and node.length < length:
+            if (node.key ^ key) >> (bits - node.length) != 0:
+                return
+            node = node.children[(key >> (bits - node.length - 1)) & 1]
+
+        if node is None or (node.key ^ key) >> (bits - length) != 0:
+            return
+
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.events is not None:
+                yield node
+            stack.extend(child for child in node.children if child is not None)
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('PrefixTrie({} nodes)'.format(self.nodes))
+
+###############################################################################
+# Event index
+
+
+class EventIndex():
+    """ In-memory index of the events, for the correlation of large batches
+        of alerts without a round trip to the database per alert: the
+        prefixes of the Hijack and Leak tables in a PrefixTrie, and the
+        outages of every AS, each with the time intervals of their events.
+        Hijacks and leaks last an instant, outages until their end time.
+    """
+
+    # Tables whose prefixes are indexed
+    PREFIX_TABLES = ('Hijack', 'Leak')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.clear()
+
+        # Last run of --reextract seen by a refresh
+        self.reextraction = None
+
+    ###########################################################################
+
+    def clear(self):
+        """ Forgets every loaded event """
+
+        self.trie = PrefixTrie()
+
+        # {asn: IntervalList of its outages}
+        self.outages = {}
+
+        # Events loaded, and ranges of the SyncState table already looked at
+        self.ids = IdSet()
+        self.synced = IdSet()
+
+        self.events = 0
+
+    ###########################################################################
+
+    def refresh(self):
+        """ Loads the events added since the last refresh, i.e. every event
+            the first time: the ids above the highest loaded one, and the ids
+            that the ingestion marked as processed since then, which can be
+            lower with the distributed backfill. The rows replaced by a run
+            of --reextract keep their id, so every event is loaded again
+            after one
+            Returns: the number of events loaded
+        """
+
+        cursor = self.connection.cursor()
+        cursor.execute('SELECT max(id) FROM Reextraction;')
+        reextraction = cursor.fetchone()[0]
+        if reextraction != self.reextraction:
+            self.clear()
+            self.reextraction = reextraction
+
+        cursor.execute('SELECT first_id, last_id FROM SyncState;')
+        state = IdSet(cursor.fetchall())
+
+        # The first refresh loads everything
+        ranges = state.difference(self.synced) if self.ids.max() else []
+        ranges.append((self.ids.max() + 1, None))
+        self.synced = state
+
+        loaded = 0
+        for start in range(0, len(ranges), RANGES_PER_QUERY):
+            loaded += self.load(ranges[start:start + RANGES_PER_QUERY])
+        self.connection.rollback()
+
+        return loaded
+
+    ###########################################################################
+
+    def load(self, ranges):
+        """ Adds the events whose id is in one of the (first_id, last_id)
+            'ranges', where a last_id of None has no upper bound
+            Returns: the number of events loaded
+        """
+
+        conditions = []
+        parameters = []
+        for first_id, last_id in ranges:
+            if last_id is None:
+                conditions.append('id >= %s')
+                parameters.append(first_id)
+            else:
+                conditions.append('id BETWEEN %s AND %s')
+                parameters += [first_id, last_id]
+        where = ' OR '.join(conditions)
+
+        loaded = 0
+        for table_name in self.PREFIX_TABLES:
+            columns = PREFIX_COLUMNS[table_name]
+
+            # Server side cursor on postgresql: the rows are not all loaded
+            # at once
+            cursor = self.connection.cursor('index_{}'.format(
+                table_name.lower()))
+            cursor.execute('SELECT id, start_time, {} FROM {} WHERE {};'.format(
+                ', '.join(columns), table_name, where), parameters)
+            for row in cursor:
+                id, start = row[0], as_datetime(row[1])
+                if id in self.ids:
+                    continue
+
+                self.ids.add(id)
+                loaded += 1
+                for prefix in set(row[2:]):
+                    if prefix is not None:
+                        self.add_prefix(prefix, start, start, table_name, id)
+            cursor.close()
+
+        cursor = self.connection.cursor('index_outage')
+        cursor.execute('SELECT id, start_time, end_time, asn FROM Outage '
+                       'WHERE {};'.format(where), parameters)
+        for id, start, end, asn in cursor:
+            if id in self.ids:
+                continue
+
+            self.ids.add(id)
+            loaded += 1
+            if asn is None:
+                continue
+
+            start = as_datetime(start)
+            end = as_datetime(end)
+            if start is not None:
+                end = max(end or start, start)
+            self.outages.setdefault(int(asn), IntervalList()).add(
+                start, end, 'Outage', id)
+        cursor.close()
+
+        self.events += loaded
+
+        return loaded
+
+    ###########################################################################
+
+    def add_prefix(self, prefix, start, end, table_name, id):
+        node = self.trie.insert(*PrefixTrie.key(prefix))
+        if node.events is None:
+            node.events = IntervalList()
+        node.events.add(start, end, table_name, id)
+
+    ###########################################################################
+
+    def find(self, prefix, since=None, until=None, match='covering'):
+        """ Finds the hijacks and leaks of the prefixes that match 'prefix'
+            (see query.PREFIX_OPERATORS) and that happened between 'since'
+            (included) and 'until' (excluded)
+            Returns: a list of (table_name, id, prefix, start_time), sorted
+            by start time
+        """
+
+        return self.node_events(self.nodes(prefix, match), since, until)
+
+    ###########################################################################
+
+    def nodes(self, prefix, match='covering'):
+        """ Returns: the IP version of 'prefix', and the nodes with events of
+            the prefixes that match it
+        """
+
+        if match not in PREFIX_OPERATORS:
+            raise ValueError('Unknown prefix match: {!r}'.format(match))
+
+        version, key, length = PrefixTrie.key(prefix)
+
+        nodes = []
+        if match in ('covering', 'overlaps'):
+            nodes += self.trie.covering(version, key, length)
+        if match in ('within', 'overlaps'):
+            nodes += [node for node in self.trie.within(version, key, length)
+                      if match == 'within' or node.length > length]
+
+        return version, nodes
+
+    ###########################################################################
+
+    def node_events(self, nodes, since=None, until=None):
+        """ Returns: the events of the (version, nodes) 'nodes' between
+            'since' and 'until', as find
+        """
+
+        version, nodes = nodes
+
+        found = {}
+        for node in nodes:
+            for start, _, table_name, id in node.events.overlapping(since,
+                                                                    until):
+                if (table_name, id) not in found:
+                    found[table_name, id] = (start, node)
+
+        # The events without a start time come last
+        return [(table_name, id, self.prefix(version, node), start)
+                for (table_name, id), (start, node)
+                in sorted(found.items(),
+                          key=lambda item: (item[1][0] is None, item[1][0]))]
+
+    ###########################################################################
+
+    def find_many(self, alerts, window=datetime.timedelta(hours=1),
+                  match='covering'):
+        """ Correlates a batch of (prefix, time) 'alerts' with the hijacks
+            and leaks of their prefix less than 'window' before or after
+            their time (a time of None matches every time)
+            Returns: the list of the events of every alert (see find)
+        """
+
+        # Alerts often come in bursts on the same prefixes, whose nodes are
+        # only looked up once
+        nodes = {}
+
+        results = []
+        for prefix, time in alerts:
+            if prefix not in nodes:
+                nodes[prefix] = self.nodes(prefix, match)
+
+            if time is None:
+                results.append(self.node_events(nodes[prefix]))
+            else:
+                results.append(self.node_events(nodes[prefix],
+                                                time - window, time + window))
+
+        return results
+
+    ###########################################################################
+
+    def find_outages(self, asn, since=None, until=None):
+        """ Returns: the (id, start_time, end_time) of the outages of 'asn'
+            that overlap the window from 'since' (included) to 'until'
+            (excluded), sorted by start time
+        """
+
+        outages = self.outages.get(int(asn))
+        if outages is None:
+            return []
+
+        return [(id, start, end) for start, end, _, id
+                in outages.overlapping(since, until)]
+
+    ###########################################################################
+
+    @staticmethod
+    def prefix(version, node):
+        """ Returns: the prefix of 'node' as a string """
+
+        if version == 4:
+            network = ipaddress.IPv4Network((node.key, node.length))
+        else:
+            network = ipaddress.IPv6Network((node.key, node.length))
+
+        return str(network)
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('EventIndex({} events, {} nodes, {} ASes)'.format(
+            self.events, self.trie.nodes, len(self.outages)))
@@ -0,0 +1,118 @@
+###############################################################################
+# Imports
+
+import psycopg2.extras  # Rows as dictionaries
+
+###############################################################################
+# Searchable columns
+
+# Event tables in the order in which they are searched
+EVENT_TABLES = ('Outage', 'Hijack', 'Leak')
+
+# Columns of each table that hold a prefix, an ASN and a time
+PREFIX_COLUMNS = {
+    'Outage': (),
+    'Hijack': ('original_prefix', 'hj_prefix'),
+    'Leak': ('prefix',),
+}
+ASN_COLUMNS = {
+    'Outage': ('asn',),
+    'Hijack': ('original_asn', 'hj_asn'),
+    'Leak': ('original_asn', 'leaking_asn'),
+}
+TIME_COLUMN = 'start_time'
+
+# Prefix operators backed by the GiST inet_ops indexes:
+#   overlaps: the event prefix covers or is inside the prefix
+#   covering: the event prefix covers (or is) the prefix
+#   within: the event prefix is inside (or is) the prefix
+PREFIX_OPERATORS = {
+    'overlaps': '&&',
+    'covering': '>>=',
+    'within': '<<=',
+}
+
+###############################################################################
+# Queries
+
+
+def build_query(table_name, prefix=None, match='overlaps', asn=None,
+                since=None, until=None, limit=None):
+    """ Builds a parameterized query that selects the events of 'table_name'
+        matching every given filter
+        Returns:
+            the query, or None if the table cannot match the filters (i.e.
+            prefix filter on Outage)
+            the list of parameters
+    """
+
+    conditions = []
+    parameters = []
+
+    if prefix is not None:
+        columns = PREFIX_COLUMNS[table_name]
+        if not columns:
+            return None, []
+
+        operator = PREFIX_OPERATORS[match]
+        conditions.append('(' + ' OR '.join(
+            '{} {} %s::inet'.format(column, operator) for column in columns
+        ) + ')')
+        parameters += [prefix] * len(columns)
+
+    if asn is not None:
+        alternatives = ['{} = %s'.format(column)
+                        for column in ASN_COLUMNS[table_name]]
+        parameters += [asn] * len(alternatives)
+
+        # The ASes that propagated a leak are in the Leaker table. Unlike
+        # IN (SELECT ...), an array computed once lets the planner combine
+        # the indexes of every alternative
+        if table_name == 'Leak':
+            alternatives.append('id = ANY(ARRAY(SELECT leak FROM Leaker '
+                                'WHERE asn = %s))')
+            parameters.append(asn)
+
+        conditions.append('(' + ' OR '.join(alternatives) + ')')
+
+    if since is not None:
+        conditions.append('{} >= %s'.format(TIME_COLUMN))
+        parameters.append(since)
+
+    if until is not None:
+        conditions.append('{} < %s'.format(TIME_COLUMN))
+        parameters.append(until)
+
+    # The views add the AS names, which are stored once per AS
+    query = 'SELECT * FROM {}View'.format(table_name)
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY {} DESC'.format(TIME_COLUMN)
+
+    if limit is not None:
+        query += ' LIMIT %s'
+        parameters.append(limit)
+
+    return query, parameters
+
+###############################################################################
+
+
+def find_events(connection, types=EVENT_TABLES, **filters):
+    """ Yields the events of the tables 'types' that match 'filters' (see
+        build_query)
+        Returns:
+            the table name
+            the row as a dictionary {column_name: value}
+    """
+
+    cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+    for table_name in types:
+        query, parameters = build_query(table_name, **filters)
+        if query is None:
+            continue
+
+        cursor.execute(query, parameters)
+        for row in cursor:
+            yield table_name, row
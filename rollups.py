@@ -0,0 +1,178 @@
+###############################################################################
+# Imports
+
+# General utility
+import sys
+
+###############################################################################
+# Rollup queries
+
+# Select the AsnStats rows of the events that match the filters {Outage},
+# {Hijack} and {Leak}
+ASN_STATS = """
+SELECT asn, 'outage', count(*), sum(coalesce(number_of_prefixes, 0)),
+       min(start_time), max(start_time)
+FROM Outage WHERE asn IS NOT NULL AND {Outage} GROUP BY asn
+UNION ALL
+SELECT original_asn, 'hijacked', count(*), count(*),
+       min(start_time), max(start_time)
+FROM Hijack WHERE original_asn IS NOT NULL AND {Hijack} GROUP BY original_asn
+UNION ALL
+SELECT hj_asn, 'hijacker', count(*), count(*),
+       min(start_time), max(start_time)
+FROM Hijack WHERE hj_asn IS NOT NULL AND {Hijack} GROUP BY hj_asn
+UNION ALL
+SELECT original_asn, 'leaked', count(*), count(*),
+       min(start_time), max(start_time)
+FROM Leak WHERE original_asn IS NOT NULL AND {Leak} GROUP BY original_asn
+UNION ALL
+SELECT leaking_asn, 'leaker', count(*), count(*),
+       min(start_time), max(start_time)
+FROM Leak WHERE leaking_asn IS NOT NULL AND {Leak} GROUP BY leaking_asn
+"""
+
+# Select the DailyStats rows of the events that match the filters
+DAILY_STATS = """
+SELECT start_time::date, 'Outage', count(*),
+       sum(coalesce(number_of_prefixes, 0)), min(start_time), max(start_time)
+FROM Outage WHERE start_time IS NOT NULL AND {Outage} GROUP BY 1
+UNION ALL
+SELECT start_time::date, 'Hijack', count(*), count(*),
+       min(start_time), max(start_time)
+FROM Hijack WHERE start_time IS NOT NULL AND {Hijack} GROUP BY 1
+UNION ALL
+SELECT start_time::date, 'Leak', count(*), count(*),
+       min(start_time), max(start_time)
+FROM Leak WHERE start_time IS NOT NULL AND {Leak} GROUP BY 1
+"""
+
+# Rollup tables: (name, key columns, select query)
+ROLLUPS = (
+    ('AsnStats', ('asn', 'role'), ASN_STATS),
+    ('DailyStats', ('day', 'type'), DAILY_STATS),
+)
+
+# Columns shared by the rollup tables
+STAT_COLUMNS = ('events', 'prefixes', 'first_seen', 'last_seen')
+
+# Filters that select every event, or the events of the current batch
+EVERY_EVENT = {'Outage': 'TRUE', 'Hijack': 'TRUE', 'Leak': 'TRUE'}
+BATCH_EVENTS = {
+    'Outage': 'id = ANY(%(Outage)s)',
+    'Hijack': 'id = ANY(%(Hijack)s)',
+    'Leak': 'id = ANY(%(Leak)s)',
+}
+
+###############################################################################
+# Rollups
+
+
+class Rollups():
+    """ Maintains per-ASN and per-day statistics of the events in the
+        AsnStats and DailyStats tables
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.writer = None
+
+    ###########################################################################
+
+    def attach(self, writer):
+        """ Updates the rollups with the events inserted by the BulkWriter
+            'writer', in the same transaction
+        """
+
+        self.writer = writer
+        writer.hooks.append(self.update)
+
+    ###########################################################################
+
+    def update(self, cursor):
+        """ Adds the events inserted by the current flush of the writer to the
+            rollups
+        """
+
+        inserted = self.writer.inserted
+        if not any(inserted.values()):
+            return
+
+        for table_name, keys, select in ROLLUPS:
+            updates = ['{0} = {1}.{0} + EXCLUDED.{0}'.format(column,
+                                                             table_name)
+                       for column in ('events', 'prefixes')]
+            updates += ['first_seen = LEAST({}.first_seen, '
+                        'EXCLUDED.first_seen)'.format(table_name),
+                        'last_seen = GREATEST({}.last_seen, '
+                        'EXCLUDED.last_seen)'.format(table_name)]
+
+            cursor.execute(
+                'INSERT INTO {} ({}) {} ON CONFLICT ({}) DO UPDATE SET {};'
+                .format(table_name, ', '.join(keys + STAT_COLUMNS),
+                        select.format(**BATCH_EVENTS), ', '.join(keys),
+                        ', '.join(updates)),
+                inserted)
+
+    ###########################################################################
+
+    def is_empty(self):
+        """ Returns: True if no rollup row exists """
+
+        cursor = self.connection.cursor()
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM AsnStats) '
+                       'OR EXISTS (SELECT 1 FROM DailyStats);')
+
+        return not cursor.fetchone()[0]
+
+    ###########################################################################
+
+    def rebuild(self):
+        """ Recomputes the rollups from the event tables """
+
+        cursor = self.connection.cursor()
+
+        for table_name, keys, select in ROLLUPS:
+            cursor.execute('TRUNCATE {};'.format(table_name))
+            cursor.execute('INSERT INTO {} ({}) {};'.format(
+                table_name, ', '.join(keys + STAT_COLUMNS),
+                select.format(**EVERY_EVENT)))
+
+        self.connection.commit()
+
+    ###########################################################################
+
+    def check(self):
+        """ Compares the rollups with the statistics computed from the event
+            tables, and prints the differences
+            Returns: True if the rollups match the event tables
+        """
+
+        cursor = self.connection.cursor()
+        valid = True
+
+        for table_name, keys, select in ROLLUPS:
+            expected = select.format(**EVERY_EVENT)
+            stored = 'SELECT {} FROM {}'.format(
+                ', '.join(keys + STAT_COLUMNS), table_name)
+
+            # Rows that are missing from the rollup, and rows that are wrong
+            for label, query in (
+                    ('missing or wrong', '({}) EXCEPT ({})'.format(expected,
+                                                                   stored)),
+                    ('unexpected', '({}) EXCEPT ({})'.format(stored,
+                                                             expected))):
+                cursor.execute('SELECT count(*) FROM ({}) difference;'
+                               .format(query))
+                count = cursor.fetchone()[0]
+                if count:
+                    valid = False
+                    print('{}: {} {} rows'.format(table_name, count, label),
+                          file=sys.stderr)
+
+        self.connection.rollback()
+        return valid
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('Rollups')
@@ -0,0 +1,66 @@
+-------------------------------------------------------------------------------
+-- AS Names
+-------------------------------------------------------------------------------
+
+-- Name of every AS given by its newest event, whose id is in 'event'. Only
+-- written with --strip-as-names, where the *_as_name columns of the new
+-- events are only filled when the name differs from this one
+
+CREATE TABLE IF NOT EXISTS AutonomousSystem (
+  asn INTEGER,
+  name TEXT,
+  event INTEGER,
+
+  PRIMARY KEY (asn)
+);
+
+ALTER TABLE AutonomousSystem ADD COLUMN IF NOT EXISTS event INTEGER;
+
+-- Incremented at every rename, so that the other writers reload their names
+CREATE SEQUENCE IF NOT EXISTS AsNameRenames;
+
+------------------------------------------------------------------------------
+-- Views
+-----------------------------------------------------------------------------
+
+-- The event tables with their AS names, for the queries written before the
+-- AutonomousSystem table. The name stored in a row wins: the rows written
+-- before the upgrade, the outages of a country (ASN 0) and the events that
+-- name the AS differently keep theirs
+
+CREATE OR REPLACE VIEW OutageView AS
+SELECT Outage.id, Outage.start_time, Outage.end_time, Outage.asn,
+       COALESCE(Outage.as_name, AutonomousSystem.name) AS as_name,
+       Outage.number_of_prefixes, Outage.percentage
+FROM Outage
+LEFT JOIN AutonomousSystem ON AutonomousSystem.asn = Outage.asn;
+
+CREATE OR REPLACE VIEW HijackView AS
+SELECT Hijack.id, Hijack.start_time, Hijack.original_prefix,
+       Hijack.original_asn,
+       COALESCE(Hijack.original_as_name, original_as.name)
+         AS original_as_name,
+       Hijack.hj_time, Hijack.hj_prefix, Hijack.hj_asn,
+       COALESCE(Hijack.hj_as_name, hj_as.name) AS hj_as_name,
+       Hijack.hj_as_path, Hijack.number_of_peers
+FROM Hijack
+LEFT JOIN AutonomousSystem original_as
+  ON original_as.asn = Hijack.original_asn
+LEFT JOIN AutonomousSystem hj_as ON hj_as.asn = Hijack.hj_asn;
+
+CREATE OR REPLACE VIEW LeakView AS
+SELECT Leak.id, Leak.start_time, Leak.prefix, Leak.original_asn,
+       COALESCE(Leak.original_as_name, original_as.name) AS original_as_name,
+       Leak.leaking_asn,
+       COALESCE(Leak.leaking_as_name, leaking_as.name) AS leaking_as_name,
+       Leak.as_path, Leak.number_of_peers
+FROM Leak
+LEFT JOIN AutonomousSystem original_as ON original_as.asn = Leak.original_asn
+LEFT JOIN AutonomousSystem leaking_as ON leaking_as.asn = Leak.leaking_asn;
+
+CREATE OR REPLACE VIEW LeakerView AS
+SELECT Leaker.id, Leaker.asn,
+       COALESCE(Leaker.as_name, AutonomousSystem.name) AS as_name,
+       Leaker.leak
+FROM Leaker
+LEFT JOIN AutonomousSystem ON AutonomousSystem.asn = Leaker.asn;
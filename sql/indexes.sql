@@ -0,0 +1,34 @@
+-------------------------------------------------------------------------------
+-- Indexes
+-------------------------------------------------------------------------------
+
+------------------------------------------------------------------------------
+-- Prefixes: containment and overlap lookups (>>=, <<=, &&)
+-----------------------------------------------------------------------------
+
+CREATE INDEX IF NOT EXISTS hijack_original_prefix_idx
+  ON Hijack USING GIST (original_prefix inet_ops);
+CREATE INDEX IF NOT EXISTS hijack_hj_prefix_idx
+  ON Hijack USING GIST (hj_prefix inet_ops);
+CREATE INDEX IF NOT EXISTS leak_prefix_idx
+  ON Leak USING GIST (prefix inet_ops);
+
+------------------------------------------------------------------------------
+-- ASNs
+-----------------------------------------------------------------------------
+
+CREATE INDEX IF NOT EXISTS outage_asn_idx ON Outage (asn);
+CREATE INDEX IF NOT EXISTS hijack_original_asn_idx ON Hijack (original_asn);
+CREATE INDEX IF NOT EXISTS hijack_hj_asn_idx ON Hijack (hj_asn);
+CREATE INDEX IF NOT EXISTS leak_original_asn_idx ON Leak (original_asn);
+CREATE INDEX IF NOT EXISTS leak_leaking_asn_idx ON Leak (leaking_asn);
+CREATE INDEX IF NOT EXISTS leaker_asn_idx ON Leaker (asn);
+CREATE INDEX IF NOT EXISTS leaker_leak_idx ON Leaker (leak);
+
+------------------------------------------------------------------------------
+-- Time windows
+-----------------------------------------------------------------------------
+
+CREATE INDEX IF NOT EXISTS outage_start_time_idx ON Outage (start_time);
+CREATE INDEX IF NOT EXISTS hijack_start_time_idx ON Hijack (start_time);
+CREATE INDEX IF NOT EXISTS leak_start_time_idx ON Leak (start_time);
@@ -0,0 +1,16 @@
+-------------------------------------------------------------------------------
+-- Negative Cache
+-------------------------------------------------------------------------------
+
+-- bgpstream.com event ids that could not be downloaded or parsed, and when
+-- they were last tried
+
+CREATE TABLE IF NOT EXISTS FailedEvent (
+  id INTEGER,
+  reason TEXT,
+  attempts INTEGER,
+  first_failure TIMESTAMP,
+  last_attempt TIMESTAMP,
+
+  PRIMARY KEY (id)
+);
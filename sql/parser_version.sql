@@ -0,0 +1,22 @@
+-------------------------------------------------------------------------------
+-- Parser Version
+-------------------------------------------------------------------------------
+
+-- Version of the parser (page_parser.PARSER_VERSION) that extracted every
+-- event, NULL for the events stored before the version was recorded
+
+ALTER TABLE Outage ADD COLUMN IF NOT EXISTS parser_version SMALLINT;
+ALTER TABLE Hijack ADD COLUMN IF NOT EXISTS parser_version SMALLINT;
+ALTER TABLE Leak ADD COLUMN IF NOT EXISTS parser_version SMALLINT;
+
+-- One row per run of --reextract, which replaces the rows of the events
+-- without changing their id, so that the in-memory indexes of the events
+-- (prefix_index.EventIndex) load them again
+
+CREATE TABLE IF NOT EXISTS Reextraction (
+  id SERIAL,
+  replaced INTEGER,
+  finished TIMESTAMP DEFAULT now(),
+
+  PRIMARY KEY (id)
+);
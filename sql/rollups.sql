@@ -0,0 +1,38 @@
+-------------------------------------------------------------------------------
+-- Rollups
+-------------------------------------------------------------------------------
+
+-- Statistics maintained in the same transaction as the inserted events. The
+-- affected prefixes are the number_of_prefixes of an outage, and one prefix
+-- per hijack or leak.
+
+------------------------------------------------------------------------------
+-- Per ASN, for each role of the AS in the events: outage, hijacked (expected
+-- origin), hijacker, leaked (original origin) and leaker
+-----------------------------------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS AsnStats (
+  asn INTEGER,
+  role TEXT,
+  events INTEGER,
+  prefixes BIGINT,
+  first_seen TIMESTAMP,
+  last_seen TIMESTAMP,
+
+  PRIMARY KEY (asn, role)
+);
+
+------------------------------------------------------------------------------
+-- Per day of start_time and per event type
+-----------------------------------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS DailyStats (
+  day DATE,
+  type TEXT,
+  events INTEGER,
+  prefixes BIGINT,
+  first_seen TIMESTAMP,
+  last_seen TIMESTAMP,
+
+  PRIMARY KEY (day, type)
+);
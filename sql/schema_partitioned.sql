@@ -0,0 +1,82 @@
+-------------------------------------------------------------------------------
+-- Database Schema, with the event tables partitioned by month of start_time
+-------------------------------------------------------------------------------
+
+-- Partitions are named <table>_<year>_<month> and created as events arrive
+-- (see partitions.py). The rows without a start time go to <table>_default.
+-- The key of a partitioned table must contain the partition column, hence
+-- UNIQUE (id, start_time), and Leaker cannot reference Leak.
+
+------------------------------------------------------------------------------
+-- Outage 
+-----------------------------------------------------------------------------
+
+CREATE TABLE Outage (
+  id INTEGER,
+  start_time TIMESTAMP,
+  end_time TIMESTAMP,
+  asn INTEGER,
+  as_name TEXT,
+  number_of_prefixes SMALLINT,
+  percentage REAL,
+
+  UNIQUE (id, start_time)
+) PARTITION BY RANGE (start_time);
+
+CREATE TABLE outage_default PARTITION OF Outage DEFAULT;
+
+------------------------------------------------------------------------------
+-- Leak
+-----------------------------------------------------------------------------
+
+CREATE TABLE Leak (
+  id INTEGER,
+  start_time TIMESTAMP,
+  prefix INET,
+  original_asn INTEGER,
+  original_as_name TEXT,
+  leaking_asn INTEGER,
+  leaking_as_name TEXT,
+  as_path TEXT,
+  number_of_peers SMALLINT,
+
+  UNIQUE (id, start_time)
+) PARTITION BY RANGE (start_time);
+
+CREATE TABLE leak_default PARTITION OF Leak DEFAULT;
+
+------------------------------------------------------------------------------
+-- Leakers
+-----------------------------------------------------------------------------
+
+CREATE TABLE Leaker (
+  id SERIAL,
+  asn INTEGER,
+  as_name TEXT,
+  leak INTEGER,
+
+  PRIMARY KEY (id)
+);
+
+------------------------------------------------------------------------------
+-- Hijack
+-----------------------------------------------------------------------------
+
+CREATE TABLE Hijack (
+  id INTEGER,
+  start_time TIMESTAMP,
+  original_prefix INET,
+  original_asn INTEGER,
+  original_as_name TEXT,
+  hj_time TIMESTAMP,
+  hj_prefix INET,
+  hj_asn INTEGER,
+  hj_as_name TEXT,
+  hj_as_path TEXT,
+  number_of_peers SMALLINT,
+
+  UNIQUE (id, start_time)
+) PARTITION BY RANGE (start_time);
+
+CREATE TABLE hijack_default PARTITION OF Hijack DEFAULT;
+
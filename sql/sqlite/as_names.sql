@@ -0,0 +1,58 @@
+-------------------------------------------------------------------------------
+-- AS Names of the SQLite backend
+-------------------------------------------------------------------------------
+
+-- Same as sql/as_names.sql, in a script of its own so that the views can be
+-- created without the indexes of sql/sqlite/upgrade.sql. There is no
+-- AsNameRenames sequence: a SQLite database has one writer
+
+CREATE TABLE IF NOT EXISTS AutonomousSystem (
+  asn INTEGER,
+  name TEXT,
+  event INTEGER,
+
+  PRIMARY KEY (asn)
+);
+
+ALTER TABLE AutonomousSystem ADD COLUMN event INTEGER;
+
+------------------------------------------------------------------------------
+-- Views
+-----------------------------------------------------------------------------
+
+CREATE VIEW IF NOT EXISTS OutageView AS
+SELECT Outage.id, Outage.start_time, Outage.end_time, Outage.asn,
+       COALESCE(Outage.as_name, AutonomousSystem.name) AS as_name,
+       Outage.number_of_prefixes, Outage.percentage
+FROM Outage
+LEFT JOIN AutonomousSystem ON AutonomousSystem.asn = Outage.asn;
+
+CREATE VIEW IF NOT EXISTS HijackView AS
+SELECT Hijack.id, Hijack.start_time, Hijack.original_prefix,
+       Hijack.original_asn,
+       COALESCE(Hijack.original_as_name, original_as.name)
+         AS original_as_name,
+       Hijack.hj_time, Hijack.hj_prefix, Hijack.hj_asn,
+       COALESCE(Hijack.hj_as_name, hj_as.name) AS hj_as_name,
+       Hijack.hj_as_path, Hijack.number_of_peers
+FROM Hijack
+LEFT JOIN AutonomousSystem original_as
+  ON original_as.asn = Hijack.original_asn
+LEFT JOIN AutonomousSystem hj_as ON hj_as.asn = Hijack.hj_asn;
+
+CREATE VIEW IF NOT EXISTS LeakView AS
+SELECT Leak.id, Leak.start_time, Leak.prefix, Leak.original_asn,
+       COALESCE(Leak.original_as_name, original_as.name) AS original_as_name,
+       Leak.leaking_asn,
+       COALESCE(Leak.leaking_as_name, leaking_as.name) AS leaking_as_name,
+       Leak.as_path, Leak.number_of_peers
+FROM Leak
+LEFT JOIN AutonomousSystem original_as ON original_as.asn = Leak.original_asn
+LEFT JOIN AutonomousSystem leaking_as ON leaking_as.asn = Leak.leaking_asn;
+
+CREATE VIEW IF NOT EXISTS LeakerView AS
+SELECT Leaker.id, Leaker.asn,
+       COALESCE(Leaker.as_name, AutonomousSystem.name) AS as_name,
+       Leaker.leak
+FROM Leaker
+LEFT JOIN AutonomousSystem ON AutonomousSystem.asn = Leaker.asn;
@@ -0,0 +1,72 @@
+-------------------------------------------------------------------------------
+-- Upgrades of the SQLite backend
+-------------------------------------------------------------------------------
+
+-- Tables of sql/sync_state.sql and sql/negative_cache.sql, the columns and
+-- the table of sql/parser_version.sql, and the btree indexes of
+-- sql/indexes.sql (SQLite has no inet type for the prefixes). The AS names are
+-- in sql/sqlite/as_names.sql
+
+------------------------------------------------------------------------------
+-- Sync State
+-----------------------------------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS SyncState (
+  first_id INTEGER,
+  last_id INTEGER,
+
+  PRIMARY KEY (first_id)
+);
+
+------------------------------------------------------------------------------
+-- Negative Cache
+-----------------------------------------------------------------------------
+
+CREATE TABLE IF NOT EXISTS FailedEvent (
+  id INTEGER,
+  reason TEXT,
+  attempts INTEGER,
+  first_failure TIMESTAMP,
+  last_attempt TIMESTAMP,
+
+  PRIMARY KEY (id)
+);
+
+------------------------------------------------------------------------------
+-- ASNs
+-----------------------------------------------------------------------------
+
+CREATE INDEX IF NOT EXISTS outage_asn_idx ON Outage (asn);
+CREATE INDEX IF NOT EXISTS hijack_original_asn_idx ON Hijack (original_asn);
+CREATE INDEX IF NOT EXISTS hijack_hj_asn_idx ON Hijack (hj_asn);
+CREATE INDEX IF NOT EXISTS leak_original_asn_idx ON Leak (original_asn);
+CREATE INDEX IF NOT EXISTS leak_leaking_asn_idx ON Leak (leaking_asn);
+CREATE INDEX IF NOT EXISTS leaker_asn_idx ON Leaker (asn);
+CREATE INDEX IF NOT EXISTS leaker_leak_idx ON Leaker (leak);
+
+------------------------------------------------------------------------------
+-- Time windows
+-----------------------------------------------------------------------------
+
+CREATE INDEX IF NOT EXISTS outage_start_time_idx ON Outage (start_time);
+CREATE INDEX IF NOT EXISTS hijack_start_time_idx ON Hijack (start_time);
+CREATE INDEX IF NOT EXISTS leak_start_time_idx ON Leak (start_time);
+
+------------------------------------------------------------------------------
+-- Parser Version
+-----------------------------------------------------------------------------
+
+-- SQLite has no ADD COLUMN IF NOT EXISTS: SQLiteBackend.execute_script skips
+-- the columns that already exist
+
+ALTER TABLE Outage ADD COLUMN parser_version SMALLINT;
+ALTER TABLE Hijack ADD COLUMN parser_version SMALLINT;
+ALTER TABLE Leak ADD COLUMN parser_version SMALLINT;
+
+CREATE TABLE IF NOT EXISTS Reextraction (
+  id INTEGER,
+  replaced INTEGER,
+  finished TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+  PRIMARY KEY (id)
+);
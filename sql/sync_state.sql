@@ -0,0 +1,13 @@
+-------------------------------------------------------------------------------
+-- Sync State
+-------------------------------------------------------------------------------
+
+-- Ranges [first_id, last_id] of bgpstream.com event ids that have already
+-- been processed
+
+CREATE TABLE IF NOT EXISTS SyncState (
+  first_id INTEGER,
+  last_id INTEGER,
+
+  PRIMARY KEY (first_id)
+);
@@ -0,0 +1,21 @@
+-------------------------------------------------------------------------------
+-- Work Queue
+-------------------------------------------------------------------------------
+
+-- Ranges of bgpstream.com event ids shared by the backfill workers. A worker
+-- leases a pending range, or a leased one whose lease expired because its
+-- worker stopped, until 'lease_expires'. 'state' is pending, leased or done
+
+CREATE TABLE IF NOT EXISTS WorkRange (
+  first_id INTEGER,
+  last_id INTEGER,
+  state TEXT,
+  worker TEXT,
+  lease_expires TIMESTAMP WITH TIME ZONE,
+  attempts INTEGER,
+
+  PRIMARY KEY (first_id)
+);
+
+CREATE INDEX IF NOT EXISTS work_range_state_idx
+  ON WorkRange (state, first_id);
@@ -0,0 +1,289 @@
+###############################################################################
+# Imports
+
+import psycopg2  # Postgresql
+import psycopg2.extras  # Multi-row inserts
+import sqlite3  # Embedded database
+
+# General utility
+import os
+import re
+
+###############################################################################
+# SQLite adapter
+
+# Placeholders of psycopg2: %s and %(name)s
+PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s')
+
+# Number of parameters allowed in a statement by SQLite before 3.32
+SQLITE_MAX_PARAMETERS = 999
+
+
+def sqlite_query(query):
+    """ Returns: 'query' with the placeholders of sqlite3 instead of the ones
+        of psycopg2
+    """
+
+    return PLACEHOLDER.sub(
+        lambda match: ':' + match.group(1) if match.group(1) else '?', query)
+
+###############################################################################
+
+
+class SQLiteCursor():
+    """ sqlite3 cursor that accepts the queries written for psycopg2 """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, query, parameters=()):
+        self.cursor.execute(sqlite_query(query), parameters)
+
+    def executemany(self, query, parameters):
+        self.cursor.executemany(sqlite_query(query), parameters)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def close(self):
+        self.cursor.close()
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def __repr__(self):
+        return ('SQLiteCursor')
+
+
+###############################################################################
+
+
+class SQLiteConnection():
+    """ sqlite3 connection whose cursors accept the queries written for
+        psycopg2
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def cursor(self, name=None):
+        """ 'name' is accepted for psycopg2 server side cursors, whose rows are
+            fetched lazily, which sqlite3 cursors always do
+        """
+
+        return SQLiteCursor(self.connection.cursor())
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+    def __repr__(self):
+        return ('SQLiteConnection')
+
+
+###############################################################################
+
+
+def execute_values(cursor, query, values, page_size=100, fetch=False):
+    """ psycopg2.extras.execute_values for both backends: inserts 'values' with
+        multi-row statements built from 'query', whose first %s stands for the
+        rows
+        Returns: the rows returned by the statements if 'fetch'
+    """
+
+    if not isinstance(cursor, SQLiteCursor):
+        return psycopg2.extras.execute_values(cursor, query, values,
+                                              page_size=page_size,
+                                              fetch=fetch)
+
+    head, tail = query.split('%s', 1)
+    head, tail = sqlite_query(head), sqlite_query(tail)
+
+    width = len(values[0]) if values else 1
+    row = '(' + ', '.join(['?'] * width) + ')'
+    size = max(1, min(page_size, SQLITE_MAX_PARAMETERS // width))
+
+    result = []
+    for start in range(0, len(values), size):
+        page = values[start:start + size]
+        cursor.cursor.execute(head + ', '.join([row] * len(page)) + tail,
+                              [value for columns in page
+                               for value in columns])
+        if fetch:
+            result += cursor.cursor.fetchall()
+
+    return result if fetch else None
+
+###############################################################################
+# Backends
+
+
+class PostgresBackend():
+    """ Postgresql server, with every feature: rollups, partitions and the
+        index-backed lookups
+    """
+
+    name = 'postgres'
+
+    # Scripts of the tables
+    SCHEMA = 'sql/schema.sql'
+    PARTITIONED_SCHEMA = 'sql/schema_partitioned.sql'
+
+    # Idempotent scripts that create what is not in the schema, run at every
+    # start so that existing databases are upgraded
+    UPGRADE_SCRIPTS = ['sql/sync_state.sql', 'sql/negative_cache.sql',
+                       'sql/indexes.sql', 'sql/rollups.sql',
+                       'sql/as_names.sql', 'sql/work_queue.sql',
+                       'sql/parser_version.sql']
+
+    # Views read by the lookups and the exports, with what they depend on
+    VIEWS_SCRIPT = 'sql/as_names.sql'
+
+    # Raised when a table does not exist
+    MISSING_TABLE = psycopg2.ProgrammingError
+
+    # Rollups, partitions, lookups and the work queue
+    ANALYTICS = True
+
+    ###########################################################################
+
+    @staticmethod
+    def connect(name, user):
+        return psycopg2.connect("dbname='{}' user='{}' "
+                                "password='' host=''".format(name, user))
+
+    ###########################################################################
+
+    @staticmethod
+    def clear(connection):
+        """ Deletes every table of the database """
+
+        cursor = connection.cursor()
+
+        # Delete all tables (by default every table is in public)
+        cursor.execute("DROP SCHEMA IF EXISTS public CASCADE;")
+
+        # Reset the schema
+        cursor.execute('CREATE SCHEMA public;')
+
+        connection.commit()
+
+    ###########################################################################
+
+    @staticmethod
+    def execute_script(connection, script):
+        """ Executes and commits the statements of 'script' """
+
+        connection.cursor().execute(script)
+        connection.commit()
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('PostgresBackend')
+
+
+###############################################################################
+
+
+class SQLiteBackend():
+    """ Single file database for local use, without a server. Only the
+        ingestion is supported: no rollups, partitions nor prefix lookups
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = 'sql/sqlite/schema.sql'
+    PARTITIONED_SCHEMA = None
+    UPGRADE_SCRIPTS = ['sql/sqlite/upgrade.sql', 'sql/sqlite/as_names.sql']
+    VIEWS_SCRIPT = 'sql/sqlite/as_names.sql'
+    MISSING_TABLE = sqlite3.OperationalError
+    ANALYTICS = False
+
+    ###########################################################################
+
+    @staticmethod
+    def connect(name, user=None):
+        """ Opens the database file 'name', or '<name>.sqlite' if 'name' has no
+            extension
+        """
+
+        path = name if os.path.splitext(name)[1] else name + '.sqlite'
+
+        # The writer may run in another thread than the one that connected,
+        # but never in two threads at a time
+        connection = sqlite3.connect(path, check_same_thread=False,
+                                     detect_types=sqlite3.PARSE_DECLTYPES)
+
+        # Write-ahead log: readers do not block the ingestion, and a commit
+        # does not wait for the data to reach the disk
+        connection.execute('PRAGMA journal_mode = WAL;')
+        connection.execute('PRAGMA synchronous = NORMAL;')
+        connection.execute('PRAGMA foreign_keys = ON;')
+
+        return SQLiteConnection(connection)
+
+    ###########################################################################
+
+    @staticmethod
+    def clear(connection):
+        """ Deletes every table and view of the database """
+
+        cursor = connection.cursor()
+        cursor.execute("SELECT type, name FROM sqlite_master "
+                       "WHERE type IN ('table', 'view') "
+                       "AND name NOT LIKE 'sqlite_%';")
+        objects = cursor.fetchall()
+
+        script = 'PRAGMA foreign_keys = OFF;\n'
+        script += ''.join('DROP {} {};\n'.format(type.upper(), name)
+                          for type, name in objects)
+        script += 'PRAGMA foreign_keys = ON;\n'
+        connection.connection.executescript(script)
+
+    ###########################################################################
+
+    @staticmethod
+    def execute_script(connection, script):
+        """ Executes and commits the statements of 'script' one at a time.
+            SQLite has no ADD COLUMN IF NOT EXISTS: the statements that add a
+            column that exists are skipped
+        """
+
+        for statement in script.split(';\n'):
+            try:
+                connection.connection.execute(statement)
+            except sqlite3.OperationalError as error:
+                if not str(error).startswith('duplicate column name'):
+                    raise
+
+        connection.commit()
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('SQLiteBackend')
+
+
+###############################################################################
+
+# Backends by name
+BACKENDS = {
+    'postgres': PostgresBackend,
+    'sqlite': SQLiteBackend,
+}
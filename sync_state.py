@@ -0,0 +1,219 @@
+###############################################################################
+# Imports
+
+import bisect   # Sorted ranges
+from storage import execute_values  # Multi-row inserts
+
+###############################################################################
+# Run-length set
+
+
+class IdSet():
+    """ Set of integers stored as sorted, disjoint and non-adjacent ranges
+        [first, last]. Consecutive event ids only cost one range.
+    """
+
+    def __init__(self, ranges=()):
+        self.firsts = []
+        self.lasts = []
+
+        for first, last in ranges:
+            self.add_range(first, last)
+
+    ###########################################################################
+
+    def add(self, id):
+        """ Adds 'id' to the set """
+
+        self.add_range(id, id)
+
+    ###########################################################################
+
+    def add_range(self, first, last):
+        """ Adds every id from 'first' to 'last' (included), merging the
+            ranges that overlap or touch it
+        """
+
+        # Ranges that end right before 'first' or later, and that start right
+        # after 'last' or earlier, are merged
+        start = bisect.bisect_left(self.lasts, first - 1)
+        stop = bisect.bisect_right(self.firsts, last + 1)
+
+        if start < stop:
+            first = min(first, self.firsts[start])
+            last = max(last, self.lasts[stop - 1])
+
+        self.firsts[start:stop] = [first]
+        self.lasts[start:stop] = [last]
+
+    ###########################################################################
+
+    def __contains__(self, id):
+        index = bisect.bisect_right(self.firsts, id) - 1
+        return index >= 0 and self.lasts[index] >= id
+
+    ###########################################################################
+
+    def __len__(self):
+        return sum(last - first + 1
+                   for first, last in zip(self.firsts, self.lasts))
+
+    ###########################################################################
+
+    def ranges(self, low=None, high=None):
+        """ Returns: the list of (first, last) ranges that intersect
+            [low, high], or every range
+        """
+
+        start = 0 if low is None else bisect.bisect_left(self.lasts, low)
+        stop = (len(self.firsts) if high is None
+                else bisect.bisect_right(self.firsts, high))
+
+        return list(zip(self.firsts[start:stop], self.lasts[start:stop]))
+
+    ###########################################################################
+
+    def missing(self, low, high):
+        """ Yields the ids from 'high' down to 'low' that are not in the set
+        """
+
+        id = high
+        index = bisect.bisect_right(self.firsts, id) - 1
+
+        while id >= low:
+            if index >= 0 and self.lasts[index] >= id:
+                # Jump over the range that contains 'id'
+                id = self.firsts[index] - 1
+                index -= 1
+            else:
+                yield id
+                id -= 1
+
+    ###########################################################################
+
+    def max(self):
+        """ Returns: the highest id of the set or 0 """
+
+        return self.lasts[-1] if self.lasts else 0
+
+    ###########################################################################
+
+    def difference(self, other):
+        """ Returns: the list of (first, last) ranges of the ids of this set
+            that are not in the IdSet 'other'
+        """
+
+        ranges = []
+        for first, last in self.ranges():
+            for other_first, other_last in other.ranges(first, last):
+                if other_first > first:
+                    ranges.append((first, other_first - 1))
+                first = other_last + 1
+            if first <= last:
+                ranges.append((first, last))
+
+        return ranges
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('IdSet({})'.format(self.ranges()))
+
+
+###############################################################################
+# Sync state
+
+
+class SyncState():
+    """ Keeps track of the bgpstream.com events that have already been
+        processed. The ids are stored as ranges in the SyncState table, and
+        are saved in the same transaction as the rows of the events.
+    """
+
+    # Tables whose id is the bgpstream.com event number
+    EVENT_TABLES = ('Outage', 'Hijack', 'Leak')
+
+    def __init__(self, connection):
+        self.connection = connection
+
+        cursor = connection.cursor()
+        cursor.execute('SELECT first_id, last_id FROM SyncState;')
+        self.ids = IdSet(cursor.fetchall())
+
+        # Databases filled before the sync state existed: every stored event
+        # has been processed
+        if not self.ids.ranges():
+            for table_name in self.EVENT_TABLES:
+                cursor.execute('SELECT id FROM {};'.format(table_name))
+                for id, in cursor.fetchall():
+                    self.ids.add(id)
+
+            self.low, self.high = 1, self.ids.max()
+            self.save(cursor)
+            connection.commit()
+
+        # Span of the ids added since the last save, or None
+        self.low = self.high = None
+
+    ###########################################################################
+
+    def add(self, event_number):
+        """ Marks 'event_number' as processed """
+
+        self.ids.add(event_number)
+
+        self.low = (event_number if self.low is None
+                    else min(self.low, event_number))
+        self.high = (event_number if self.high is None
+                     else max(self.high, event_number))
+
+    ###########################################################################
+
+    def missing(self, low, high):
+        """ Yields the event numbers from 'high' down to 'low' that have never
+            been processed
+        """
+
+        return self.ids.missing(low, high)
+
+    ###########################################################################
+
+    def max(self):
+        """ Returns: the highest processed event number or 0 """
+
+        return self.ids.max()
+
+    ###########################################################################
+
+    def save(self, cursor):
+        """ Writes the ranges that changed since the last save. Meant to be
+            called right before the commit of the rows of the events
+        """
+
+        if self.low is None:
+            return
+
+        # The ranges of the table that touch the new ids are replaced by the
+        # merged ranges, including the ones saved by other processes since
+        # this one started
+        low, high = self.low - 1, self.high + 1
+        cursor.execute('SELECT first_id, last_id FROM SyncState '
+                       'WHERE last_id >= %s AND first_id <= %s;', (low, high))
+        for first_id, last_id in cursor.fetchall():
+            self.ids.add_range(first_id, last_id)
+
+        cursor.execute('DELETE FROM SyncState '
+                       'WHERE last_id >= %s AND first_id <= %s;', (low, high))
+
+        ranges = self.ids.ranges(low, high)
+        if ranges:
+            execute_values(
+                cursor, 'INSERT INTO SyncState (first_id, last_id) VALUES %s',
+                ranges)
+
+        self.low = self.high = None
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('SyncState')
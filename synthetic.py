@@ -0,0 +1,498 @@
+#!/usr/bin/python3.5
+
+###############################################################################
+# Imports
+
+import argparse  # Argument parsing
+
+# Local stand-in of bgpstream.com
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import threading
+
+# Page cache backends
+from page_cache import open_cache
+
+# General utility
+import datetime
+import gzip
+import random
+import sys
+import time
+
+###############################################################################
+# Page templates
+
+# The parser recognizes the type of a page from the words 'outage', 'hijack'
+# and 'Leak', which are left out of everything but the event description
+PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<link rel="stylesheet" href="/static/css/bootstrap.min.css">
+<script src="/static/js/jquery.min.js"></script>
+</head>
+<body>
+<nav class="navbar navbar-default">
+{navigation}
+</nav>
+<div class="container">
+<table class="table">
+<tr><td>
+{description}
+</td></tr>
+</table>
+</div>
+<footer>
+{footer}
+</footer>
+</body>
+</html>
+"""
+
+OUTAGE = """<h3>BGP, {title} outage</h3>
+<p>Start time: {start_time} UTC</p>
+<p>End time: {end_time} UTC</p>
+<p>Over the last few minutes we detected an outage for {subject}
+affecting the reachability of its networks.</p>
+<p>Number of Prefixes Affected: {prefixes} ({percentage}%)</p>"""
+
+HIJACK = """<h3>Possible BGP hijack</h3>
+<p>Start time: {start_time} UTC</p>
+<p>Expected prefix: <b>{prefix}</b></p>
+<p>Expected ASN: {asn} ({name})</p>
+<p>But beginning at {hj_time} UTC,</p>
+<p>Detected advertisement: <b>{hj_prefix}</b></p>
+<p>Detected Origin ASN {hj_asn} ({hj_name})</p>
+<p>Detected AS Path {path}</p>
+<p>Detected by number of BGPMon peers: {peers}</p>"""
+
+LEAK = """<h3>BGP Leak</h3>
+<p>Start time: {start_time} UTC</p>
+<p>Leaked prefix: {prefix} (AS{asn} {name})</p>
+<p>Leaked by: AS{leaking_asn} <a href="#">{leaking_name}</a></p>
+<p>Example AS path: {path} </p>
+<p>Number of BGPMon peers that saw it: <b>{peers}</b></p>
+<p>Leaked To:<ul>
+{leakers}
+</ul>"""
+
+# Building blocks of the AS names. No 'AS' and no parenthesis: the parser
+# splits on them
+NAME_WORDS = ('Alpha', 'Blue', 'Carrier', 'Data', 'Euro', 'Fiber', 'Global',
+              'Hosting', 'Internet', 'Metro', 'Net', 'Online', 'Pacific',
+              'Telecom', 'Union', 'Wave')
+NAME_SUFFIXES = ('Inc', 'Ltd', 'LLC', 'GmbH', 'Networks', 'Communications')
+COUNTRIES = ('Venezuela', 'Iraq', 'Syria', 'Sudan', 'Gabon', 'Ethiopia',
+             'Cameroon', 'Togo')
+
+###############################################################################
+# Page generator
+
+
+class PageGenerator():
+    """ Generates the event pages 1 to 'last_event' in the format of
+        bgpstream.com. A page only depends on 'seed' and its event number, so
+        the same page can be generated again by another process
+    """
+
+    # Type of the events, with their share of the events
+    TYPES = (('Outage', 0.6), ('Hijack', 0.25), ('Leak', 0.15))
+
+    def __init__(self, last_event=10000, seed=0, max_leakers=50,
+                 missing=0.02, padding=200):
+        """ 'max_leakers' is the typical maximum number of ASes a leak
+            propagates to, one leak in twenty has up to ten times more.
+            A share 'missing' of the events do not exist, and every page has
+            'padding' lines of markup around the description
+        """
+
+        self.last_event = last_event
+        self.seed = seed
+        self.max_leakers = max_leakers
+        self.missing = missing
+        self.padding = padding
+
+    ###########################################################################
+
+    def random(self, event_number):
+        """ Returns: the random generator of an event """
+
+        return random.Random(self.seed * 1000003 + event_number)
+
+    ###########################################################################
+
+    def event_type(self, event_number):
+        """ Returns: the type of an event, or None if it does not exist """
+
+        if not 1 <= event_number <= self.last_event:
+            return None
+
+        rng = self.random(event_number)
+        if rng.random() < self.missing:
+            return None
+
+        draw = rng.random()
+        for type, share in self.TYPES:
+            if draw < share:
+                return type
+            draw -= share
+
+        return self.TYPES[-1][0]
+
+    ###########################################################################
+
+    def page(self, event_number):
+        """ Returns: the html page of an event, or None if it does not exist
+        """
+
+        type = self.event_type(event_number)
+        if type is None:
+            return None
+
+        # Consume the same draws as event_type
+        rng = self.random(event_number)
+        rng.random()
+        rng.random()
+
+        description = getattr(self, type.lower())(rng)
+        navigation = '\n'.join(
+            '<li class="nav-item"><a href="/page/{0}">Menu entry {0}</a></li>'
+            .format(line) for line in range(self.padding // 2))
+        footer = '\n'.join(
+            '<div class="row">Footer line {}</div>'.format(line)
+            for line in range(self.padding - self.padding // 2))
+
+        return PAGE.format(title='BGPStream event #{}'.format(event_number),
+                           navigation=navigation, description=description,
+                           footer=footer)
+
+    ###########################################################################
+
+    @staticmethod
+    def start_time(rng):
+        """ Returns: a start time between 2015 and 2019 """
+
+        return datetime.datetime(2015, 1, 1) + datetime.timedelta(
+            seconds=rng.randrange(5 * 365 * 24 * 3600))
+
+    ###########################################################################
+
+    @staticmethod
+    def asn(rng):
+        return rng.randrange(1, 400000)
+
+    ###########################################################################
+
+    @staticmethod
+    def name(rng):
+        return '{} {} {}'.format(rng.choice(NAME_WORDS),
+                                 rng.choice(NAME_WORDS),
+                                 rng.choice(NAME_SUFFIXES))
+
+    ###########################################################################
+
+    @staticmethod
+    def prefix(rng):
+        """ Returns: an IPv4 prefix, or an IPv6 one one time out of ten """
+
+        if rng.random() < 0.1:
+            return '2001:db8:{:x}::/48'.format(rng.randrange(1 << 16))
+
+        length = rng.randrange(16, 25)
+        address = rng.randrange(1 << 32) >> (32 - length) << (32 - length)
+
+        return '{}.{}.{}.{}/{}'.format(address >> 24, address >> 16 & 255,
+                                       address >> 8 & 255, address & 255,
+                                       length)
+
+    ###########################################################################
+
+    @staticmethod
+    def more_specific(prefix):
+        """ Returns: the first half of 'prefix' """
+
+        address, length = prefix.split('/')
+        return '{}/{}'.format(address, int(length) + 1)
+
+    ###########################################################################
+
+    def path(self, rng, *ending):
+        return ' '.join(str(asn) for asn in
+                        [self.asn(rng) for _ in range(rng.randrange(1, 5))] +
+                        list(ending))
+
+    ###########################################################################
+
+    def outage(self, rng):
+        start = self.start_time(rng)
+        end = start + datetime.timedelta(seconds=rng.randrange(300, 86400))
+
+        # Outages are announced either for an AS or for a whole country
+        if rng.random() < 0.8:
+            asn, name = self.asn(rng), self.name(rng)
+            title = 'AS{} ({})'.format(asn, name)
+            subject = 'ASN {} ({})'.format(asn, name)
+        else:
+            title = subject = rng.choice(COUNTRIES)
+
+        return OUTAGE.format(title=title, subject=subject,
+                             start_time=start, end_time=end,
+                             prefixes=rng.randrange(1, 2000),
+                             percentage=rng.randrange(1, 101))
+
+    ###########################################################################
+
+    def hijack(self, rng):
+        start = self.start_time(rng)
+        prefix = self.prefix(rng)
+        hj_asn = self.asn(rng)
+
+        return HIJACK.format(start_time=start, prefix=prefix,
+                             asn=self.asn(rng), name=self.name(rng),
+                             hj_time=start, hj_prefix=self.more_specific(prefix),
+                             hj_asn=hj_asn, hj_name=self.name(rng),
+                             path=self.path(rng, hj_asn),
+                             peers=rng.randrange(1, 300))
+
+    ###########################################################################
+
+    def leak(self, rng):
+        asn = self.asn(rng)
+        leaking_asn = self.asn(rng)
+
+        maximum = self.max_leakers
+        if rng.random() < 0.05:
+            maximum *= 10
+        leakers = '\n'.join('<li>{} ({})</li>'.format(self.asn(rng),
+                                                      self.name(rng))
+                            for _ in range(rng.randrange(1, maximum + 1)))
+
+        return LEAK.format(start_time=self.start_time(rng),
+                           prefix=self.prefix(rng), asn=asn,
+                           name=self.name(rng), leaking_asn=leaking_asn,
+                           leaking_name=self.name(rng),
+                           path=self.path(rng, leaking_asn, asn),
+                           peers=rng.randrange(1, 300), leakers=leakers)
+
+    ###########################################################################
+
+    def fill_cache(self, cache, event_numbers=None):
+        """ Stores the pages of 'event_numbers' (every event by default) in
+            'cache'
+            Returns: the number of pages stored
+        """
+
+        if event_numbers is None:
+            event_numbers = range(1, self.last_event + 1)
+
+        count = 0
+        for event_number in event_numbers:
+            page = self.page(event_number)
+            if page is not None:
+                cache.put(event_number, page)
+                count += 1
+
+        return count
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('PageGenerator({}, seed={})'.format(self.last_event,
+                                                    self.seed))
+
+
+###############################################################################
+# Local server
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """ Answers /event/<number> like bgpstream.com: 200 with the page, or 500
+        if the event does not exist
+    """
+
+    # Keep-alive connections like a real web server. Without TCP_NODELAY the
+    # body, written after the headers, waits for the delayed ACK of the client
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def page(self):
+        """ Returns: the status code and the body of the requested page """
+
+        parts = self.path.rstrip('/').split('/')
+        if len(parts) != 3 or parts[1] != 'event' or not parts[2].isdigit():
+            return 404, b''
+
+        event_number = int(parts[2])
+        self.server.requested(event_number)
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        page = self.server.generator.page(event_number)
+        if page is None:
+            return 500, b''
+
+        return 200, page.encode('utf-8')
+
+    ###########################################################################
+
+    def respond(self, body):
+        status, page = self.page()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        if self.server.compress and page and \
+                'gzip' in self.headers.get('Accept-Encoding', ''):
+            page = gzip.compress(page)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(page)))
+        self.end_headers()
+
+        if body:
+            self.wfile.write(page)
+
+    ###########################################################################
+
+    def do_GET(self):
+        self.respond(True)
+
+    ###########################################################################
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    ###########################################################################
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+###############################################################################
+
+
+class PageServer(ThreadingMixIn, HTTPServer):
+    """ Serves the pages of 'generator' on a local port, each request being
+        answered after 'delay' seconds, gzip compressed with 'compress' when
+        the client accepts it. Replaces bgpstream.com in the benchmarks:
+        PageFetcher(url=server.url)
+    """
+
+    daemon_threads = True
+
+    def __init__(self, generator, host='127.0.0.1', port=0, delay=0.0,
+                 verbose=False, compress=False):
+        super().__init__((host, port), PageHandler)
+        self.generator = generator
+        self.delay = delay
+        self.verbose = verbose
+        self.compress = compress
+
+        # Time at which each event was first requested
+        self.lock = threading.Lock()
+        self.first_request = {}
+
+    ###########################################################################
+
+    @property
+    def url(self):
+        return 'http://{}:{}/event/'.format(*self.server_address[:2])
+
+    ###########################################################################
+
+    def requested(self, event_number):
+        with self.lock:
+            self.first_request.setdefault(event_number, time.perf_counter())
+
+    ###########################################################################
+
+    def start(self):
+        """ Serves in a background thread
+            Returns: the server
+        """
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    ###########################################################################
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('PageServer({!r})'.format(self.url))
+
+
+###############################################################################
+# Argument Parsing
+
+
+def get_parser():
+    # Get parser for command line arguments
+    parser = argparse.ArgumentParser(
+        description="Synthetic bgpstream.com event pages"
+    )
+    parser.add_argument('-n', '--events', action='store', default=10000,
+                        type=int, help='number of the last event. '
+                        'default=10000')
+    parser.add_argument('--seed', action='store', default=0, type=int,
+                        help='seed of the pages. default=0')
+    parser.add_argument('--max-leakers', action='store', default=50,
+                        type=int, help='typical maximum number of leakers '
+                        'of a leak. default=50')
+    subparsers = parser.add_subparsers(dest='command')
+
+    serve = subparsers.add_parser('serve', help='serve the pages over HTTP '
+                                  'at http://<host>:<port>/event/<number>')
+    serve.add_argument('--host', action='store', default='127.0.0.1',
+                       help='address to listen on. default=127.0.0.1')
+    serve.add_argument('--port', action='store', default=8080, type=int,
+                       help='port to listen on. default=8080')
+    serve.add_argument('--delay', action='store', default=0, type=float,
+                       help='seconds before answering a request. default=0')
+    serve.add_argument('--gzip', action='store_true',
+                       help='compress the pages for the clients that accept '
+                       'it')
+    serve.add_argument('-v', '--verbose', action='store_true',
+                       help='log every request')
+
+    write = subparsers.add_parser('write', help='store the pages in a page '
+                                  'cache')
+    write.add_argument('--cache', action='store', default='files',
+                       choices=['files', 'segments'],
+                       help='page cache backend. default=files')
+    write.add_argument('--cache-dir', action='store', default='html',
+                       help='directory of the page cache. default=html')
+
+    return parser
+
+
+###############################################################################
+
+if __name__ == "__main__":
+    # Create a parser
+    parser = get_parser()
+
+    # Parse arguments
+    args = parser.parse_args()
+    generator = PageGenerator(args.events, args.seed, args.max_leakers)
+
+    if args.command == 'serve':
+        server = PageServer(generator, args.host, args.port, args.delay,
+                            args.verbose, args.gzip)
+        print('Serving events 1 to {} at {}'.format(args.events, server.url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+    elif args.command == 'write':
+        cache = open_cache(args.cache, args.cache_dir)
+        print('Stored {} pages'.format(generator.fill_cache(cache)))
+        cache.close()
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,227 @@
+###############################################################################
+# Imports
+
+from storage import execute_values  # Multi-row inserts
+
+# General utility
+import contextlib
+import os
+import socket
+
+###############################################################################
+# Work queue
+
+# Key of the advisory lock that serializes the bookkeeping of the workers
+BOOKKEEPING_LOCK = 0x6267707374
+
+# Key of the advisory lock of the workers that create the tables. Not the
+# bookkeeping lock: the tables wait for the transactions of the running
+# workers, which take the bookkeeping lock before they commit
+PREPARE_LOCK = 0x6267707363
+
+# The latest pending range, or a range whose worker stopped renewing its lease
+LEASE = """
+UPDATE WorkRange SET state = 'leased', worker = %(worker)s,
+  lease_expires = now() + %(seconds)s * interval '1 second',
+  attempts = attempts + 1
+WHERE first_id = (
+  SELECT first_id FROM WorkRange
+  WHERE state = 'pending' OR (state = 'leased' AND lease_expires < now())
+  ORDER BY first_id DESC LIMIT 1
+  FOR UPDATE SKIP LOCKED)
+RETURNING first_id, last_id;
+"""
+
+
+def worker_name():
+    """ Returns: a name that identifies this process among the workers """
+
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+###############################################################################
+
+
+class WorkQueue():
+    """ Ranges of event ids shared by the backfill workers of any number of
+        processes and hosts, in the WorkRange table. A worker leases a range
+        for 'lease_seconds', renewed at every write, so that the range goes
+        back to the other workers if it stops.
+    """
+
+    def __init__(self, connection, worker=None, lease_seconds=300):
+        self.connection = connection
+        self.worker = worker or worker_name()
+        self.lease_seconds = lease_seconds
+
+        # First id of the range being processed, or None
+        self.current = None
+
+    ###########################################################################
+
+    def enqueue(self, ranges):
+        """ Adds the (first_id, last_id) 'ranges' to the queue. A range that
+            is already done is queued again, and a range that is still
+            queued is extended to 'last_id'
+            Returns: the number of queued ranges
+        """
+
+        if not ranges:
+            return 0
+
+        cursor = self.connection.cursor()
+        execute_values(
+            cursor,
+            'INSERT INTO WorkRange (first_id, last_id, state, attempts) '
+            'VALUES %s ON CONFLICT (first_id) DO UPDATE '
+            'SET last_id = GREATEST(WorkRange.last_id, EXCLUDED.last_id), '
+            "state = CASE WHEN WorkRange.state = 'done' THEN 'pending' "
+            'ELSE WorkRange.state END',
+            [(first_id, last_id, 'pending', 0)
+             for first_id, last_id in ranges])
+        self.connection.commit()
+
+        return len(ranges)
+
+    ###########################################################################
+
+    def lease(self):
+        """ Leases the next range to process
+            Returns: (first_id, last_id), or None if there is nothing left
+        """
+
+        cursor = self.connection.cursor()
+        cursor.execute(LEASE, {'worker': self.worker,
+                               'seconds': self.lease_seconds})
+        row = cursor.fetchone()
+        self.connection.commit()
+
+        self.current = row[0] if row is not None else None
+
+        return row
+
+    ###########################################################################
+
+    def leases(self):
+        """ Yields the ranges leased one after the other until the queue is
+            empty. A range is done once the consumer asks for the next one
+        """
+
+        while True:
+            work = self.lease()
+            if work is None:
+                return
+
+            yield work
+            self.complete()
+
+    ###########################################################################
+
+    def complete(self):
+        """ Marks the current range as done """
+
+        cursor = self.connection.cursor()
+        cursor.execute("UPDATE WorkRange SET state = 'done', "
+                       'lease_expires = NULL '
+                       'WHERE first_id = %s AND worker = %s;',
+                       (self.current, self.worker))
+        self.connection.commit()
+
+        self.current = None
+
+    ###########################################################################
+
+    def save(self, cursor):
+        """ Serializes the bookkeeping of the workers, which merges the sync
+            state and adds to the rollups, and renews the lease. Meant to be
+            called before the other hooks, right before the commit
+        """
+
+        cursor.execute('SELECT pg_advisory_xact_lock(%s);',
+                       (BOOKKEEPING_LOCK,))
+
+        if self.current is None:
+            return
+
+        cursor.execute('UPDATE WorkRange '
+                       "SET lease_expires = now() + %s * interval '1 second' "
+                       'WHERE first_id = %s AND worker = %s;',
+                       (self.lease_seconds, self.current, self.worker))
+        if cursor.rowcount == 0:
+            print('The lease of the range {} was taken over by another '
+                  'worker'.format(self.current))
+
+    ###########################################################################
+
+    @contextlib.contextmanager
+    def locked(self, key):
+        """ Runs the 'with' block while holding the advisory lock 'key' """
+
+        cursor = self.connection.cursor()
+        cursor.execute('SELECT pg_advisory_lock(%s);', (key,))
+        try:
+            yield
+        finally:
+            cursor.execute('SELECT pg_advisory_unlock(%s);', (key,))
+            self.connection.commit()
+
+    ###########################################################################
+
+    def preparing(self):
+        """ Runs the 'with' block while no other worker creates tables, so
+            that the workers that start together create them once
+        """
+
+        return self.locked(PREPARE_LOCK)
+
+    ###########################################################################
+
+    def exclusive(self):
+        """ Runs the 'with' block while no other worker writes, i.e. to
+            create the rollups once when the workers start together. The
+            block must not create tables (see preparing)
+        """
+
+        return self.locked(BOOKKEEPING_LOCK)
+
+    ###########################################################################
+
+    def attach(self, writer):
+        """ Renews the lease at every write of the BulkWriter 'writer', in
+            the same transaction as the rows
+        """
+
+        writer.hooks.insert(0, self.save)
+
+    ###########################################################################
+
+    def status(self):
+        """ Returns: {state: (number of ranges, number of event ids)} """
+
+        cursor = self.connection.cursor()
+        cursor.execute('SELECT state, count(*), sum(last_id - first_id + 1) '
+                       'FROM WorkRange GROUP BY state ORDER BY state;')
+        status = {state: (ranges, ids)
+                  for state, ranges, ids in cursor.fetchall()}
+        self.connection.rollback()
+
+        return status
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('WorkQueue({})'.format(self.worker))
+
+
+###############################################################################
+
+
+def split_ranges(low, high, size=1000):
+    """ Returns: the ranges of 'size' ids that cover 'low' to 'high', aligned
+        on multiples of 'size' so that they are the same from one call to
+        the next
+    """
+
+    first = (low - 1) // size * size + 1
+
+    return [(max(start, low), min(start + size - 1, high))
+            for start in range(first, high + 1, size)]
@@ -0,0 +1,273 @@
+###############################################################################
+# Imports
+
+from storage import execute_values  # Multi-row inserts
+
+# Run statistics
+from metrics import METRICS
+
+# General utility
+import sys
+import time
+
+###############################################################################
+# Bulk writer
+
+
+class BulkWriter():
+    """ Buffers the rows extracted from the event pages and writes them with
+        one multi-row parameterized INSERT per table and per batch, followed
+        by a single commit
+    """
+
+    # Tables in the order in which they are flushed (Leaker references Leak)
+    TABLES = ('Outage', 'Hijack', 'Leak', 'Leaker')
+
+    # Tables whose id is the bgpstream.com event number. Inserting an event
+    # that is already stored is a no-op.
+    EVENT_TABLES = ('Outage', 'Hijack', 'Leak')
+
+    # Tables whose rows belong to an event: {table_name: (column, event
+    # table)}. They are only inserted with their event, otherwise saving an
+    # event again would duplicate them
+    CHILD_TABLES = {'Leaker': ('leak', 'Leak')}
+
+    def __init__(self, connection, batch_size=500, flush_interval=5.0,
+                 debug=False, state=None, failures=None, partitions=None,
+                 replace=False):
+        """ The buffered rows are flushed every 'batch_size' events or every
+            'flush_interval' seconds, whichever comes first. The events saved
+            with save_event are marked as processed in the SyncState 'state'
+            or as failed in the NegativeCache 'failures', in the same
+            transaction as their rows. With 'partitions', the rows of the
+            event tables are written to their monthly partition. With
+            'replace', the stored rows of the events are deleted before their
+            new rows are inserted
+        """
+
+        self.connection = connection
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.debug = debug
+        self.partitions = partitions
+        self.replace = replace
+
+        # AsNames that stores the AS names of the rows, see AsNames.attach
+        self.names = None
+
+        # Rows waiting to be written: {table_name: [columns, ...]}
+        self.rows = {table: [] for table in self.TABLES}
+
+        # Ids of the events actually inserted by the current flush, for the
+        # hooks: {table_name: [id, ...]}
+        self.inserted = {table: [] for table in self.EVENT_TABLES}
+        self.events = 0
+        self.last_flush = time.monotonic()
+
+        # Functions called with the cursor right before every commit, to
+        # write data that must be consistent with the rows
+        self.hooks = []
+
+        self.state = state
+        self.failures = failures
+        for bookkeeping in (state, failures):
+            if bookkeeping is not None:
+                self.hooks.append(bookkeeping.save)
+
+        # Statistics
+        self.total_rows = 0
+        self.total_time = 0.0
+
+    ###########################################################################
+
+    def add(self, table_name, columns):
+        """ Buffers a row. 'columns' is a dictionary {column_name: value}
+            Returns: False if 'table_name' is not a known table, else True
+        """
+
+        if table_name not in self.rows:
+            print('Skipping row for unknown table {!r}: {}'.format(
+                table_name, columns), file=sys.stderr)
+            return False
+
+        # The caller may reuse 'columns' for the next row
+        self.rows[table_name].append(dict(columns))
+        return True
+
+    ###########################################################################
+
+    def save_event(self, event_number, rows, reason=None):
+        """ Buffers the (type, columns) 'rows' of an event, or records why the
+            event could not be used if 'rows' is None
+        """
+
+        if rows is None:
+            METRICS.count('failed_events')
+            if self.failures is not None:
+                self.failures.fail(event_number, reason)
+        else:
+            METRICS.count('saved_events')
+            for table_name, columns in rows:
+                self.add(table_name, columns)
+            if self.state is not None:
+                self.state.add(event_number)
+            if self.failures is not None:
+                self.failures.succeed(event_number)
+
+        self.event_done()
+
+    ###########################################################################
+
+    def event_done(self):
+        """ Signals that every row of an event has been added. Flushes the
+            buffer if the batch is full or if it is too old
+        """
+
+        self.events += 1
+
+        if (self.events >= self.batch_size or
+                time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    ###########################################################################
+
+    def flush(self):
+        """ Writes every buffered row and commits
+            Returns: the number of rows written
+        """
+
+        start = time.monotonic()
+        cursor = self.connection.cursor()
+        count = 0
+        self.inserted = {table: [] for table in self.EVENT_TABLES}
+
+        if self.replace:
+            self.delete(cursor, [columns['id']
+                                 for table_name in self.EVENT_TABLES
+                                 for columns in self.rows[table_name]])
+
+        # The new ASes of every table are stored at once, before the rows
+        if self.names is not None:
+            self.names.strip(cursor, self.rows)
+
+        for table_name in self.TABLES:
+            rows = self.rows[table_name]
+            self.rows[table_name] = []
+
+            if table_name in self.CHILD_TABLES:
+                column, event_table = self.CHILD_TABLES[table_name]
+                inserted = set(self.inserted[event_table])
+                rows = [columns for columns in rows
+                        if columns.get(column) in inserted]
+
+            if not rows:
+                continue
+
+            if self.partitions is not None and \
+                    table_name in self.EVENT_TABLES:
+                targets = self.partitions.route(cursor, table_name, rows)
+            else:
+                targets = {table_name: rows}
+
+            # Rows of the same table may not all have the same columns (a
+            # field can be missing from a page), so they are grouped by keys
+            for target, target_rows in targets.items():
+                groups = {}
+                for columns in target_rows:
+                    groups.setdefault(tuple(columns), []).append(columns)
+
+                for keys, group in groups.items():
+                    self.insert(cursor, table_name, keys,
+                                [tuple(columns[key] for key in keys)
+                                 for columns in group], target)
+
+            count += len(rows)
+
+        for hook in self.hooks:
+            with METRICS.timer('hook_seconds', hook=hook.__qualname__):
+                hook(cursor)
+
+        with METRICS.timer('commit_seconds'):
+            self.connection.commit()
+
+        # Update statistics
+        elapsed = time.monotonic() - start
+        self.total_rows += count
+        self.total_time += elapsed
+        self.events = 0
+        self.last_flush = time.monotonic()
+
+        if self.debug and count:
+            print('Flushed {} rows in {:.3f}s ({:.0f} rows/s)'.format(
+                count, elapsed, count / elapsed if elapsed else 0))
+
+        return count
+
+    ###########################################################################
+
+    def delete(self, cursor, event_numbers):
+        """ Deletes every stored row of the events 'event_numbers', whatever
+            their type
+        """
+
+        if not event_numbers:
+            return
+
+        values = [(event_number,) for event_number in event_numbers]
+        for table_name, (column, _) in self.CHILD_TABLES.items():
+            execute_values(cursor, 'DELETE FROM {} WHERE {} IN (VALUES %s)'
+                           .format(table_name, column), values)
+        for table_name in self.EVENT_TABLES:
+            execute_values(cursor, 'DELETE FROM {} WHERE id IN (VALUES %s)'
+                           .format(table_name), values)
+
+    ###########################################################################
+
+    def insert(self, cursor, table_name, keys, values, target=None):
+        """ Inserts 'values', a list of tuples ordered like 'keys', into
+            'table_name', or into its partition 'target', with a single
+            statement. The ids of the events that were not already stored are
+            added to self.inserted
+        """
+
+        event = table_name in self.EVENT_TABLES
+        query = 'INSERT INTO {} ({}) VALUES %s{}'.format(
+            target or table_name, ', '.join(keys),
+            ' ON CONFLICT DO NOTHING RETURNING id' if event else '')
+
+        if self.debug:
+            print('{} ({} rows)'.format(query, len(values)))
+
+        with METRICS.timer('insert_seconds', table=table_name):
+            ids = execute_values(cursor, query, values,
+                                 page_size=len(values), fetch=event)
+        METRICS.count('rows', len(values), table=table_name)
+        if event:
+            self.inserted[table_name] += [id for id, in ids]
+
+    ###########################################################################
+
+    def close(self):
+        """ Flushes the remaining rows """
+
+        self.flush()
+
+    ###########################################################################
+
+    def rows_per_second(self):
+        """ Returns: the average write throughput since the writer exists """
+
+        return self.total_rows / self.total_time if self.total_time else 0.0
+
+    ###########################################################################
+
+    def report(self):
+        """ Returns: a one-line summary of the write throughput """
+
+        return 'Wrote {} rows in {:.3f}s ({:.0f} rows/s)'.format(
+            self.total_rows, self.total_time, self.rows_per_second())
+
+    ###########################################################################
+
+    def __repr__(self):
+        return ('BulkWriter')